@@ -6,6 +6,8 @@ import numpy as np
 import itertools
 import math
 import logging
+import scene_metrics
+import planner_trace
 
 PICK_HEIGHT = 2
 MAX_TRIALS = 100  # Max number of times to try to find a good op that works
@@ -52,9 +54,11 @@ def random_objects_movements(
     while cur_frame <= total_frames - MOVEMENT_MAX:
         ops = [add_movements_multiObj_try, add_movements_singleObj]
         op = random.choice(ops)
+        planner_trace.start_segment(op.__name__, cur_frame)
         end_frame = op(
             objects, cur_frame, all_obj_locations, min_dist, total_frames,
             record, max_motions=max_motions)
+        planner_trace.end_segment(end_frame)
         cur_frame = end_frame + 1
         # Round to next 30 frames
         cur_frame = math.ceil(cur_frame / 30) * 30
@@ -89,6 +93,7 @@ def add_movements_multiObj_try(objects, start_frame, all_obj_locations,
         frames_this_move = random.randint(MOVEMENT_MIN, MOVEMENT_MAX)
         new_start_frame = start_frame + random.randint(0, 5)
         new_end_frame = min(new_start_frame + frames_this_move, total_frames)
+        planner_trace.candidate()
         if not _can_contain(objects[i1], objects[i2],
                             # other objects, to check collisions
                             [el for i, el in enumerate(objects)
@@ -148,6 +153,7 @@ def add_movements_multiObj_try(objects, start_frame, all_obj_locations,
                 '{} vs {}'.format(len(objects[i]), len(all_obj_locations[i]))
         assert_no_collisions(all_obj_locations, objects, min_dist, record)
         return max(new_end_frame, new_end_frame_singleObjMotion)
+    planner_trace.fallback('no_contain_pair')
     return start_frame - 1
 
 
@@ -157,9 +163,11 @@ def _can_contain(ob1, ob2, other_objects, all_obj_locations, end_frame,
     assert len(other_objects) == len(all_obj_locations)
     # Only cones do the contains, and can contain spl or smaller sphere/cones,
     # cylinders/cubes are too large
-    if (len(ob1) == 1 and ob1[0][0]['sized'] > ob2[0][0]['sized'] and
+    if not (len(ob1) == 1 and ob1[0][0]['sized'] > ob2[0][0]['sized'] and
             ob1[0][0]['shape'] == 'cone' and
             ob2[0][0]['shape'] in ['cone', 'sphere', 'spl']):
+        planner_trace.reject('not_containable')
+    else:
         # Also make sure the moved object will not collide with anything
         # there
         collisions = [
@@ -176,6 +184,7 @@ def _can_contain(ob1, ob2, other_objects, all_obj_locations, end_frame,
             zip(other_objects, all_obj_locations)]
         if not any(collisions):
             return True
+        planner_trace.reject('end_frame_collision')
     return False
 
 
@@ -212,6 +221,7 @@ def add_movements_singleObj(objects, start_frame, all_obj_locations, min_dist,
         last_frame_added = max(new_end_frame, last_frame_added)
         if new_end_frame <= new_start_frame:
             logging.error('>>> This should not happen')
+            planner_trace.fallback('out_of_frames')
             # most likely won't be able to get anything else, just die
             return total_frames
         obj_locations_per_obj, split = add_movements(
@@ -356,18 +366,25 @@ def add_movements(objs, record, start_frame, end_frame,
             assert len(obj_pos) == end_frame - start_frame + 1, \
                 'pos didnt match for action {}. {} vs {}'.format(
                     action, len(obj_pos), end_frame - start_frame + 1)
+        planner_trace.candidate()
         clean = [_no_object_overlaps(
             obj_pos, obj['sized'], other_obj_locs, other_obj_sizes,
             start_frame, end_frame, min_dist)
             for (obj, _), obj_pos in zip(objs, obj_pos_all_subObj)]
+        if not all(clean):
+            planner_trace.reject('path_collision')
         if split:
             # In this case, clean should also check if the final positions are
             # sufficiently far apart or not.
             clean.append(not _obj_overlap(
                 obj_pos_all_subObj[0][-1], objs[0][0]['sized'],
                 obj_pos_all_subObj[1][-1], objs[1][0]['sized'], min_dist))
+            if not clean[-1]:
+                planner_trace.reject('split_overlap')
         if not all(clean) and num_trials > MAX_TRIALS:
             logging.debug('Hit the max_trials')
+            scene_metrics.count('no_op_fallbacks')
+            planner_trace.fallback('_no_op')
             action = [_no_op] * len(objs)
             split = False
             if 'x' in kwargs:  # no_op does not take these
@@ -387,6 +404,7 @@ def add_movements(objs, record, start_frame, end_frame,
                               start_frame, end_frame)
             break
         num_trials += 1
+        scene_metrics.count('movement_retries')
     bpy.ops.screen.frame_jump(end=False)
     # +1 because the frame numbering starts at 0, and frame number total_frames
     # is the last frame
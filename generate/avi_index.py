@@ -0,0 +1,167 @@
+import os
+import struct
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+
+"""
+Pure python reader for the RIFF structure of the AVI files written by Blender
+(AVI_JPEG). Only the headers and the idx1 chunk are read, the frame data in
+the movi list is skipped over. Blender writes the idx1 index when it closes
+the video, so a video without index was not fully rendered.
+"""
+
+AviInfo = namedtuple('AviInfo', [
+    'path',
+    'file_size',
+    'has_index',
+    'truncated',  # a chunk or list extends past the end of the file
+    'header_frames',  # total frames according to the main (avih) header
+    'index_frames',  # number of video frame chunks in the idx1 index
+    'width',
+    'height',
+    'fps',
+    'movi_offset',  # file offset of the 'movi' fourcc of the movi list
+    'movi_size',
+    'index_size',
+    'min_frame_size',
+    'max_frame_size',
+    'error',
+])
+
+# Offsets and sizes of the frame data, in index order
+AviFrames = namedtuple('AviFrames', ['offsets', 'sizes'])
+
+_CHUNK_HEADER = struct.Struct('<4sI')
+_INDEX_ENTRY = struct.Struct('<4sIII')
+_AVIH = struct.Struct('<10I')
+_STRH = struct.Struct('<4s4sIHHIIII')
+
+
+def _is_video_chunk(ckid):
+    return ckid[2:] in (b'dc', b'db')
+
+
+def _parse_hdrl(data):
+    """ Returns (header frames, width, height, fps) from the hdrl list. """
+    header_frames, width, height, fps = None, None, None, None
+    pos = 0
+    while pos + 8 <= len(data):
+        fourcc, size = _CHUNK_HEADER.unpack_from(data, pos)
+        if fourcc == b'avih' and size >= _AVIH.size:
+            avih = _AVIH.unpack_from(data, pos + 8)
+            header_frames, width, height = avih[4], avih[8], avih[9]
+        elif fourcc == b'LIST':
+            # strl lists, with the stream headers; descend into them
+            pos += 12
+            continue
+        elif fourcc == b'strh' and size >= _STRH.size and fps is None:
+            strh = _STRH.unpack_from(data, pos + 8)
+            if strh[0] == b'vids' and strh[6] > 0:
+                fps = float(strh[7]) / strh[6]
+        pos += 8 + size + (size & 1)
+    return header_frames, width, height, fps
+
+
+def _parse_idx1(data, movi_offset):
+    offsets, sizes = [], []
+    base = None
+    for pos in range(0, len(data) - _INDEX_ENTRY.size + 1, _INDEX_ENTRY.size):
+        ckid, _, offset, size = _INDEX_ENTRY.unpack_from(data, pos)
+        if not _is_video_chunk(ckid):
+            continue
+        if base is None:
+            # Offsets are relative to the 'movi' fourcc in most writers,
+            # but absolute in some
+            base = movi_offset if offset < movi_offset else 0
+        # Point to the data, after the chunk header
+        offsets.append(base + offset + 8)
+        sizes.append(size)
+    return AviFrames(offsets, sizes)
+
+
+def read_avi(fpath, with_frames=False):
+    """
+    Read the structure of an AVI file. Returns an AviInfo, and if with_frames
+    is set, also the AviFrames with the position of each frame in the file.
+    """
+    info = dict.fromkeys(AviInfo._fields)
+    info.update(path=fpath, has_index=False, truncated=False)
+    frames = None
+    try:
+        file_size = os.path.getsize(fpath)
+        info['file_size'] = file_size
+        with open(fpath, 'rb') as fin:
+            riff, _ = _CHUNK_HEADER.unpack(fin.read(8))
+            if riff != b'RIFF' or fin.read(4) != b'AVI ':
+                raise ValueError('Not an AVI file')
+            pos = 12
+            while pos + 8 <= file_size:
+                fin.seek(pos)
+                fourcc, size = _CHUNK_HEADER.unpack(fin.read(8))
+                if pos + 8 + size > file_size:
+                    info['truncated'] = True
+                if fourcc == b'LIST':
+                    list_type = fin.read(4)
+                    if list_type == b'hdrl':
+                        (info['header_frames'], info['width'], info['height'],
+                         info['fps']) = _parse_hdrl(fin.read(size - 4))
+                    elif list_type == b'movi':
+                        info['movi_offset'] = pos + 8
+                        info['movi_size'] = size
+                elif fourcc == b'idx1':
+                    info['has_index'] = True
+                    info['index_size'] = size
+                    frames = _parse_idx1(
+                        fin.read(size), info['movi_offset'] or 0)
+                    info['index_frames'] = len(frames.sizes)
+                    if frames.sizes:
+                        info['min_frame_size'] = min(frames.sizes)
+                        info['max_frame_size'] = max(frames.sizes)
+                pos += 8 + size + (size & 1)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        info['error'] = str(e)
+    info = AviInfo(**info)
+    if with_frames:
+        return info, frames
+    return info
+
+
+def is_broken(info, num_frames=None):
+    """
+    A video is broken if it could not be read, has no index, is truncated or
+    has empty frames. If num_frames (the planned --num_frames of the scene) is
+    given, the video must also have all num_frames + 1 frames.
+    """
+    if info.error is not None or not info.has_index or info.truncated:
+        return True
+    if not info.index_frames or not info.min_frame_size:
+        return True
+    if num_frames is not None and info.index_frames != num_frames + 1:
+        return True
+    return False
+
+
+def check_avi_broken(fpath, num_frames=None):
+    """ Check if the AVI file is broken, i.e. does not have index. This
+    indicates a video that was not fully rendered and must be ignored for the
+    final training/testing. """
+    if os.path.exists(fpath + '.lock'):
+        # For any properly rendered video, the lock file must be deleted.
+        return True
+    return is_broken(read_avi(fpath), num_frames)
+
+
+def check_avis_broken(fpaths, num_frames=None, num_threads=16):
+    """
+    check_avi_broken for many files, reading them from a thread pool.
+    num_frames can be a single value or one per file.
+    """
+    if not isinstance(num_frames, (list, tuple)):
+        num_frames = [num_frames] * len(fpaths)
+    pool = ThreadPool(num_threads)
+    try:
+        return pool.map(lambda el: check_avi_broken(*el),
+                        list(zip(fpaths, num_frames)))
+    finally:
+        pool.close()
@@ -0,0 +1,144 @@
+import argparse
+import glob
+import os.path as osp
+
+import numpy as np
+
+import frame_reader
+from generate_labels import DICTIONARY_INDEX, WINDOW_SIZE, move_in_window
+from scene_index import read_scene
+
+
+"""
+Index of the action windows of all videos, for training on clips. The
+planner starts the movements of each segment at a multiple of 30 frames and
+finishes them within it (see actions.random_objects_movements), so every
+30-frame window holds complete actions. A window spans frames start to
+start + 30, both included, as in generate_labels.move_in_window: a move may
+end on the first frame of the next segment. The index lists every window of
+every video with the actions fully inside it, as generate_labels.DICTIONARY
+tokens (action, color, material, shape), and the byte offset of the first
+frame of the window in the video (for frame_reader). It is one .npz of flat
+arrays, so a loader can sample windows uniformly without opening any scene
+JSON:
+
+  videos: video file names
+  clip_video, clip_start, clip_offset: per window, the id of its video, its
+    first frame and the file offset of that frame
+  clip_indptr: the actions of window i are actions[clip_indptr[i]:
+    clip_indptr[i + 1]]
+  action_tokens: (num actions, 4) tokens; action_frames: (num actions, 2)
+    start and end frame
+
+python clip_index.py Out --output Out/clips.npz
+"""
+
+
+def get_windows(record, window_size=WINDOW_SIZE):
+    """ (start frame, moves) of each window of a SceneRecord, with the moves
+    that start and end inside the window. """
+    # The video has num_frames + 1 frames, the last window ends on the last
+    num_windows = record.num_frames // window_size
+    windows = []
+    for window_id in range(num_windows):
+        start = window_id * window_size
+        moves = [move for move in record.moves
+                 if move_in_window(move, start, window_size)]
+        windows.append((start, moves))
+    return windows
+
+
+def move_tokens(record, move):
+    color, material, shape = record.objects[move[0]]
+    return [DICTIONARY_INDEX[el] for el in (move[1], color, material, shape)]
+
+
+def build(output_dir, window_size=WINDOW_SIZE):
+    """ The clip index arrays of all scenes with a good video. """
+    videos, clip_video, clip_start, clip_offset, clip_indptr = \
+        [], [], [], [], [0]
+    action_tokens, action_frames = [], []
+    for scene_fpath in sorted(glob.glob(
+            osp.join(output_dir, 'scenes', '*.json'))):
+        record = read_scene(scene_fpath)
+        video_fpath = osp.join(output_dir, 'images', record.video)
+        try:
+            offsets = frame_reader.load_index(
+                video_fpath, record.num_frames)['offsets']
+        except (ValueError, OSError):
+            # Not rendered, or not fully
+            continue
+        for start, moves in get_windows(record, window_size):
+            clip_video.append(len(videos))
+            clip_start.append(start)
+            clip_offset.append(offsets[start])
+            for move in moves:
+                action_tokens.append(move_tokens(record, move))
+                action_frames.append(move[3:5])
+            clip_indptr.append(len(action_tokens))
+        videos.append(record.video)
+    return {
+        'window_size': np.int32(window_size),
+        'videos': np.array(videos, dtype='U'),
+        'clip_video': np.array(clip_video, dtype=np.int32),
+        'clip_start': np.array(clip_start, dtype=np.int32),
+        'clip_offset': np.array(clip_offset, dtype=np.int64),
+        'clip_indptr': np.array(clip_indptr, dtype=np.int64),
+        'action_tokens': np.array(
+            action_tokens, dtype=np.int16).reshape((-1, 4)),
+        'action_frames': np.array(
+            action_frames, dtype=np.int32).reshape((-1, 2)),
+    }
+
+
+class ClipIndex:
+    def __init__(self, fpath):
+        with np.load(fpath) as data:
+            for key in data.files:
+                setattr(self, key, data[key])
+        self.window_size = int(self.window_size)
+
+    def __len__(self):
+        return len(self.clip_start)
+
+    def get(self, clip_id):
+        """ Video, first frame, byte offset of the first frame and actions
+        (tokens, start and end frame) of a window. """
+        start, end = self.clip_indptr[clip_id], self.clip_indptr[clip_id + 1]
+        return {
+            'video': str(self.videos[self.clip_video[clip_id]]),
+            'start': int(self.clip_start[clip_id]),
+            'offset': int(self.clip_offset[clip_id]),
+            'tokens': self.action_tokens[start:end],
+            'frames': self.action_frames[start:end],
+        }
+
+    def sample(self, num_clips, with_actions=True, rng=np.random):
+        """ Ids of num_clips windows drawn uniformly, from the windows with
+        at least one action unless with_actions is False. """
+        candidates = np.arange(len(self))
+        if with_actions:
+            candidates = candidates[np.diff(self.clip_indptr) > 0]
+        return rng.choice(candidates, num_clips)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index the action windows of the rendered videos')
+    parser.add_argument(
+        'output_dir', help='--output_dir of render_videos.py')
+    parser.add_argument(
+        '--output', required=True, help='Where to write the index (.npz)')
+    parser.add_argument(
+        '--window_size', default=WINDOW_SIZE, type=int,
+        help='Frames per window')
+    args = parser.parse_args()
+    index = build(args.output_dir, args.window_size)
+    np.savez(args.output, **index)
+    print(f'Indexed {len(index["clip_start"])} windows with '
+          f'{len(index["action_tokens"])} actions from '
+          f'{len(index["videos"])} videos')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import glob
+import json
+import os
+import os.path as osp
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+"""
+Helpers to run the renderer on CPU-only nodes (launch.py --cpu_farm): find
+the cores (and NUMA nodes) available to us, split them into disjoint sets, one
+per Blender worker, and benchmark a reference scene to pick the number of
+workers, Cycles threads and tile size that give the most videos per hour.
+"""
+
+TILE_SIZES = [16, 32, 64]
+DEFAULT_TILE_SIZE = 32
+
+
+def available_cpus():
+    return sorted(os.sched_getaffinity(0))
+
+
+def parse_cpulist(cpulist):
+    """ Parse the kernel's cpulist format, eg, "0-3,8-11". """
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus += list(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """
+    Returns a list of (node id, cpus) for every NUMA node that has CPUs we are
+    allowed to run on. Machines without NUMA information are a single node.
+    """
+    cpus = set(available_cpus())
+    nodes = []
+    for node_dir in sorted(glob.glob('/sys/devices/system/node/node[0-9]*')):
+        try:
+            with open(osp.join(node_dir, 'cpulist'), 'r') as fin:
+                node_cpus = sorted(cpus & set(parse_cpulist(fin.read())))
+        except IOError:
+            continue
+        if node_cpus:
+            nodes.append((int(osp.basename(node_dir)[len('node'):]),
+                          node_cpus))
+    if not nodes:
+        nodes = [(None, sorted(cpus))]
+    return nodes
+
+
+def _split(lst, n):
+    """ Split lst into n contiguous chunks whose sizes differ by at most 1. """
+    k, m = divmod(len(lst), n)
+    return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)]
+            for i in range(n)]
+
+
+def split_cores(num_workers, nodes=None):
+    """
+    Split the available cores into num_workers disjoint sets. If the workers
+    can be spread evenly over the NUMA nodes, every worker stays within one
+    node. Returns a list of (node id or None, cpus).
+    """
+    nodes = nodes or numa_nodes()
+    num_cpus = sum(len(cpus) for _, cpus in nodes)
+    assert 0 < num_workers <= num_cpus, \
+        'Can not run {} workers on {} cores'.format(num_workers, num_cpus)
+    if num_workers % len(nodes) == 0 and all(
+            len(cpus) >= num_workers // len(nodes) for _, cpus in nodes):
+        res = []
+        for node, cpus in nodes:
+            res += [(node, el) for el in _split(
+                cpus, num_workers // len(nodes))]
+        return res
+    all_cpus = [cpu for _, cpus in nodes for cpu in cpus]
+    return [(None, el) for el in _split(all_cpus, num_workers)]
+
+
+def pinned_command(cmd, node, cpus):
+    """ Prefix a shell command so it only runs on the given cores. """
+    cpu_list = ','.join(str(el) for el in cpus)
+    if node is not None and shutil.which('numactl'):
+        # Also keep the memory on the same node
+        return 'numactl --physcpubind={} --membind={} {}'.format(
+            cpu_list, node, cmd)
+    return 'taskset -c {} {}'.format(cpu_list, cmd)
+
+
+def candidate_worker_counts(num_cpus, num_nodes=1):
+    """ Powers of 2 and multiples of the number of NUMA nodes. """
+    counts = set([num_nodes, num_cpus])
+    count = 1
+    while count <= num_cpus:
+        counts.add(count)
+        count *= 2
+    return sorted(el for el in counts if 0 < el <= num_cpus)
+
+
+def read_benchmark_metrics(output_dir):
+    """ Returns (seconds outside of the render, seconds per frame). """
+    with open(osp.join(output_dir, 'metrics.jsonl'), 'r') as fin:
+        metrics = [json.loads(line) for line in fin if line.strip()]
+    metrics = [el for el in metrics if el['status'] == 'ok']
+    assert len(metrics) > 0, 'Benchmark render failed in {}'.format(
+        output_dir)
+    metrics = metrics[-1]
+    render = metrics['stages'].get('render', 0.0)
+    frames = max(metrics['counters'].get('frames_rendered', 1), 1)
+    return metrics['total'] - render, render / frames
+
+
+def plan_reference(make_cmd, output_dir, threads):
+    """ Plan the reference scene once, and render it, into output_dir. The
+    benchmark runs load its BLEND file, so they all render the same scene.
+    Returns the seconds outside of the render, which are those of planning
+    a scene. """
+    subprocess.call(make_cmd(output_dir, threads, DEFAULT_TILE_SIZE),
+                    shell=True, stdout=subprocess.DEVNULL)
+    return read_benchmark_metrics(output_dir)[0]
+
+
+def benchmark(make_cmd, num_workers, tile_size, num_frames, nodes=None,
+              num_views=1, reference_dir=None):
+    """
+    Run num_workers pinned Blender workers at the same time on the reference
+    scene, so the measurement includes the contention between them.
+    make_cmd(output_dir, threads, tile_size) should return the shell command
+    to render the reference scene into output_dir, loading the BLEND file in
+    its blend/ folder if there is one (render_videos.py --save_blendfiles 1).
+    If reference_dir is given (see plan_reference), its scene is rendered by
+    every worker. Returns the expected videos per hour with num_frames frames
+    per video, and num_views views (see render_videos.py --num_views)
+    rendered per planned scene.
+    """
+    cores = split_cores(num_workers, nodes)
+    threads = min(len(cpus) for _, cpus in cores)
+    tmp_dir = tempfile.mkdtemp(prefix='cpu_farm_')
+    try:
+        procs = []
+        for worker_id, (node, cpus) in enumerate(cores):
+            output_dir = osp.join(tmp_dir, str(worker_id))
+            if reference_dir is not None:
+                os.makedirs(output_dir)
+                os.symlink(osp.abspath(osp.join(reference_dir, 'blend')),
+                           osp.join(output_dir, 'blend'))
+            cmd = pinned_command(
+                make_cmd(output_dir, threads, tile_size), node, cpus)
+            procs.append((output_dir, subprocess.Popen(
+                cmd, shell=True, stdout=subprocess.DEVNULL)))
+        setup_times, frame_times = [], []
+        for output_dir, proc in procs:
+            proc.wait()
+            setup_time, frame_time = read_benchmark_metrics(output_dir)
+            setup_times.append(setup_time)
+            frame_times.append(frame_time)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    setup_seconds = sum(setup_times) / len(setup_times)
+    if reference_dir is not None:
+        # The workers only loaded the scene, it was planned once
+        setup_seconds = read_benchmark_metrics(reference_dir)[0]
+    seconds_per_video = (setup_seconds +
+                         max(frame_times) * (num_frames + 1) * num_views)
+    return OrderedDict([
+        ('workers', num_workers),
+        ('threads', threads),
+        ('tile_size', tile_size),
+        ('setup_seconds', setup_seconds),
+        ('sec_per_frame', max(frame_times)),
+        ('videos_per_hour', num_workers * 3600.0 / seconds_per_video),
+    ])
+
+
+def choose_config(make_cmd, num_frames, worker_counts=None, tile_sizes=None,
+                  log=print, num_views=1):
+    """
+    Pick the worker count (and hence the Cycles threads per worker) with the
+    default tile size first, and then the tile size for that worker count.
+    All configs render the same reference scene, planned once. Returns the
+    best benchmark result and all results.
+    """
+    nodes = numa_nodes()
+    num_cpus = sum(len(cpus) for _, cpus in nodes)
+    worker_counts = worker_counts or candidate_worker_counts(
+        num_cpus, len(nodes))
+    tile_sizes = tile_sizes or TILE_SIZES
+    results = []
+    reference_root = tempfile.mkdtemp(prefix='cpu_farm_reference_')
+    reference_dir = osp.join(reference_root, 'reference')
+    log('Planning the reference scene')
+    plan_reference(make_cmd, reference_dir, num_cpus)
+
+    def run(num_workers, tile_size):
+        res = benchmark(make_cmd, num_workers, tile_size, num_frames, nodes,
+                        num_views, reference_dir)
+        log('Benchmark: {workers} workers x {threads} threads, tile '
+            '{tile_size}: {sec_per_frame:.2f} s/frame, '
+            '{videos_per_hour:.1f} videos/h'.format(**res))
+        results.append(res)
+        return res
+
+    try:
+        best = max([run(el, DEFAULT_TILE_SIZE) for el in worker_counts],
+                   key=lambda el: el['videos_per_hour'])
+        for tile_size in tile_sizes:
+            if tile_size == DEFAULT_TILE_SIZE:
+                continue
+            res = run(best['workers'], tile_size)
+            if res['videos_per_hour'] > best['videos_per_hour']:
+                best = res
+    finally:
+        shutil.rmtree(reference_root, ignore_errors=True)
+    return best, results
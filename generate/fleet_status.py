@@ -0,0 +1,173 @@
+import glob
+import json
+import os
+import os.path as osp
+import re
+import time
+from collections import OrderedDict, defaultdict
+
+"""
+Aggregate the heartbeats written by the render_videos.py workers (see
+heartbeat.py) into a fleet summary: progress, videos/hour, per-slot and
+per-GPU utilization, failures, stalled workers and the projected completion
+time. Used by launch.py, but can also be run on its own to look at a running
+or finished launch:
+
+python fleet_status.py Out/status
+"""
+
+HEARTBEAT_PATTERN = 'worker_*.json'
+VIEW_VIDEO = re.compile(r'_view[0-9]+\.avi$')
+
+
+def heartbeat_path(status_dir, slot):
+    return osp.join(status_dir, 'worker_{}.json'.format(slot))
+
+
+def clear_heartbeats(status_dir):
+    """ Remove heartbeats left over from an earlier launch. """
+    for fpath in glob.glob(osp.join(status_dir, HEARTBEAT_PATTERN)):
+        os.remove(fpath)
+
+
+def read_heartbeats(status_dir):
+    heartbeats = []
+    for fpath in sorted(glob.glob(osp.join(status_dir, HEARTBEAT_PATTERN))):
+        try:
+            with open(fpath, 'r') as fin:
+                heartbeats.append(json.load(fin))
+        except (IOError, ValueError):
+            # Being replaced right now, will be read on the next update
+            continue
+    return heartbeats
+
+
+def count_finished_videos(image_dir):
+    """ Videos that are already fully rendered, ie, not locked anymore. """
+    if not osp.isdir(image_dir):
+        return 0
+    fnames = set(os.listdir(image_dir))
+    # The other views of a scene (--num_views) are not separate videos
+    return len([el for el in fnames
+                if el.endswith('.avi') and el + '.lock' not in fnames and
+                not VIEW_VIDEO.search(el)])
+
+
+def summarize(heartbeats, start_time, total_videos, initial_done=0,
+              stall_timeout=300, now=None):
+    now = now or time.time()
+    elapsed = max(now - start_time, 1e-6)
+    slots = []
+    gpus = defaultdict(list)
+    # Workers started without launch.py have no slot
+    for hb in sorted(heartbeats,
+                     key=lambda el: (el['slot'] is None, el['slot'] or 0)):
+        alive = max(hb['updated'] - hb['started'], 1e-6)
+        stalled = (not hb['finished'] and
+                   now - hb['updated'] > stall_timeout)
+        slot = OrderedDict([
+            ('slot', hb['slot']),
+            ('gpu', hb['gpu']),
+            ('host', hb['host']),
+            ('index', hb['index']),
+            ('stage', 'stalled' if stalled else hb['stage']),
+            ('frames_done', hb['frames_done']),
+            ('num_frames', hb['num_frames']),
+            ('sec_per_frame', hb['sec_per_frame']),
+            ('scenes_done', hb['scenes_done']),
+            ('scenes_failed', hb['scenes_failed']),
+            ('utilization', min(hb['render_seconds'] / alive, 1.0)),
+            ('seconds_since_update', now - hb['updated']),
+        ])
+        slots.append(slot)
+        gpus[str(hb['gpu'])].append(slot)
+    # Scenes with a broken video count as failed (see render_videos.py), so
+    # the rate and ETA are of good videos only
+    done = sum(el['scenes_done'] for el in slots)
+    failed = sum(el['scenes_failed'] for el in slots)
+    remaining = max(total_videos - initial_done - done - failed, 0)
+    videos_per_hour = done * 3600.0 / elapsed
+    eta = None
+    if videos_per_hour > 0:
+        eta = now + remaining * 3600.0 / videos_per_hour
+    per_gpu = OrderedDict()
+    for gpu, gpu_slots in sorted(gpus.items()):
+        per_gpu[gpu] = OrderedDict([
+            ('slots', len(gpu_slots)),
+            ('scenes_done', sum(el['scenes_done'] for el in gpu_slots)),
+            ('scenes_failed', sum(el['scenes_failed'] for el in gpu_slots)),
+            ('utilization', sum(el['utilization'] for el in gpu_slots) /
+             len(gpu_slots)),
+            ('stalled', sum(el['stage'] == 'stalled' for el in gpu_slots)),
+        ])
+    return OrderedDict([
+        ('updated', now),
+        ('elapsed', elapsed),
+        ('total_videos', total_videos),
+        ('initial_done', initial_done),
+        ('done', done),
+        ('failed', failed),
+        ('remaining', remaining),
+        ('videos_per_hour', videos_per_hour),
+        ('eta', eta),
+        ('stalled', sum(el['stage'] == 'stalled' for el in slots)),
+        ('gpus', per_gpu),
+        ('slots', slots),
+    ])
+
+
+def write_status(summary, fpath):
+    tmp_fpath = fpath + '.tmp'
+    with open(tmp_fpath, 'w') as fout:
+        json.dump(summary, fout, indent=2)
+    os.replace(tmp_fpath, fpath)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(
+        seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+def format_summary(summary):
+    finished = summary['initial_done'] + summary['done']
+    eta = 'unknown'
+    if summary['eta'] is not None:
+        eta = '{} (in {})'.format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(summary['eta'])),
+            _format_duration(summary['eta'] - summary['updated']))
+    lines = [
+        '[{}] {}/{} videos ({} this run, {} failed), {:.1f} videos/h, '
+        'ETA {}'.format(
+            _format_duration(summary['elapsed']), finished,
+            summary['total_videos'], summary['done'], summary['failed'],
+            summary['videos_per_hour'], eta),
+    ]
+    for slot in summary['slots']:
+        spf = slot['sec_per_frame']
+        lines.append(
+            '  slot {:>3} gpu {:>4s} | #{:<7} {:12s} frame {:>3}/{:<3} '
+            '{:>6s} s/frame | done {:4d} failed {:3d} | util {:3.0f}%'.format(
+                str(slot['slot']), str(slot['gpu']), str(slot['index']),
+                slot['stage'], slot['frames_done'], str(slot['num_frames']),
+                '-' if spf is None else '{:.2f}'.format(spf),
+                slot['scenes_done'], slot['scenes_failed'],
+                100 * slot['utilization']))
+    if summary['stalled'] > 0:
+        lines.append('  WARNING: {} stalled worker(s)'.format(
+            summary['stalled']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Show the fleet status')
+    parser.add_argument('status_dir', help='Directory with the heartbeats')
+    parser.add_argument('--total_videos', type=int, default=0)
+    parser.add_argument('--stall_timeout', type=int, default=300)
+    args = parser.parse_args()
+    heartbeats = read_heartbeats(args.status_dir)
+    start_time = min([el['started'] for el in heartbeats] or [time.time()])
+    print(format_summary(summarize(
+        heartbeats, start_time, args.total_videos,
+        stall_timeout=args.stall_timeout)))
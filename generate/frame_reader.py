@@ -0,0 +1,161 @@
+import io
+import mmap
+import os
+import struct
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from PIL import Image
+
+import avi_index
+
+
+"""
+Random access to the frames of the AVI_JPEG (MJPEG) videos. Every frame of
+an MJPEG video is a JPEG on its own, so a clip can be read without decoding
+the video up to it. The position of each frame is taken from the idx1 chunk
+of the AVI once (see avi_index.py) and stored in a small index file next to
+the video (<video>.idx.npz), which is rebuilt when the video changes. The
+video is memory mapped, and the frames are decoded with PIL in a thread pool
+to uint8 arrays.
+
+with FrameReader('Out/images/CATER_new_000001.avi') as reader:
+    clip = reader.get_clip(30, 30)  # (30, height, width, 3) uint8
+"""
+
+INDEX_SUFFIX = '.idx.npz'
+
+_DHT_MARKER = b'\xff\xc4'
+_SOS_MARKER = b'\xff\xda'
+_STANDARD_DHT = None
+
+
+def index_path(video_path):
+    return video_path + INDEX_SUFFIX
+
+
+def build_index(video_path, num_frames=None):
+    """
+    Read the frame positions of a video and store them in its index file.
+    Raises ValueError if the video is broken (see avi_index.is_broken);
+    num_frames is the planned --num_frames of the scene, if known.
+    """
+    info, frames = avi_index.read_avi(video_path, with_frames=True)
+    if avi_index.is_broken(info, num_frames):
+        raise ValueError('Broken video {} ({})'.format(
+            video_path, info.error or 'incomplete'))
+    st = os.stat(video_path)
+    index = {
+        'offsets': np.array(frames.offsets, dtype=np.int64),
+        'sizes': np.array(frames.sizes, dtype=np.int32),
+        'file_size': np.int64(st.st_size),
+        'mtime': np.float64(st.st_mtime),
+        'width': np.int32(info.width),
+        'height': np.int32(info.height),
+    }
+    tmp_fpath = '{}.{}.tmp.npz'.format(index_path(video_path), os.getpid())
+    np.savez(tmp_fpath, **index)
+    os.rename(tmp_fpath, index_path(video_path))
+    return index
+
+
+def load_index(video_path, num_frames=None):
+    """ The index of a video, built if missing or outdated. """
+    fpath = index_path(video_path)
+    if os.path.exists(fpath):
+        with np.load(fpath) as data:
+            index = {key: data[key] for key in data.files}
+        st = os.stat(video_path)
+        if (index['file_size'] == st.st_size and
+                index['mtime'] == st.st_mtime):
+            return index
+    return build_index(video_path, num_frames)
+
+
+def _standard_dht():
+    """ DHT segments with the standard Huffman tables, as written by libjpeg
+    when the tables are not optimized. """
+    global _STANDARD_DHT
+    if _STANDARD_DHT is None:
+        buf = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buf, 'JPEG', optimize=False)
+        data = buf.getvalue()
+        segments = []
+        pos = data.find(_DHT_MARKER)
+        while pos >= 0 and data[pos:pos + 2] == _DHT_MARKER:
+            length, = struct.unpack('>H', data[pos + 2:pos + 4])
+            segments.append(data[pos:pos + 2 + length])
+            pos += 2 + length
+        _STANDARD_DHT = b''.join(segments)
+    return _STANDARD_DHT
+
+
+def add_huffman_tables(jpeg):
+    """ MJPEG frames may leave out the Huffman tables, to use the standard
+    ones; PIL needs them in the file. """
+    sos = jpeg.find(_SOS_MARKER)
+    if sos < 0 or jpeg.find(_DHT_MARKER, 0, sos) >= 0:
+        return jpeg
+    return jpeg[:sos] + _standard_dht() + jpeg[sos:]
+
+
+def decode_jpeg(jpeg):
+    img = Image.open(io.BytesIO(add_huffman_tables(jpeg)))
+    return np.asarray(img.convert('RGB'))
+
+
+class FrameReader:
+    def __init__(self, video_path, num_frames=None, num_threads=4):
+        """
+        num_frames: the planned --num_frames of the scene, to check the
+            video when its index is built.
+        num_threads: Threads to decode the frames with.
+        """
+        self.video_path = video_path
+        self.index = load_index(video_path, num_frames)
+        self.offsets = self.index['offsets']
+        self.sizes = self.index['sizes']
+        self.num_threads = num_threads
+        self._file = open(video_path, 'rb')
+        self._mmap = mmap.mmap(
+            self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pool = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._mmap.close()
+        self._file.close()
+
+    def get_jpeg(self, frame):
+        """ The encoded JPEG of a frame, as bytes. """
+        offset = self.offsets[frame]
+        return self._mmap[offset:offset + self.sizes[frame]]
+
+    def get_frame(self, frame):
+        """ (height, width, 3) uint8 array of a frame. """
+        return decode_jpeg(self.get_jpeg(frame))
+
+    def get_frames(self, frames):
+        """ (len(frames), height, width, 3) uint8 array of the given frames,
+        decoded in parallel. """
+        jpegs = [self.get_jpeg(frame) for frame in frames]
+        if self.num_threads <= 1 or len(jpegs) <= 1:
+            return np.stack([decode_jpeg(el) for el in jpegs])
+        if self._pool is None:
+            self._pool = ThreadPool(self.num_threads)
+        return np.stack(self._pool.map(decode_jpeg, jpegs))
+
+    def get_clip(self, start, length, step=1):
+        """ length frames starting at start, every step-th frame. """
+        return self.get_frames(range(start, start + length * step, step))
@@ -2,28 +2,32 @@
 
 import glob
 import os.path as osp
-import json
 from gen_utils import mkdir_p
+from avi_index import check_avis_broken
+from scene_index import iter_scenes
+from label_cache import LabelCache
+import localize
+import label_export
+from localize import NUM_ROWS, NUM_COLS
 import numpy as np
 from tqdm import tqdm
 import logging
-import subprocess
-from functools import partial
-import re
 import cPickle as pkl
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, namedtuple, OrderedDict
 from itertools import permutations, product
 import multiprocessing as mp
-import math
-import copy
 
 OUTPUT_DATA_DIR = 'output'  # Change path to where the videos are stored
 LIST_DIR = 'lists'
 USE_TRAIN_TEST_SPLIT_FROM = None
 MAX_TOT_VIDEOS = 5500
 np.random.seed(42)
-NUM_ROWS = 3
-NUM_COLS = 3
+# Bump when the cached scene entries change, to invalidate the cache
+SCENE_CACHE_VERSION = 3
+# Localize every LOCALIZE_FRAME_STEP-th frame for the per-frame labels
+LOCALIZE_FRAME_STEP = 10
+# Scenes read (and videos checked) at once by read_data
+READ_BATCH_SIZE = 256
 ACTION_CLASSES = [
     # object, movement
     ('sphere', '_slide'),
@@ -41,6 +45,7 @@ ACTION_CLASSES = [
     ('cone', '_pick_place'),
     ('cone', '_slide'),
 ]
+ACTION_CLASSES_SET = set(ACTION_CLASSES)
 _BEFORE = 'before'
 _AFTER = 'after'
 _DURING = 'during'
@@ -51,50 +56,102 @@ ORDERING = [
 ]
 
 
-def localize_dataset(data, num_rows=NUM_ROWS, num_cols=NUM_COLS):
-    """ data is a dictionary with video name to metadata (JSON file). """
-    # NOTE that this code is now also being used by proj_utils to go from
-    # 2D coordinates on plane to class ID. So change that too if this gets
-    # changed.
-    fnames = []
-    lbls = []
-    for fname, metadata in data.items():
-        fnames.append(fname)
-        objects = metadata['objects']
-        object = [el for el in objects if el['shape'] == 'spl'][0]
-        pos = object['locations'][str(len(object['locations']) - 1)]
-        if num_rows != NUM_ROWS or num_cols != NUM_COLS:
-            # In this case, need to scale the pos values to scale to the new num_rows etc
-            pos[0] *= num_cols * 1.0 / NUM_COLS
-            pos[1] *= num_rows * 1.0 / NUM_ROWS
-        # Without math.floor it would screw up on negative axis
-        x, y = (int(math.floor(pos[0])) + num_cols,
-                int(math.floor(pos[1])) + num_rows)
-        cls_id = y * (2 * num_cols) + x
-        lbls.append(cls_id)
-    return fnames, lbls, {'classes': range(num_cols * num_rows * 4)}
+# Things most label tasks need about a video, computed once per video
+Video = namedtuple('Video', [
+    'fname',
+    'metadata',
+    'name_to_type',  # instance name to shape
+    'actions',  # (shape, motion) for every motion of every object
+])
 
 
-def actions_or_not_dataset(data, action_classes):
-    fnames = []
-    lbls = []
-    for fname, metadata in data.items():
-        fnames.append(fname)
-        movements = metadata['movements']
-        objects = metadata['objects']
-        name_to_type = {el['instance']: el['shape'] for el in objects}
-        shape_to_actions = defaultdict(lambda: [])
-        for name, motions in movements.items():
-            shape_to_actions[name_to_type[name]] += [
-                el[0] for el in motions]
+def get_video(fname, metadata):
+    name_to_type = {el['instance']: el['shape'] for el in metadata['objects']}
+    actions = []
+    for name, motions in metadata['movements'].items():
+        for motion in motions:
+            actions.append((name_to_type[name], motion))
+    return Video(fname, metadata, name_to_type, actions)
+
+
+class LabelTask(object):
+    """ A label set. All tasks are computed together by compile_labels, in a
+    single pass over the videos, so adding a task does not add a pass.
+    Subclasses set the classes and define get_label, the label of one
+    Video. """
+    classes = None
+    # How the labels are stored by label_export
+    label_kind = 'multi_hot'
+
+    def get_metadata(self):
+        return {'classes': self.classes}
+
+
+class LocalizeTask(LabelTask):
+    """ Grid cell the snitch is in, at the last frame or at every few frames
+    (see localize.get_frame_ids). Computed for all videos at once by
+    compile_labels. """
+    def __init__(self, num_rows=NUM_ROWS, num_cols=NUM_COLS, frames=None):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.frames = frames
+        self.classes = range(num_cols * num_rows * 4)
+        self.label_kind = 'class' if frames is None else 'sequence'
+
+    def format_label(self, class_ids):
+        if self.frames is None:
+            return int(class_ids[0])
+        # Each video only has the labels of its own frames
+        return ','.join([str(el) for el in class_ids if el != localize.PAD])
+
+    def get_label(self, video):
+        positions = localize.get_trajectory(video.metadata)
+        class_ids = localize.localize(
+            positions[np.newaxis], [len(positions)],
+            [(self.num_rows, self.num_cols)], self.frames)[0, 0]
+        return self.format_label(class_ids)
+
+    def get_metadata(self):
+        metadata = super(LocalizeTask, self).get_metadata()
+        if self.frames is not None:
+            metadata['frames'] = self.frames
+        return metadata
+
+
+def compile_localize_labels(data, tasks):
+    """ Labels of the LocalizeTasks, for all videos and grids of a given
+    frames setting in one array operation. Returns a list of labels per task,
+    in the order of data. """
+    positions, num_frames = localize.get_trajectories(data.values())
+    labels = {}
+    for frames in set([task.frames for task in tasks.values()]):
+        names = [name for name, task in tasks.items() if task.frames == frames]
+        class_ids = localize.localize(
+            positions, num_frames,
+            [(tasks[name].num_rows, tasks[name].num_cols) for name in names],
+            frames)
+        for name, task_class_ids in zip(names, class_ids):
+            labels[name] = [tasks[name].format_label(el)
+                            for el in task_class_ids]
+    return labels
+
+
+class ActionsPresentTask(LabelTask):
+    """ Which of the (shape, movement) action classes happen in the video. """
+    def __init__(self, action_classes=ACTION_CLASSES):
+        self.classes = action_classes
+
+    def get_label(self, video):
+        shape_to_actions = defaultdict(set)
+        for shape, motion in video.actions:
+            shape_to_actions[shape].add(motion[0])
         this_lbl = []
         # iterate over the classes and check if any of that is true for this
         # case
-        for action_id, (shape, movement) in enumerate(action_classes):
+        for action_id, (shape, movement) in enumerate(self.classes):
             if movement in shape_to_actions[shape]:
                 this_lbl.append(action_id)
-        lbls.append(','.join([str(el) for el in this_lbl]))
-    return fnames, lbls, {'classes': action_classes}
+        return ','.join([str(el) for el in this_lbl])
 
 
 def get_ordering(act1_time, act2_time):
@@ -110,43 +167,30 @@ def get_ordering(act1_time, act2_time):
         return _DURING
 
 
-def satisfy_action_class(action_class, actions_set):
-    action_class_ents, action_class_ord = action_class
-    assert len(action_class_ents) == len(actions_set), \
-        'Must be same number of actions'
-    # The action set must contain the exact objects in exact motion
-    for action_class_ent, action in zip(action_class_ents, actions_set):
-        if (action_class_ent[0] != action[0] or
-                action_class_ent[1] != action[1][0]):
-            return False
-    # Now need to make sure the intervals make sense w.r.t the relation
-    for i in range(len(action_class_ord)):
-        if not get_ordering(
-                actions_set[i][1][2:],
-                actions_set[i + 1][1][2:]) == action_class_ord[i]:
-            return False
-    return True
-
-
-def compute_active_labels(data_el, classes, n):
-    fname, metadata = data_el
-    movements = metadata['movements']
-    objects = metadata['objects']
-    name_to_type = {el['instance']: el['shape'] for el in objects}
-    all_actions = []
-    for name, motions in movements.items():
-        for motion in motions:
-            all_actions.append((
-                name_to_type[name],
-                motion))
-    # Consider all n-length permutations of all_actions, and check if it
-    # fits any of the classes
+def get_action_class_key(actions_set):
+    """ The action order class an ordered set of (shape, motion) fits in:
+    the (shape, movement) of each action and the ordering between each two
+    consecutive ones. """
+    action_class_ents = tuple(
+        (shape, motion[0]) for shape, motion in actions_set)
+    action_class_ord = tuple(
+        get_ordering(actions_set[i][1][2:], actions_set[i + 1][1][2:])
+        for i in range(len(actions_set) - 1))
+    return action_class_ents, action_class_ord
+
+
+def compute_active_labels(actions, class_index, n):
+    """ class_index maps each action order class to its id. """
+    # Actions that are in no class (eg, _no_op) can't match anything
+    actions = [el for el in actions if (el[0], el[1][0]) in ACTION_CLASSES_SET]
+    # Consider all n-length permutations of the actions, and look up the
+    # class each of them fits in
     this_lbl = set()
-    for (cls_id, action_class), actions_set in product(
-            enumerate(classes), permutations(all_actions, n)):
-        if satisfy_action_class(action_class, actions_set):
+    for actions_set in permutations(actions, n):
+        cls_id = class_index.get(get_action_class_key(actions_set))
+        if cls_id is not None:
             this_lbl.add(cls_id)
-    return fname, this_lbl
+    return this_lbl
 
 
 def action_order_unique(classes):
@@ -166,38 +210,119 @@ def action_order_unique(classes):
     return classes_uniq
 
 
-def actions_order_dataset(data, n=2, unique=False):
+class ActionsOrderTask(LabelTask):
+    """ Which n actions happen, in which order. """
     # NOTE: When an object is contained, and the containing object slides,
     # I consider that as a slide for the contained object as well.
-    fnames = []
-    lbls = []
-    action_sets = list(product(ACTION_CLASSES, repeat=n))
-    # all orderings
-    orderings = list(product(ORDERING, repeat=(n-1)))
-    # all actions and orderings
-    classes = list(product(action_sets, orderings))
-    if unique:
-        # Remove classes such as "X before Y" when "Y after X" already exists in the data
-        classes = action_order_unique(classes)
-    print('Action orders classes {}'.format(len(classes)))
-    # Now check for all combinations in the video and check if it fits any of
-    # the classes
-    num_labels_active = 0
+    def __init__(self, n=2, unique=False):
+        self.n = n
+        action_sets = list(product(ACTION_CLASSES, repeat=n))
+        # all orderings
+        orderings = list(product(ORDERING, repeat=(n-1)))
+        # all actions and orderings
+        classes = list(product(action_sets, orderings))
+        if unique:
+            # Remove classes such as "X before Y" when "Y after X" already exists in the data
+            classes = action_order_unique(classes)
+        print('Action orders classes {}'.format(len(classes)))
+        self.classes = classes
+        self.class_index = {action_class: cls_id
+                            for cls_id, action_class in enumerate(classes)}
+
+    def get_label(self, video):
+        this_lbl = compute_active_labels(
+            video.actions, self.class_index, self.n)
+        return ','.join([str(el) for el in sorted(list(this_lbl))])
+
+
+# Set in each worker of the compile_labels pool, see init_worker
+_WORKER_TASKS = None
+_WORKER_VIDEOS = None
+
+
+def init_worker(tasks, videos):
+    """ The workers get the tasks and the compact videos once, when they
+    start (inherited when forked), and then only receive video indices. """
+    global _WORKER_TASKS, _WORKER_VIDEOS
+    _WORKER_TASKS = tasks
+    _WORKER_VIDEOS = videos
+
+
+def compile_video_labels(video_id):
+    video = _WORKER_VIDEOS[video_id]
+    return [task.get_label(video) for task in _WORKER_TASKS]
+
+
+def get_chunksize(num_items, num_workers):
+    # A few chunks per worker, to balance the load without much IPC
+    return max(1, num_items // (num_workers * 4))
+
+
+def compile_labels(data, tasks, num_workers=None):
+    """ Compute the labels of all tasks in a single pass over the videos.
+    data is a dictionary with video name to metadata (JSON file), tasks an
+    OrderedDict of task name to LabelTask. Returns an OrderedDict of task
+    name to (fnames, labels). num_workers defaults to the number of cores. """
+    fnames = list(data.keys())
+    results = OrderedDict([(name, (fnames, [])) for name in tasks])
+    if len(data) == 0:
+        return results
+    localize_tasks = OrderedDict([
+        (name, task) for name, task in tasks.items()
+        if isinstance(task, LocalizeTask)])
+    if localize_tasks:
+        for name, labels in compile_localize_labels(
+                data, localize_tasks).items():
+            results[name][1].extend(labels)
+    other_tasks = OrderedDict([
+        (name, task) for name, task in tasks.items()
+        if name not in localize_tasks])
+    if not other_tasks:
+        return results
+    # The other tasks only need the actions, so drop the rest of the metadata
+    # (the per-frame locations are most of it) before handing it to workers
+    videos = [get_video(fname, metadata)._replace(metadata=None)
+              for fname, metadata in data.items()]
+    if num_workers is None:
+        num_workers = mp.cpu_count()
+    num_workers = max(1, min(num_workers, len(videos)))
     # Compute the labels in parallel, since it is pretty slow
-    pool = mp.Pool(16)
-    all_labels = list(tqdm(
-        pool.imap(partial(compute_active_labels, classes=classes, n=n),
-                  data.items()),
-        total=len(data), desc='Computing action order labels'))
+    pool = mp.Pool(num_workers, initializer=init_worker,
+                   initargs=(list(other_tasks.values()), videos))
+    for labels in tqdm(
+            pool.imap(compile_video_labels, range(len(videos)),
+                      chunksize=get_chunksize(len(videos), num_workers)),
+            total=len(videos), desc='Computing labels'):
+        for name, label in zip(other_tasks, labels):
+            results[name][1].append(label)
     pool.terminate()
-    for fname, this_lbl in all_labels:
-        fnames.append(fname)
-        num_labels_active += len(this_lbl)
-        lbls.append(','.join([str(el) for el in sorted(list(this_lbl))]))
-    num_labels_active /= len(data)
-    print('Found {} active labels avg out of {} classes'.format(
-        num_labels_active, len(classes)))
-    return fnames, lbls, {'classes': classes}
+    for name, task in other_tasks.items():
+        if isinstance(task, ActionsOrderTask):
+            num_labels_active = sum(len(el.split(',')) if el else 0
+                                    for el in results[name][1])
+            num_labels_active /= len(data)
+            print('Found {} active labels avg out of {} classes'.format(
+                num_labels_active, len(task.classes)))
+    return results
+
+
+def task_dataset(data, task):
+    fnames, lbls = compile_labels(data, OrderedDict([('task', task)]))['task']
+    return fnames, lbls, task.get_metadata()
+
+
+def localize_dataset(data, num_rows=NUM_ROWS, num_cols=NUM_COLS,
+                     frames=None):
+    """ data is a dictionary with video name to metadata (JSON file). """
+    return task_dataset(data, LocalizeTask(num_rows, num_cols, frames))
+
+
+def actions_or_not_dataset(data, action_classes):
+    return task_dataset(data, ActionsPresentTask(action_classes))
+
+
+def actions_order_dataset(data, n=2, unique=False):
+    return task_dataset(data, ActionsOrderTask(n, unique))
 
 
 def write_to_file(vid_lbl, fname):
@@ -206,47 +331,50 @@ def write_to_file(vid_lbl, fname):
             fout.write('{} {}\n'.format(vname, lbl))
 
 
-def check_avi_broken(fpath):
-    """ Check if the AVI file is broken, i.e. does not have index. This
-    indicates a video that was not fully rendered and must be ignored for the
-    final training/testing. """
-    if osp.exists(fpath + '.lock'):
-        # For any properly rendered video, the lock file must be deleted.
-        return True
-    # TODO(rgirdhar): Also might want to check for empty, overly small files?
-    # So far the AVI without index is able to catch most bad/partially rendered
-    # files.
-    try:
-        output = subprocess.check_output(
-            'ffmpeg -i {}'.format(fpath), shell=True, stderr=subprocess.STDOUT,
-            universal_newlines=True)
-    except subprocess.CalledProcessError as exc:
-        output = exc.output
-    prog = re.compile('.*AVI without index.*', flags=re.DOTALL)
-    if prog.match(output):
-        return True
-    return False
-
-
-def read_data(scene_files):
+def get_video_path(scene_file):
+    return osp.splitext(scene_file.replace('/scenes/', '/images/'))[0] + '.avi'
+
+
+def read_data(scene_files, cache=None, batch_size=READ_BATCH_SIZE):
+    """ Read the metadata of all scenes with a good video. The metadata is
+    projected to the fields the tasks need, with the snitch trajectory but
+    without the per-frame locations of all objects, so memory does not grow
+    much with the number of frames. If a LabelCache is given, scenes that
+    did not change since they were cached are not read again, neither for
+    their metadata nor to localize. The scenes are read in batches, and the
+    videos of a batch checked together. """
     data = {}
-    for scene_file in tqdm(scene_files, desc='Reading metadata'):
-        # TODO(rgirdhar): Make sure to only keep the videos that are readable
-        try:
-            with open(scene_file, 'r') as fin:
-                metadata = json.load(fin)
-            vid_name = osp.splitext(scene_file.replace(
-                '/scenes/', '/images/'))[0] + '.avi'
-            # Ignore videos that were not rendered correctly
-            if check_avi_broken(vid_name):
+    for start in tqdm(range(0, len(scene_files), batch_size),
+                      desc='Reading metadata'):
+        batch = scene_files[start:start + batch_size]
+        cached = OrderedDict(
+            (scene_file, cache.get(scene_file) if cache is not None
+             else None) for scene_file in batch)
+        todo = []
+        # The snitch trajectory is taken while the whole scene is read, a
+        # scene that can not be localized is skipped as unreadable
+        for scene_file, metadata in iter_scenes(
+                [el for el in batch if cached[el] is None],
+                on_read=lambda full, scene: localize.with_trajectory(
+                    scene, full_metadata=full)):
+            cached[scene_file] = {'good': None, 'metadata': metadata}
+            todo.append(scene_file)
+        # Ignore videos that were not rendered correctly
+        broken = check_avis_broken(
+            [get_video_path(el) for el in todo],
+            [cached[el]['metadata']['num_frames'] for el in todo])
+        for scene_file, is_broken in zip(todo, broken):
+            cached[scene_file]['good'] = not is_broken
+            if cache is not None:
+                cache.put(scene_file, cached[scene_file],
+                          video_path=get_video_path(scene_file))
+        for scene_file, entry in cached.items():
+            if entry is None or not entry['good']:
                 continue
-            data[vid_name] = metadata
+            data[get_video_path(scene_file)] = entry['metadata']
             if len(data) > MAX_TOT_VIDEOS:
                 # Since we don't make a list of others, might as well stop here
-                break
-        except Exception as e:
-            logging.error('Unable to read {} due to {}'.format(
-                scene_file, e))
+                return data
     return data
 
 
@@ -279,31 +407,28 @@ def sort_data_for_train_test_split(data):
 def main():
     scene_files = glob.glob(osp.join(OUTPUT_DATA_DIR, 'scenes/*.json'))
     output_dir = osp.join(OUTPUT_DATA_DIR, LIST_DIR)
-    data_cache_fpath = osp.join(OUTPUT_DATA_DIR, 'good_videos.pkl')
-    if osp.exists(data_cache_fpath):
-        print('Found pre-computed file of good rendered data {}'.format(
-            data_cache_fpath))
-        with open(data_cache_fpath, 'r') as fin:
-            data = pkl.load(fin)
-        print('...Read.')
-    else:
-        data = read_data(scene_files)
-        with open(data_cache_fpath, 'w') as fout:
-            pkl.dump(data, fout)
+    # Only the scenes that were added or changed since the last run are read
+    cache = LabelCache(osp.join(OUTPUT_DATA_DIR, 'scene_cache.pkl'),
+                       version=SCENE_CACHE_VERSION)
+    cache.prune(scene_files)
+    data = read_data(scene_files, cache)
+    cache.save()
+    print('Read {} scenes, {} were cached'.format(
+        cache.num_misses, cache.num_hits))
     print('Found {} good videos out of {}'.format(len(data), len(scene_files)))
     train_data, val_data = sort_data_for_train_test_split(data)
     train_data = OrderedDict(train_data)
     val_data = OrderedDict(val_data)
-    dataset_gen_fns = OrderedDict([
-        ('actions_order_uniq', partial(actions_order_dataset, unique=True)),
-        ('localize_4x4', partial(localize_dataset, num_rows=2, num_cols=2)),
-        ('localize_8x8', partial(localize_dataset, num_rows=4, num_cols=4)),
-        ('localize', localize_dataset),
-        ('actions_present', partial(
-            actions_or_not_dataset,
-            action_classes=ACTION_CLASSES)),
+    tasks = OrderedDict([
+        ('actions_order_uniq', ActionsOrderTask(n=2, unique=True)),
+        ('localize_4x4', LocalizeTask(num_rows=2, num_cols=2)),
+        ('localize_8x8', LocalizeTask(num_rows=4, num_cols=4)),
+        ('localize', LocalizeTask()),
+        ('localize_frames', LocalizeTask(frames=LOCALIZE_FRAME_STEP)),
+        ('actions_present', ActionsPresentTask(ACTION_CLASSES)),
     ])
-    for dset_name, dset_fn in dataset_gen_fns.items():
+    todo = OrderedDict()
+    for dset_name, task in tasks.items():
         this_output_dir = osp.join(output_dir, dset_name)
         train_txt_outfpath = osp.join(this_output_dir, 'train.txt')
         train_shuf_txt_outfpath = osp.join(
@@ -313,19 +438,28 @@ def main():
         if not (osp.exists(train_shuf_txt_outfpath) and
                 osp.exists(train_txt_outfpath) and
                 osp.exists(val_txt_outfpath)):
-            train_fnames, train_labels, train_metadata = dset_fn(copy.deepcopy(train_data))
-            val_fnames, val_labels, val_metadata = dset_fn(copy.deepcopy(val_data))
-            # remove datapoints that don't have a valid label
-            vid_lbl_train = [(fname, label) for fname, label in
-                             zip(train_fnames, train_labels) if len(str(label)) > 0]
-            vid_lbl_val = [(fname, label) for fname, label in
-                           zip(val_fnames, val_labels) if len(str(label)) > 0]
-            # split into train and test
-            train_metadata.update(val_metadata)
-            with open(osp.join(this_output_dir, 'metadata.pkl'), 'w') as fout:
-                pkl.dump(train_metadata, fout)
-            write_to_file(vid_lbl_train, train_txt_outfpath)
-            write_to_file(vid_lbl_val, val_txt_outfpath)
+            todo[dset_name] = task
+    # One pass over each split for all the tasks
+    train_labels = compile_labels(train_data, todo)
+    val_labels = compile_labels(val_data, todo)
+    for dset_name, task in todo.items():
+        this_output_dir = osp.join(output_dir, dset_name)
+        train_fnames, train_lbls = train_labels[dset_name]
+        val_fnames, val_lbls = val_labels[dset_name]
+        # remove datapoints that don't have a valid label
+        vid_lbl_train = [(fname, label) for fname, label in
+                         zip(train_fnames, train_lbls) if len(str(label)) > 0]
+        vid_lbl_val = [(fname, label) for fname, label in
+                       zip(val_fnames, val_lbls) if len(str(label)) > 0]
+        with open(osp.join(this_output_dir, 'metadata.pkl'), 'w') as fout:
+            pkl.dump(task.get_metadata(), fout)
+        write_to_file(vid_lbl_train, osp.join(this_output_dir, 'train.txt'))
+        write_to_file(vid_lbl_val, osp.join(this_output_dir, 'val.txt'))
+        for split, vid_lbl in [('train', vid_lbl_train), ('val', vid_lbl_val)]:
+            label_export.write_labels(
+                this_output_dir, split, [el[0] for el in vid_lbl],
+                [el[1] for el in vid_lbl], task.label_kind,
+                num_classes=len(task.classes))
 
 
 if __name__ == '__main__':
@@ -1,72 +1,46 @@
 import json
 import os
-import subprocess
-import re
+import multiprocessing as mp
+from collections import Counter
 from tqdm import tqdm
+from scene_index import SceneIndex
+from avi_index import check_avi_broken, check_avis_broken
+from label_cache import LabelCache
+import label_export
 
 SCENES_FOLDER = 'generate/Out/scenes'
+IMAGES_FOLDER = 'generate/Out/images'
+LABEL_CACHE = 'generate/Out/label_cache.pkl'
+# Bump when the labels are computed differently, to invalidate the cache
+LABEL_CACHE_VERSION = 1
 LABELS_FOLDER = 'generate/Out/'
 
 DICTIONARY = ['EOS', '_containing', '_contain', '_pick_place', '_rotate', '_slide',
               'metal', 'rubber',
               'yellow', 'cyan', 'gold', 'brown', 'red', 'gray', 'purple', 'blue', 'green',
               'sphere', 'cube', 'cylinder', 'cone', 'spl']
+DICTIONARY_INDEX = {word: i for i, word in enumerate(DICTIONARY)}
+# The planner starts the moves of each segment at a multiple of this
+WINDOW_SIZE = 30
+
+# Each scene JSON is parsed once, all the functions below read from here
+SCENE_INDEX = SceneIndex(SCENES_FOLDER)
 
 def get_video(scene):
     """Get the image file name from the scene."""
-    s = json.load(open(f'generate/Out/scenes/{scene}'))
-    video = s['image_filename']
-    if check_avi_broken(f'generate/Out/images/{video}'):
+    record = SCENE_INDEX.get(scene)
+    video = record.video
+    if check_avi_broken(f'{IMAGES_FOLDER}/{video}', record.num_frames):
         print(f'Video {video} is broken')
         return None
     return video
 
-def check_avi_broken(fpath):
-    """ Check if the AVI file is broken, i.e. does not have index.
-    This indicates a video that was not fully rendered and must be ignored for the
-    final training/testing. 
-
-    Args:
-        fpath: Path to the video file.
-    Returns:
-        True if the video is broken, False otherwise.
-    """
-    if os.path.exists(fpath + '.lock'):
-        # For any properly rendered video, the lock file must be deleted.
-        return True
-    # TODO(rgirdhar): Also might want to check for empty, overly small files?
-    # So far the AVI without index is able to catch most bad/partially rendered
-    # files.
-
-    if not os.path.exists(fpath):
-        # If the file does not exist, it is broken.
-        return True
-    try:
-        output = subprocess.check_output(
-            'ffmpeg -i {}'.format(fpath), shell=True, stderr=subprocess.STDOUT,
-            universal_newlines=True)
-    except subprocess.CalledProcessError as exc:
-        output = exc.output
-    prog = re.compile('.*AVI without index.*', flags=re.DOTALL)
-    if prog.match(output):
-        return True
-    return False
-
 def get_moves(scene):
     """ Get the moves for a scene.
     Returns a list of tuples of the form (object_name, action, target, start_frame, end_frame)
     """
-    s = json.load(open(f'generate/Out/scenes/{scene}'))
-    moves = s['movements']
-    cleaned = []
-    for object_name in moves:
-        for ac in moves[object_name]:
-            if ac[0] == '_no_op':
-                continue
-            cleaned.append([object_name]+ac)
-    # Sort by start frame (3rd element of tuple)
-    cleaned.sort(key=lambda x: x[3])
-    return cleaned
+    # Copy, since the callers reorder the moves
+    return [list(move) for move in SCENE_INDEX.get(scene).moves]
 
 def who_contains_who(moves,time_point):
     """
@@ -101,13 +75,10 @@ def detect_overlap(moves):
     return False, None, None
 
 def get_objects(scene):
-    """Get the objects for a scene."""
-    s = json.load(open(f'generate/Out/scenes/{scene}'))
-    objects =  s['objects']
-    cleaned = {} # key is object name, value is color, material, shape
-    for obj in objects:
-        cleaned[obj['instance']] = (obj['color'], obj["material"], obj['shape'])
-    return cleaned
+    """Get the objects for a scene.
+    Returns a dict where the key is the object name, value is (color, material, shape)
+    """
+    return SCENE_INDEX.get(scene).objects
 
 def instance_to_label(scene, instance):
     """Converts the instance to the object's label.
@@ -120,10 +91,24 @@ def instance_to_label(scene, instance):
 
 def get_dictionary_label(label):
     """Converts the label to the index in the dictionary."""
-    dictionary_label = []
-    for i in range(len(label)):
-        dictionary_label.append(DICTIONARY.index(label[i]))
-    return dictionary_label
+    return [DICTIONARY_INDEX[token] for token in label]
+
+def move_in_window(move, start, window_size=WINDOW_SIZE):
+    """True if the move is fully inside the window of frames start to
+    start + window_size, both included (the windows share their boundary
+    frame, where a move may end).
+    """
+    return move[3] >= start and move[4] <= start + window_size
+
+def find_missing_window(moves):
+    """Returns the first 30 frame interval (start, end) without a move fully
+    inside it, or None if every interval has one.
+    """
+    for i in range(3):
+        start = i * WINDOW_SIZE
+        if not any(move_in_window(move, start) for move in moves):
+            return (start, start + WINDOW_SIZE)
+    return None
 
 def check_moves(moves):
     """Check if every 30 frames there is at least 1 move.
@@ -131,17 +116,8 @@ def check_moves(moves):
     """
     if len(moves) == 0:
         return False
-    for i in range(3):
-        found = False
-        for move in moves:
-            if move[3] >= i*30 and move[4] <= (i+1)*30:
-                found = True
-                break
-        if not found:
-            print(f'No move found in interval {i*30} to {(i+1)*30}, moves: {moves}')
-            return False
-    return True
-    
+    return find_missing_window(moves) is None
+
 
 def get_label(scene):
     """Get the label for a scene."""
@@ -169,31 +145,99 @@ def get_label(scene):
             label.extend(instance_to_label(scene, moves[i][0]))
         
     dict_label = get_dictionary_label(label)
-    dict_label.append(DICTIONARY.index('EOS')) # always end with EOS
+    dict_label.append(DICTIONARY_INDEX['EOS']) # always end with EOS
     return dict_label
 
-def get_all_labels():
-    """Get all labels for all scenes."""
-    scenes = os.listdir(SCENES_FOLDER)
+def label_scene(scene):
+    """Get the video and label for a scene.
+    Returns (record, video, label, skip) where record is the parsed scene and
+    skip is None, or a dict with the reason the scene can not be used.
+    The video is not checked here, see check_videos.
+    """
+    try:
+        record = SCENE_INDEX.get(scene)
+        video = record.video
+        moves = get_moves(scene)
+        if len(moves) == 0:
+            return record, None, None, {'scene': scene, 'reason': 'no_moves'}
+        window = find_missing_window(moves)
+        if window is not None:
+            return record, None, None, {'scene': scene, 'reason': 'missing_move_in_window',
+                                        'window': window, 'moves': moves}
+        return record, video, get_label(scene), None
+    finally:
+        # Each scene is only needed once here, keep the memory bounded
+        SCENE_INDEX.evict(scene)
+
+def check_videos(results):
+    """Skip the scenes of results (from label_scene) with a broken video.
+    The videos are checked all at once from a thread pool, which is I/O bound
+    and cheaper than checking them one by one in the label workers.
+    """
+    broken = check_avis_broken(
+        [f'{IMAGES_FOLDER}/{el["record"].video}' for el in results],
+        [el['record'].num_frames for el in results])
+    for result, is_broken in zip(results, broken):
+        if is_broken:
+            result.update(video=None, label=None, skip={
+                'scene': result['record'].name, 'reason': 'broken_video',
+                'video': result['record'].video})
+
+def get_all_labels(num_workers=None, cache_path=LABEL_CACHE):
+    """Get all labels for all scenes.
+    The scenes are labeled in parallel, the labels are returned in the sorted
+    order of the scenes. Returns the labels as (video, label) tuples and the
+    skipped scenes as dicts with the reason they were skipped.
+    Results are cached in cache_path, so only scenes that were added or
+    changed since the last run are labeled again. Set it to None to disable.
+    """
+    # The folder also has the trajectory files of --compact_trajectories
+    scenes = [el for el in os.listdir(SCENES_FOLDER) if el.endswith('.json')]
     scenes.sort()
-    
-    skipped = 0
+    scene_paths = [f'{SCENES_FOLDER}/{scene}' for scene in scenes]
+
+    results = {}
+    cache = None
+    if cache_path is not None:
+        cache = LabelCache(cache_path, version=LABEL_CACHE_VERSION)
+        cache.prune(scene_paths)
+        for scene, scene_path in zip(scenes, scene_paths):
+            value = cache.get(scene_path)
+            if value is not None:
+                results[scene] = value
+        print(f'Found {len(results)} of {len(scenes)} scenes in the label cache')
+    todo = [scene for scene in scenes if scene not in results]
+
+    num_workers = num_workers or mp.cpu_count()
+    # Large enough chunks to keep the IPC overhead low, small enough to keep
+    # all workers busy until the end
+    chunksize = max(1, len(todo) // (num_workers * 16))
+    new_results = []
+    with mp.Pool(num_workers) as pool:
+        for record, video, label, skip in tqdm(
+                pool.imap(label_scene, todo, chunksize=chunksize), total=len(todo)):
+            results[record.name] = {'record': record, 'video': video, 'label': label, 'skip': skip}
+            new_results.append(results[record.name])
+    check_videos(new_results)
+    if cache is not None:
+        for result in new_results:
+            record = result['record']
+            cache.put(f'{SCENES_FOLDER}/{record.name}', result,
+                      video_path=f'{IMAGES_FOLDER}/{record.video}')
+    if cache is not None:
+        cache.save()
+
+    skipped = []
     labels = []
-    for i in tqdm(range(len(scenes))):
-        video = get_video(scenes[i])
-        if video is None:
-            skipped += 1
-            print(f'No video for {scenes[i]}')
+    for scene in scenes:
+        result = results[scene]
+        if result['skip'] is not None:
+            skipped.append(result['skip'])
             continue
-        label = get_label(scenes[i])
-        if label is None:
-            skipped += 1
-            print(f'No label for {scenes[i]}')
-            continue
-        #print(scenes[i], video, label)
-        labels.append((video,label))
-    print(f'Skipped {skipped} scenes')
-    return labels
+        labels.append((result['video'], result['label']))
+    reasons = Counter(skip['reason'] for skip in skipped)
+    print(f'Skipped {len(skipped)} scenes: {dict(reasons)}')
+    return labels, skipped
 
 def split_train_val_test(labels):
     """First split 20% of the data into test
@@ -207,10 +251,10 @@ def split_train_val_test(labels):
     - green rubber cone
     """
     def is_test_label(label):
-        action_color_material = label[0] == DICTIONARY.index('_rotate') and label[1] == DICTIONARY.index('blue') and label[2] == DICTIONARY.index('rubber')
-        action_color_shape = label[0] == DICTIONARY.index('_slide') and label[1] == DICTIONARY.index('red') and label[3] == DICTIONARY.index('cube')
-        action_material_shape = label[0] == DICTIONARY.index('_pick_place') and label[2] == DICTIONARY.index('metal') and label[3] == DICTIONARY.index('sphere')
-        color_material_shape = label[1] == DICTIONARY.index('green') and label[2] == DICTIONARY.index('rubber') and label[3] == DICTIONARY.index('cone')
+        action_color_material = label[0] == DICTIONARY_INDEX['_rotate'] and label[1] == DICTIONARY_INDEX['blue'] and label[2] == DICTIONARY_INDEX['rubber']
+        action_color_shape = label[0] == DICTIONARY_INDEX['_slide'] and label[1] == DICTIONARY_INDEX['red'] and label[3] == DICTIONARY_INDEX['cube']
+        action_material_shape = label[0] == DICTIONARY_INDEX['_pick_place'] and label[2] == DICTIONARY_INDEX['metal'] and label[3] == DICTIONARY_INDEX['sphere']
+        color_material_shape = label[1] == DICTIONARY_INDEX['green'] and label[2] == DICTIONARY_INDEX['rubber'] and label[3] == DICTIONARY_INDEX['cone']
         return action_color_material or action_color_shape or action_material_shape or color_material_shape
 
     test = []
@@ -251,29 +295,30 @@ def split_train_val_test(labels):
     return train, val, test_, test_val
 
 def format_prettier(labels):
-    pretty = ""
-    for i in range(len(labels)):
-        pretty += labels[i][0] + ':' # video
-        pretty += str(labels[i][1]).replace(' ','')[1:-1] + '\n' # label but without the brackets and spaces
-        
-    return pretty
+    lines = []
+    for video, label in labels:
+        # label but without the brackets and spaces
+        lines.append(video + ':' + str(label).replace(' ','')[1:-1] + '\n')
+    return ''.join(lines)
 
 if __name__ == '__main__':
-    labels = get_all_labels()
+    labels, skipped = get_all_labels()
+    with open(f'{LABELS_FOLDER}skipped.json', 'w') as f:
+        json.dump(skipped, f, indent=1)
     train, val, test_, test_val = split_train_val_test(labels)
     sum_ = len(train) + len(val) + len(test_) + len(test_val)
     print(F'Train: {len(train)}/{sum_} = {len(train)/sum_}')
     print(F'Val: {len(val)}/{sum_} = {len(val)/sum_}')
     print(F'Test: {len(test_)}/{sum_} = {len(test_)/sum_}')
     print(F'Test val: {len(test_val)}/{sum_} = {len(test_val)/sum_}')
-    with open(f'{LABELS_FOLDER}train.txt', 'w') as f:
-        f.write(format_prettier(train))
-    with open(f'{LABELS_FOLDER}val.txt', 'w') as f:
-        f.write(format_prettier(val))
-    with open(f'{LABELS_FOLDER}test.txt', 'w') as f:
-        f.write(format_prettier(test_))
-    with open(f'{LABELS_FOLDER}test_val.txt', 'w') as f:
-        f.write(format_prettier(test_val))
+    for split, split_labels in [('train', train), ('val', val),
+                                ('test', test_), ('test_val', test_val)]:
+        with open(f'{LABELS_FOLDER}{split}.txt', 'w') as f:
+            f.write(format_prettier(split_labels))
+        label_export.write_labels(
+            LABELS_FOLDER, split, [el[0] for el in split_labels],
+            [el[1] for el in split_labels], 'sequence',
+            num_classes=len(DICTIONARY))
     print('Done')
     
 
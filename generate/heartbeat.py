@@ -0,0 +1,135 @@
+from __future__ import print_function
+
+import json
+import os
+import socket
+import time
+
+
+"""
+Worker heartbeats for launch.py. Each render_videos.py worker keeps a small
+JSON status file up to date with the scene and stage it is working on, how
+many frames of the current video are done (of each view in turn, with
+--num_views) and how many videos it finished.
+The launcher reads all of them to show the fleet progress (see
+fleet_status.py). The module level functions are no-ops unless `start` was
+called, so render_videos.py can call them unconditionally.
+"""
+
+_ACTIVE = None
+
+
+class Heartbeat:
+    def __init__(self, fpath, slot=None, device=None):
+        self.fpath = fpath
+        now = time.time()
+        if device is None:
+            device = os.environ.get('CUDA_VISIBLE_DEVICES')
+        self.state = {
+            'slot': slot,
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'gpu': device,
+            'started': now,
+            'updated': now,
+            'index': None,
+            'view': None,
+            'stage': 'starting',
+            'frames_done': 0,
+            'num_frames': None,
+            'sec_per_frame': None,
+            'scenes_done': 0,
+            'scenes_failed': 0,
+            'render_seconds': 0.0,
+            'finished': False,
+        }
+        self._last_frame_time = None
+
+    def write(self):
+        self.state['updated'] = time.time()
+        # Write to a temp file and rename, so readers never see partial files
+        tmp_fpath = '{}.{}.tmp'.format(self.fpath, os.getpid())
+        with open(tmp_fpath, 'w') as fout:
+            json.dump(self.state, fout)
+        os.replace(tmp_fpath, self.fpath)
+
+    def update(self, **kwargs):
+        self.state.update(kwargs)
+        self.write()
+
+    def start_scene(self, index, num_frames):
+        self.state['index'] = index
+        self.state['view'] = None
+        self.state['num_frames'] = num_frames
+        self.state['frames_done'] = 0
+        self._last_frame_time = None
+        self.update(stage='setup')
+
+    def start_render(self, view=0):
+        # frames_done counts the frames of this view's video only
+        self.state['view'] = view
+        self.state['frames_done'] = 0
+        self._last_frame_time = time.time()
+        self.update(stage='render' if view == 0 else
+                    'render_view{}'.format(view))
+
+    def frame_done(self):
+        now = time.time()
+        if self._last_frame_time is not None:
+            seconds = now - self._last_frame_time
+            self.state['render_seconds'] += seconds
+            # Smooth over frames so a single slow frame does not dominate
+            if self.state['sec_per_frame'] is None:
+                self.state['sec_per_frame'] = seconds
+            else:
+                self.state['sec_per_frame'] = (
+                    0.9 * self.state['sec_per_frame'] + 0.1 * seconds)
+        self._last_frame_time = now
+        self.state['frames_done'] += 1
+        self.write()
+
+    def finish_scene(self, failed=False):
+        if failed:
+            self.state['scenes_failed'] += 1
+        else:
+            self.state['scenes_done'] += 1
+        self.update(stage='idle')
+
+
+def start(fpath, slot=None, device=None):
+    global _ACTIVE
+    _ACTIVE = Heartbeat(fpath, slot=slot, device=device)
+    _ACTIVE.write()
+    return _ACTIVE
+
+
+def stop():
+    global _ACTIVE
+    if _ACTIVE is not None:
+        _ACTIVE.update(stage='finished', finished=True)
+    _ACTIVE = None
+
+
+def update(**kwargs):
+    if _ACTIVE is not None:
+        _ACTIVE.update(**kwargs)
+
+
+def start_scene(index, num_frames):
+    if _ACTIVE is not None:
+        _ACTIVE.start_scene(index, num_frames)
+
+
+def start_render(view=0):
+    if _ACTIVE is not None:
+        _ACTIVE.start_render(view)
+
+
+def frame_done():
+    if _ACTIVE is not None:
+        _ACTIVE.frame_done()
+
+
+def finish_scene(failed=False):
+    if _ACTIVE is not None:
+        _ACTIVE.finish_scene(failed=failed)
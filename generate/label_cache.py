@@ -0,0 +1,101 @@
+import hashlib
+import os
+import os.path as osp
+try:
+    import cPickle as pkl
+except ImportError:
+    import pickle as pkl
+
+
+"""
+Persistent cache of per-scene results for the label tools, so a rerun only
+processes the scenes that were added or changed since the last one. Entries
+are keyed by the scene path. An entry is valid as long as the scene file has
+the same size and mtime (or, if only the mtime changed, the same content
+hash), and the video it was stored with, if any, still has the same size and
+mtime. Entries of deleted scenes are dropped with `prune`.
+"""
+
+
+def file_hash(fpath):
+    sha = hashlib.sha1()
+    with open(fpath, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _stat(fpath):
+    """ (size, mtime) of the file, or None if it does not exist. """
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+def _video_stat(fpath):
+    # The renderer removes the lock only after the video is written, so a
+    # video can turn good without changing
+    return _stat(fpath), osp.exists(fpath + '.lock')
+
+
+class LabelCache:
+    def __init__(self, fpath, version=1):
+        """
+        version: Bump it when the cached values are computed differently,
+            this invalidates all the entries of older versions.
+        """
+        self.fpath = fpath
+        self.version = version
+        self.entries = {}
+        self.num_hits = 0
+        self.num_misses = 0
+        if osp.exists(fpath):
+            with open(fpath, 'rb') as fin:
+                cached = pkl.load(fin)
+            if cached.get('version') == version:
+                self.entries = cached['entries']
+
+    def get(self, scene_path):
+        """ Returns the cached value, or None if missing or outdated. """
+        entry = self.entries.get(scene_path)
+        if entry is None or (
+                entry['video_path'] is not None and
+                _video_stat(entry['video_path']) != entry['video_stat']):
+            self.num_misses += 1
+            return None
+        scene_stat = _stat(scene_path)
+        if scene_stat != entry['stat']:
+            if scene_stat is None or scene_stat[0] != entry['stat'][0] or \
+                    file_hash(scene_path) != entry['hash']:
+                self.num_misses += 1
+                return None
+            # Only touched, remember the new mtime
+            entry['stat'] = scene_stat
+        self.num_hits += 1
+        return entry['value']
+
+    def put(self, scene_path, value, video_path=None):
+        self.entries[scene_path] = {
+            'stat': _stat(scene_path),
+            'hash': file_hash(scene_path),
+            'video_path': video_path,
+            'video_stat': _video_stat(video_path) if video_path is not None
+            else None,
+            'value': value,
+        }
+
+    def prune(self, scene_paths):
+        """ Drop the entries of all scenes that are not in scene_paths. """
+        scene_paths = set(scene_paths)
+        for scene_path in list(self.entries.keys()):
+            if scene_path not in scene_paths:
+                del self.entries[scene_path]
+
+    def save(self):
+        tmp_fpath = self.fpath + '.tmp'
+        with open(tmp_fpath, 'wb') as fout:
+            pkl.dump({'version': self.version, 'entries': self.entries}, fout,
+                     pkl.HIGHEST_PROTOCOL)
+        os.rename(tmp_fpath, self.fpath)
@@ -0,0 +1,106 @@
+import json
+import os.path as osp
+
+import numpy as np
+
+
+"""
+Binary export of the label lists, written next to the text files so training
+loaders can memory map them instead of parsing text on every epoch. For each
+split there is a table of the video file names ({split}_videos.npy) and,
+depending on the kind of labels:
+  class: one class id per video ({split}_labels.npy)
+  multi_hot: a set of class ids per video, as a CSR matrix
+    ({split}_indptr.npy, {split}_indices.npy); the class ids of video i are
+    indices[indptr[i]:indptr[i + 1]]
+  sequence: a list of ids per video (tokens, per-frame classes), padded with
+    PAD ({split}_tokens.npy) with the lengths in {split}_lengths.npy
+{split}_info.json has the kind, number of videos and number of classes.
+"""
+
+KINDS = ('class', 'multi_hot', 'sequence')
+PAD = -1
+
+
+def parse_label(label):
+    """ List of ints from a label: an int, a list of ints or a comma
+    separated string as in the text files. """
+    if isinstance(label, (list, tuple, np.ndarray)):
+        return [int(el) for el in label]
+    label = str(label)
+    return [int(el) for el in label.split(',') if el != '']
+
+
+def _smallest_int_dtype(max_value):
+    for dtype in (np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _fpath(output_dir, split, name):
+    return osp.join(output_dir, '{}_{}'.format(split, name))
+
+
+def write_labels(output_dir, split, videos, labels, kind, num_classes=None):
+    """ Write the binary label files of a split. """
+    assert kind in KINDS, 'Unknown label kind {}'.format(kind)
+    assert len(videos) == len(labels)
+    labels = [parse_label(el) for el in labels]
+    max_value = max([max(el) for el in labels if el] or [0])
+    if num_classes is None:
+        num_classes = max_value + 1
+    dtype = _smallest_int_dtype(max(max_value, num_classes))
+    np.save(_fpath(output_dir, split, 'videos.npy'),
+            np.array(list(videos), dtype='U'))
+    if kind == 'class':
+        assert all([len(el) == 1 for el in labels])
+        np.save(_fpath(output_dir, split, 'labels.npy'),
+                np.array([el[0] for el in labels], dtype=dtype))
+    elif kind == 'multi_hot':
+        indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(el) for el in labels])
+        indices = np.array([cls for el in labels for cls in sorted(el)],
+                           dtype=dtype)
+        np.save(_fpath(output_dir, split, 'indptr.npy'), indptr)
+        np.save(_fpath(output_dir, split, 'indices.npy'), indices)
+    else:
+        lengths = np.array([len(el) for el in labels], dtype=np.int32)
+        tokens = np.full((len(labels), lengths.max() if len(labels) else 0),
+                         PAD, dtype=dtype)
+        for i, el in enumerate(labels):
+            tokens[i, :len(el)] = el
+        np.save(_fpath(output_dir, split, 'tokens.npy'), tokens)
+        np.save(_fpath(output_dir, split, 'lengths.npy'), lengths)
+    with open(_fpath(output_dir, split, 'info.json'), 'w') as fout:
+        json.dump({'kind': kind, 'num_videos': len(videos),
+                   'num_classes': num_classes, 'pad': PAD}, fout)
+
+
+def read_labels(output_dir, split, mmap_mode='r'):
+    """ Load the binary label files of a split, as a dict with the info and
+    the arrays (memory mapped by default). """
+    with open(_fpath(output_dir, split, 'info.json'), 'r') as fin:
+        labels = json.load(fin)
+    names = {
+        'class': ['videos', 'labels'],
+        'multi_hot': ['videos', 'indptr', 'indices'],
+        'sequence': ['videos', 'tokens', 'lengths'],
+    }[labels['kind']]
+    for name in names:
+        labels[name] = np.load(_fpath(output_dir, split, name + '.npy'),
+                               mmap_mode=mmap_mode)
+    return labels
+
+
+def multi_hot_dense(labels, rows=None):
+    """ Dense (num videos, num classes) bool matrix of multi_hot labels from
+    read_labels, for all videos or the given rows. """
+    indptr, indices = labels['indptr'], labels['indices']
+    if rows is None:
+        rows = np.arange(len(indptr) - 1)
+    rows = np.asarray(rows)
+    dense = np.zeros((len(rows), labels['num_classes']), dtype=bool)
+    for i, row in enumerate(rows):
+        dense[i, indices[indptr[row]:indptr[row + 1]]] = True
+    return dense
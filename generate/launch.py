@@ -1,7 +1,14 @@
 import multiprocessing as mp
 import subprocess
 import argparse
+import os.path as osp
+import time
+import glob
 import numpy as np
+import fleet_status
+import cpu_farm
+import scene_log
+from gen_utils import mkdir_p
 
 DATA_MOUNT_POINT = '/home/ramtin/code/uni-thesis/CATER/generate/'
 OUT_DIR = 'Out' 
@@ -11,6 +18,7 @@ MAX_MOTIONS = 1
 NUM_IMAGES = 5500 #how many videos to generate
 NUM_FRAMES = 90 #how many frames per video
 FPS = 10
+NUM_VIEWS = 1 #camera views rendered per planned scene
 
 
 
@@ -22,6 +30,28 @@ def parse_args():
     parser.add_argument(
         '--num_jobs', '-n', default=1, type=int,
         help='Run n jobs per GPU')
+    parser.add_argument(
+        '--status_interval', default=30, type=int,
+        help='Seconds between two fleet status updates')
+    parser.add_argument(
+        '--stall_timeout', default=300, type=int,
+        help='Report a worker as stalled if its heartbeat is older than '
+             'this many seconds')
+    parser.add_argument(
+        '--cpu_farm', action='store_true',
+        help='Render on CPUs only. Benchmarks a reference scene to pick the '
+             'number of workers, threads and tile size, and pins every '
+             'worker to its own set of cores.')
+    parser.add_argument(
+        '--cpu_workers', default=None, type=int,
+        help='Number of CPU workers. Skips the benchmark if --tile_size is '
+             'also given.')
+    parser.add_argument(
+        '--tile_size', default=None, type=int,
+        help='Tile size for CPU workers.')
+    parser.add_argument(
+        '--bench_frames', default=4, type=int,
+        help='Number of frames to render for the CPU benchmark')
     return parser.parse_args()
 
 
@@ -31,44 +61,132 @@ def get_gpu_count():
     return count
 
 
-def run_blender(gpu_id):
-    # sleep for a random time, to make sure it does not overlap!
-    sleep_time = 1 + int(np.random.random() * 5)  # upto 6 seconds
-    subprocess.call('sleep {}'.format(sleep_time), shell=True)
-
+def get_blender_cmd(output_dir, num_images=NUM_IMAGES, num_frames=NUM_FRAMES,
+                    extra_args=''):
     blender_path='/opt/blender-2.79/blender'
     cam_motion='--random_camera' if CAM_MOTION else ''
     max_motions='--max_motions={}'.format(MAX_MOTIONS)
 
-    cmd = f'CUDA_VISIBLE_DEVICES="{gpu_id}" \
-            {blender_path} \
+    cmd = f'{blender_path} \
             data/base_scene.blend \
             --background --python render_videos.py -- \
-            --num_images {NUM_IMAGES} \
-            --num_frames {NUM_FRAMES} \
+            --num_images {num_images} \
+            --num_frames {num_frames} \
             --fps {FPS} \
+            --num_views {NUM_VIEWS} \
             --suppress_blender_logs \
             --save_blendfiles 0 \
             {cam_motion} \
             {max_motions} \
             --filename_prefix {NAME} \
-            --output_dir {DATA_MOUNT_POINT}{OUT_DIR} \
-            --output_scene_file {DATA_MOUNT_POINT}{OUT_DIR}/scene.json \
+            --output_dir {output_dir} \
+            {extra_args} \
             '
+    return cmd
+
+
+def get_cpu_args(threads, tile_size):
+    return f'--cpu --threads {threads} --render_tile_size {tile_size}'
+
+
+def run_blender(worker):
+    # sleep for a random time, to make sure it does not overlap!
+    sleep_time = 1 + int(np.random.random() * 5)  # upto 6 seconds
+    subprocess.call('sleep {}'.format(sleep_time), shell=True)
+
+    slot = worker['slot']
+    heartbeat_file = fleet_status.heartbeat_path(STATUS_DIR, slot)
+    extra_args = f'--heartbeat_file {heartbeat_file} --worker_slot {slot} ' + \
+        worker.get('extra_args', '')
+    cmd = get_blender_cmd(f'{DATA_MOUNT_POINT}{OUT_DIR}',
+                          extra_args=extra_args)
+    if worker.get('cores') is not None:
+        node, cpus = worker['cores']
+        cmd = 'CUDA_VISIBLE_DEVICES="" ' + \
+            cpu_farm.pinned_command(cmd, node, cpus)
+    else:
+        cmd = f'CUDA_VISIBLE_DEVICES="{worker["gpu"]}" {cmd}'
 
     print('Running {}'.format(cmd))
-    subprocess.call(cmd, shell=True)
+    return subprocess.call(cmd, shell=True)
+
+
+def get_cpu_workers(args):
+    """ Size and pin the CPU workers, benchmarking if not specified. """
+    if args.cpu_workers is not None and args.tile_size is not None:
+        num_workers, tile_size = args.cpu_workers, args.tile_size
+    else:
+        def make_cmd(output_dir, threads, tile_size):
+            # Saves the reference scene once, and loads it after that
+            return get_blender_cmd(
+                output_dir, num_images=1, num_frames=args.bench_frames,
+                extra_args=get_cpu_args(threads, tile_size) +
+                ' --save_blendfiles 1')
+        best, _ = cpu_farm.choose_config(
+            make_cmd, NUM_FRAMES,
+            worker_counts=([args.cpu_workers] if args.cpu_workers else None),
+            tile_sizes=([args.tile_size] if args.tile_size else None),
+            num_views=NUM_VIEWS)
+        num_workers, tile_size = best['workers'], best['tile_size']
+        print(f'Best CPU config: {best}')
+    cores = cpu_farm.split_cores(num_workers)
+    threads = min(len(cpus) for _, cpus in cores)
+    print(f'Running {num_workers} CPU workers with {threads} threads and '
+          f'tile size {tile_size}')
+    return [{
+        'slot': slot,
+        'cores': el,
+        'extra_args': get_cpu_args(threads, tile_size),
+    } for slot, el in enumerate(cores)]
+
+
+def monitor(result, num_slots, args):
+    """ Print and store the fleet status until all workers are done. """
+    start_time = time.time()
+    initial_done = fleet_status.count_finished_videos(
+        osp.join(DATA_MOUNT_POINT, OUT_DIR, 'images'))
+    status_fpath = osp.join(STATUS_DIR, 'status.json')
+    while True:
+        finished = result.ready()
+        summary = fleet_status.summarize(
+            fleet_status.read_heartbeats(STATUS_DIR), start_time, NUM_IMAGES,
+            initial_done=initial_done, stall_timeout=args.stall_timeout)
+        summary['slots_launched'] = num_slots
+        summary['launcher_finished'] = finished
+        fleet_status.write_status(summary, status_fpath)
+        print(fleet_status.format_summary(summary), flush=True)
+        if finished:
+            break
+        result.wait(args.status_interval)
+    print(f'Status written to {status_fpath}')
 
 
+STATUS_DIR = osp.join(DATA_MOUNT_POINT, OUT_DIR, 'status')
 args = parse_args()
-if args.gpus is None:
-    ngpus = get_gpu_count()
-    gpu_ids = list(range(ngpus))
+if args.cpu_farm:
+    workers = get_cpu_workers(args)
 else:
-    gpu_ids = [int(el) for el in args.gpus.split(',')]
-ngpus = len(gpu_ids)
-print('Found {} GPUs. Using all of those.'.format(ngpus))
-# Repeat jobs per GPU
-gpu_ids *= args.num_jobs
-pool = mp.Pool(len(gpu_ids))
-pool.map(run_blender, gpu_ids)
+    if args.gpus is None:
+        ngpus = get_gpu_count()
+        gpu_ids = list(range(ngpus))
+    else:
+        gpu_ids = [int(el) for el in args.gpus.split(',')]
+    ngpus = len(gpu_ids)
+    print('Found {} GPUs. Using all of those.'.format(ngpus))
+    # Repeat jobs per GPU
+    gpu_ids *= args.num_jobs
+    workers = [{'slot': slot, 'gpu': gpu_id}
+               for slot, gpu_id in enumerate(gpu_ids)]
+mkdir_p(STATUS_DIR)
+fleet_status.clear_heartbeats(STATUS_DIR)
+pool = mp.Pool(len(workers))
+result = pool.map_async(run_blender, workers)
+monitor(result, len(workers), args)
+pool.close()
+pool.join()
+# Combine the scenes logged by all workers
+scene_logs = sorted(glob.glob(
+    osp.join(DATA_MOUNT_POINT, OUT_DIR, 'scene_logs', '*.jsonl')))
+num_scenes = scene_log.merge(
+    scene_logs, osp.join(DATA_MOUNT_POINT, OUT_DIR, 'scene.json'))
+print(f'Merged {num_scenes} scenes from {len(scene_logs)} worker logs')
@@ -0,0 +1,123 @@
+import numpy as np
+
+from scene_index import read_locations, read_trajectories
+
+
+"""
+Vectorized localization of the snitch. The snitch trajectories of all videos
+are loaded into one array, and the grid cell (class id) the snitch is in is
+computed for any number of grid sizes and frames in a single array operation,
+so per-frame localization labels cost about the same as the last frame only.
+"""
+
+# The plane is split into 2 * NUM_ROWS x 2 * NUM_COLS cells of 1 unit each;
+# other grid sizes are scaled to cover the same area
+NUM_ROWS = 3
+NUM_COLS = 3
+# Class id of the frames past the end of shorter videos
+PAD = -1
+# Metadata key of the trajectories stored by with_trajectory
+TRAJECTORY_KEY = '{}_trajectory'
+
+
+def get_trajectory(metadata, shape='spl'):
+    """ (num frames, 2) array with the x, y positions of the object. The
+    trajectory stored by with_trajectory is used if there is one, or else
+    the locations are read from the scene or trajectory file if the metadata
+    was projected without them (see scene_index.project_scene). """
+    key = TRAJECTORY_KEY.format(shape)
+    if key in metadata:
+        return metadata[key]
+    if 'trajectory_file' in metadata:
+        object = [el for el in metadata['objects'] if el['shape'] == shape][0]
+        return read_trajectories(metadata).get(object['instance'])[:, :2]
+    locations = list(read_locations(metadata, shape).values())[0]
+    return np.array([locations[str(i)][:2] for i in range(len(locations))],
+                    dtype=np.float64)
+
+
+def with_trajectory(metadata, shape='spl', full_metadata=None):
+    """ Store the trajectory of the object in the (projected) metadata, so
+    it is cached with it and localizing does not read the scene again. If
+    the full metadata it was projected from is given, the trajectory is
+    taken from there instead of the scene file. """
+    source = metadata
+    if full_metadata is not None:
+        source = dict(full_metadata, scene_file=metadata.get('scene_file'))
+    metadata[TRAJECTORY_KEY.format(shape)] = get_trajectory(source, shape)
+    return metadata
+
+
+def get_trajectories(metadatas, shape='spl'):
+    """
+    Returns a (num videos, max frames, 2) array with the positions of the
+    object in each video, and the number of frames of each video. Shorter
+    videos are padded with their last position.
+    """
+    trajectories = [get_trajectory(metadata, shape) for metadata in metadatas]
+    num_frames = np.array([len(el) for el in trajectories], dtype=np.int64)
+    max_frames = num_frames.max() if len(num_frames) else 1
+    positions = np.empty((len(trajectories), max_frames, 2), dtype=np.float64)
+    for i, trajectory in enumerate(trajectories):
+        positions[i, :len(trajectory)] = trajectory
+        positions[i, len(trajectory):] = trajectory[-1]
+    return positions, num_frames
+
+
+def get_frame_ids(num_frames, frames=None):
+    """
+    Frames to localize in each video. Returns a (num videos, max frames to
+    localize) array of indices into the trajectories, and the number of
+    frames to localize in each video. The indices past that number are only
+    padding (the last frame of the video).
+    frames: None for the last frame of each video, 'all' for all frames, or
+        an int n for every n-th frame.
+    """
+    num_frames = np.asarray(num_frames, dtype=np.int64)
+    if frames is None:
+        return ((num_frames - 1)[:, np.newaxis],
+                np.ones(len(num_frames), dtype=np.int64))
+    step = 1 if frames == 'all' else int(frames)
+    # Frames 0, step, 2 * step, ... before the end of each video
+    lengths = (num_frames + step - 1) // step
+    frame_ids = np.arange(lengths.max() if len(lengths) else 0) * step
+    frame_ids = np.minimum(frame_ids[np.newaxis],
+                           (num_frames - 1)[:, np.newaxis])
+    return frame_ids, lengths
+
+
+def localize_classes(positions, grids):
+    """
+    Class ids of the grid cells the positions fall in, for each grid.
+    positions: (..., 2) array of x, y positions on the plane.
+    grids: list of (num_rows, num_cols).
+    Returns a (len(grids), ...) int array.
+    """
+    # NOTE that this code is now also being used by proj_utils to go from
+    # 2D coordinates on plane to class ID. So change that too if this gets
+    # changed.
+    positions = np.asarray(positions, dtype=np.float64)
+    grids = np.array(grids, dtype=np.int64).reshape(
+        (-1, 2) + (1,) * (positions.ndim - 1))
+    num_rows, num_cols = grids[:, 0], grids[:, 1]
+    # Scale the positions to the grid size
+    pos_x = positions[..., 0] * (num_cols * 1.0 / NUM_COLS)
+    pos_y = positions[..., 1] * (num_rows * 1.0 / NUM_ROWS)
+    # Without floor it would screw up on negative axis
+    x = np.floor(pos_x).astype(np.int64) + num_cols
+    y = np.floor(pos_y).astype(np.int64) + num_rows
+    return y * (2 * num_cols) + x
+
+
+def localize(positions, num_frames, grids, frames=None):
+    """
+    Localize the trajectories from get_trajectories for all grids and frames
+    at once. Returns a (len(grids), num videos, max frames to localize) array
+    of class ids, PAD after the frames of shorter videos.
+    """
+    frame_ids, lengths = get_frame_ids(num_frames, frames)
+    video_ids = np.arange(len(positions))[:, np.newaxis]
+    class_ids = localize_classes(positions[video_ids, frame_ids], grids)
+    class_ids[:, np.arange(frame_ids.shape[1]) >= lengths[:, np.newaxis]] = \
+        PAD
+    return class_ids
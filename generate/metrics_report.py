@@ -0,0 +1,134 @@
+import argparse
+import glob
+import json
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+"""
+Summarize the per-scene metrics written by render_videos.py (--metrics_file).
+Prints percentiles for every stage timer and counter across all scenes.
+
+python metrics_report.py Out/metrics.jsonl
+"""
+
+PERCENTILES = [50, 90, 99]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Aggregate render_videos.py metrics logs')
+    parser.add_argument(
+        'metrics_files', nargs='+',
+        help='Metrics JSON lines files (glob patterns are expanded)')
+    parser.add_argument(
+        '--include_failed', action='store_true',
+        help='Also aggregate scenes that failed to render')
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Print the summary as JSON instead of a table')
+    return parser.parse_args()
+
+
+def read_metrics(patterns):
+    """ Yield the metrics dict of every scene in the given files. """
+    fpaths = []
+    for pattern in patterns:
+        fpaths += sorted(glob.glob(pattern)) or [pattern]
+    for fpath in fpaths:
+        with open(fpath, 'r') as fin:
+            for line in fin:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Most likely a line cut off by a killed worker
+                    continue
+
+
+def summarize_values(values):
+    values = np.asarray(values, dtype=np.float64)
+    res = OrderedDict([
+        ('n', int(values.size)),
+        ('mean', float(values.mean())),
+        ('total', float(values.sum())),
+    ])
+    for q, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        res['p{}'.format(q)] = float(v)
+    res['max'] = float(values.max())
+    return res
+
+
+def summarize(records, include_failed=False):
+    num_scenes = 0
+    status = defaultdict(int)
+    totals = []
+    stages = defaultdict(list)
+    counters = defaultdict(list)
+    start, end = None, None
+    for record in records:
+        status[record['status']] += 1
+        if record['status'] != 'ok' and not include_failed:
+            continue
+        num_scenes += 1
+        totals.append(record['total'])
+        start = min(start or record['start_time'], record['start_time'])
+        end = max(end or 0, record['start_time'] + record['total'])
+        for name, seconds in record['stages'].items():
+            stages[name].append(seconds)
+        for name, cnt in record['counters'].items():
+            counters[name].append(cnt)
+    res = OrderedDict([
+        ('num_scenes', num_scenes),
+        ('status', dict(status)),
+    ])
+    if num_scenes == 0:
+        return res
+    # Stages/counters that did not happen in a scene count as 0 for it
+    for values in list(stages.values()) + list(counters.values()):
+        values += [0] * (num_scenes - len(values))
+    res['wall_time'] = end - start
+    res['total'] = summarize_values(totals)
+    res['stages'] = OrderedDict(sorted(
+        [(name, summarize_values(values)) for name, values in stages.items()],
+        key=lambda el: -el[1]['total']))
+    res['counters'] = OrderedDict(sorted(
+        (name, summarize_values(values)) for name, values in counters.items()))
+    return res
+
+
+def print_table(summary):
+    print(f"Scenes: {summary['num_scenes']} {summary['status']}")
+    if summary['num_scenes'] == 0:
+        return
+    print(f"Wall time: {summary['wall_time']:.1f}s")
+    columns = ['mean'] + [f'p{q}' for q in PERCENTILES] + ['max']
+    header = f"{'':28s}" + ''.join(f'{c:>10s}' for c in columns) + \
+        f"{'share':>8s}"
+    total_time = summary['total']['total']
+    print(header)
+    rows = [('total', summary['total'])] + list(summary['stages'].items())
+    for name, stats in rows:
+        share = 100.0 * stats['total'] / total_time if total_time else 0
+        print(f'{name:28s}' + ''.join(f'{stats[c]:10.3f}' for c in columns) +
+              f'{share:7.1f}%')
+    print()
+    print(f"{'counter':28s}" + ''.join(f'{c:>10s}' for c in columns))
+    for name, stats in summary['counters'].items():
+        print(f'{name:28s}' + ''.join(f'{stats[c]:10.1f}' for c in columns))
+
+
+def main():
+    args = parse_args()
+    summary = summarize(read_metrics(args.metrics_files),
+                        include_failed=args.include_failed)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_table(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+from __future__ import print_function
+
+import json
+from collections import OrderedDict
+
+
+"""
+Optional trace of the decisions taken while planning a scene: how many
+candidates (object positions, contain pairs, movements) were drawn in each
+segment, why they were rejected and which fallbacks fired. Like
+scene_metrics, the planner code calls the module level functions, which are
+no-ops unless a trace was started with `start_scene`. Everything is kept as
+counters, so it is cheap enough to leave on.
+"""
+
+_ACTIVE = None
+
+
+class PlannerTrace:
+    def __init__(self, index):
+        self.index = index
+        self.segments = []
+        self.current = None
+
+    def start_segment(self, name, start_frame=None):
+        self.current = OrderedDict([
+            ('name', name),
+            ('start_frame', start_frame),
+            ('end_frame', None),
+            ('candidates', 0),
+            ('rejected', OrderedDict()),
+            ('fallbacks', OrderedDict()),
+        ])
+        self.segments.append(self.current)
+        return self.current
+
+    def end_segment(self, end_frame=None):
+        if self.current is not None:
+            self.current['end_frame'] = end_frame
+        self.current = None
+
+    def _segment(self):
+        # Decisions outside of any segment are still counted somewhere
+        if self.current is None:
+            self.start_segment('other')
+        return self.current
+
+    def candidate(self, n=1):
+        self._segment()['candidates'] += n
+
+    def reject(self, reason):
+        rejected = self._segment()['rejected']
+        rejected[reason] = rejected.get(reason, 0) + 1
+
+    def fallback(self, name):
+        fallbacks = self._segment()['fallbacks']
+        fallbacks[name] = fallbacks.get(name, 0) + 1
+
+    def get_dict(self):
+        totals = OrderedDict([
+            ('candidates', 0),
+            ('rejected', OrderedDict()),
+            ('fallbacks', OrderedDict()),
+        ])
+        for segment in self.segments:
+            totals['candidates'] += segment['candidates']
+            for key in ['rejected', 'fallbacks']:
+                for name, cnt in segment[key].items():
+                    totals[key][name] = totals[key].get(name, 0) + cnt
+        return OrderedDict([
+            ('image_index', self.index),
+            ('totals', totals),
+            ('segments', self.segments),
+        ])
+
+
+def start_scene(index):
+    global _ACTIVE
+    _ACTIVE = PlannerTrace(index)
+    return _ACTIVE
+
+
+def finish_scene(output_trace=None):
+    """ Deactivate the trace, and write it to output_trace if given. """
+    global _ACTIVE
+    if _ACTIVE is None:
+        return None
+    res = _ACTIVE.get_dict()
+    _ACTIVE = None
+    if output_trace is not None:
+        with open(output_trace, 'w') as fout:
+            json.dump(res, fout)
+    return res
+
+
+def start_segment(name, start_frame=None):
+    if _ACTIVE is not None:
+        _ACTIVE.start_segment(name, start_frame)
+
+
+def end_segment(end_frame=None):
+    if _ACTIVE is not None:
+        _ACTIVE.end_segment(end_frame)
+
+
+def candidate(n=1):
+    if _ACTIVE is not None:
+        _ACTIVE.candidate(n)
+
+
+def reject(reason):
+    if _ACTIVE is not None:
+        _ACTIVE.reject(reason)
+
+
+def fallback(name):
+    if _ACTIVE is not None:
+        _ACTIVE.fallback(name)
@@ -0,0 +1,96 @@
+import numpy as np
+
+from scene_index import read_locations
+
+
+"""
+Projection of the scene objects to the video frames, without Blender.
+render_videos.py stores the camera in the scene JSON ('camera': image size,
+projection matrix and world to camera matrix, for every frame with
+--random_camera or once otherwise). `annotate` projects the trajectories of
+all objects at all frames with one batched matrix product, giving the pixel
+center, an approximate bounding box (from the projected corners of the
+object's bounding cube) and the depth of each object at each frame.
+"""
+
+# Corners of the unit cube, the objects are scaled by their 'sized'
+_CUBE_CORNERS = np.array(
+    [[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)],
+    dtype=np.float64)
+
+
+def get_camera(scene):
+    """ Returns (projection (4, 4), modelview (num frames or 1, 4, 4), width,
+    height) from the scene metadata. """
+    camera = scene['camera']
+    return (np.array(camera['projection'], dtype=np.float64),
+            np.array(camera['modelview'], dtype=np.float64),
+            camera['width'], camera['height'])
+
+
+def get_positions(scene):
+    """ (num objects, num frames, 3) locations of the objects, in the order
+    of scene['objects']. """
+    locations = read_locations(scene)
+    positions = []
+    for obj in scene['objects']:
+        # The frames are strings once read from JSON, and ints in the scene
+        # struct render_videos.py plans (see actions.sanitize_locations)
+        obj_locations = {int(frame): location for frame, location
+                         in locations[obj['instance']].items()}
+        positions.append([obj_locations[frame]
+                          for frame in range(len(obj_locations))])
+    return np.array(positions, dtype=np.float64).reshape(
+        (len(positions), -1, 3))
+
+
+def project(points, projection, modelview, width, height):
+    """
+    Project world points to pixels.
+    points: (..., num frames, 3) array.
+    modelview: (num frames, 4, 4) or (1, 4, 4) world to camera matrices.
+    Returns (..., num frames, 2) pixel coordinates (x right, y down, as in
+    utils.get_camera_coords) and (..., num frames) depths (distance along
+    the view direction, positive in front of the camera).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    homogeneous = np.concatenate(
+        [points, np.ones(points.shape[:-1] + (1,))], axis=-1)
+    # modelview is broadcast over the frames if the camera is static
+    camera_points = np.matmul(modelview, homogeneous[..., np.newaxis])
+    clip = np.matmul(projection, camera_points)[..., 0]
+    camera_points = camera_points[..., 0]
+    ndc = clip[..., :2] / clip[..., 3:4]
+    pixels = np.stack([(ndc[..., 0] + 1) / 2 * width,
+                       height - (ndc[..., 1] + 1) / 2 * height], axis=-1)
+    return pixels, -camera_points[..., 2]
+
+
+def annotate(scene, positions=None):
+    """
+    Per-frame 2D annotations of all objects. positions defaults to
+    get_positions(scene). Returns a dict of arrays:
+      centers: (num objects, num frames, 2) pixel centers
+      boxes: (num objects, num frames, 4) x0, y0, x1, y1 pixel boxes
+      depth: (num objects, num frames) depth of the centers
+    """
+    projection, modelview, width, height = get_camera(scene)
+    if positions is None:
+        positions = get_positions(scene)
+    sizes = np.array([obj['sized'] for obj in scene['objects']],
+                     dtype=np.float64)
+    # Corners of the bounding cube of each object at each frame
+    corners = positions[:, :, np.newaxis, :] + \
+        sizes[:, np.newaxis, np.newaxis, np.newaxis] * _CUBE_CORNERS
+    # Project the centers and the corners together: (objects, 9, frames, 3)
+    points = np.concatenate(
+        [positions[:, np.newaxis], corners.transpose(0, 2, 1, 3)], axis=1)
+    pixels, depth = project(points, projection, modelview, width, height)
+    corner_pixels = pixels[:, 1:]
+    boxes = np.concatenate([corner_pixels.min(axis=1),
+                            corner_pixels.max(axis=1)], axis=-1)
+    return {
+        'centers': pixels[:, 0],
+        'boxes': boxes,
+        'depth': depth[:, 0],
+    }
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+"""
+Spatial relationships (left, right, front, behind) between all pairs of
+objects at all frames. The relationships are computed at once from the
+(num objects, num frames, 3) trajectories, as a boolean tensor of shape
+(relation, frame, i, j) where [r, f, i, j] is True if object j is RELATIONS[r]
+of object i at frame f. The 'relationships' field of the scene JSON is its
+view at the first frame (see to_lists). The full tensor of a scene JSON is
+relation_tensor(projection.get_positions(scene), scene['directions']).
+"""
+
+RELATIONS = ('left', 'right', 'front', 'behind')
+# Objects closer than this along a direction are not related
+EPS = 0.2
+
+
+def relation_tensor(positions, directions, eps=EPS):
+    """
+    positions: (num objects, num frames, 3) locations of the objects.
+    directions: dict from relation name to the unit vector of its direction
+        on the ground plane (scene_struct['directions']).
+    Returns the (len(RELATIONS), num frames, num objects, num objects)
+    boolean tensor.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    axes = np.array([directions[name] for name in RELATIONS],
+                    dtype=np.float64)
+    # (relation, frame, object) coordinate of each object along each
+    # direction
+    coords = np.dot(positions, axes.T).transpose(2, 1, 0)
+    tensor = (coords[:, :, np.newaxis, :] -
+              coords[:, :, :, np.newaxis]) > eps
+    # An object is not related to itself, even with eps < 0
+    diagonal = np.arange(positions.shape[0])
+    tensor[:, :, diagonal, diagonal] = False
+    return tensor
+
+
+def to_lists(tensor, frame=0):
+    """ The relationships at a frame as a dict from relation name to lists,
+    where j is in output[relation][i] if object j is relation of object i.
+    """
+    return {
+        name: [np.flatnonzero(row).tolist() for row in tensor[r, frame]]
+        for r, name in enumerate(RELATIONS)}
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+
+
+"""
+Per-frame object index and depth of a rendered video, taken from the render
+passes of the same Cycles render (render_videos.py --render_passes). Object
+i of the scene JSON has pass index i + 1 (0 is the background), so the index
+maps to the 'instance' names stored with the passes. The store is one .npz
+next to the video (<video>.passes.npz):
+
+  instances: instance name of each pass index, from 1
+  index_values, index_lengths: run-length encoding of the object index of
+    each frame (row-major, top row first), the runs of frame f are
+    index_indptr[f]:index_indptr[f + 1]
+  depth: (num frames, height, width) float16 distance along the view
+    direction, inf for the background
+
+with Passes('Out/images/CATER_new_000001.passes.npz') as passes:
+    mask = passes.get_mask(0, 'cone_1')  # (height, width) bool
+"""
+
+SUFFIX = '.passes.npz'
+PASSES = ('index', 'depth')
+
+
+def get_fpath(video_fpath):
+    return os.path.splitext(video_fpath)[0] + SUFFIX
+
+
+def rle_encode(labels):
+    """ (values, lengths) of the runs of a label map, in row-major order. """
+    flat = np.ravel(labels)
+    starts = np.concatenate(
+        [[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    lengths = np.diff(np.concatenate([starts, [flat.size]]))
+    return flat[starts], lengths
+
+
+def rle_decode(values, lengths, shape):
+    return np.repeat(values, lengths).reshape(shape)
+
+
+class PassWriter:
+    """ Collects the passes of a video frame by frame, and writes them once
+    closed. """
+    def __init__(self, fpath, instances):
+        self.fpath = fpath
+        self.instances = instances
+        self.shape = None
+        self.index_values, self.index_lengths = [], []
+        self.index_indptr = [0]
+        self.depth = []
+
+    def add(self, index=None, depth=None):
+        """ The passes of the next frame: index a (height, width) map of pass
+        indices, depth a (height, width) float map. """
+        if index is not None:
+            self.shape = index.shape
+            values, lengths = rle_encode(index)
+            self.index_values.append(values.astype(np.uint8))
+            self.index_lengths.append(lengths.astype(np.uint32))
+            self.index_indptr.append(self.index_indptr[-1] + len(values))
+        if depth is not None:
+            self.shape = depth.shape
+            # The background is far beyond the float16 range
+            depth = np.where(depth < np.finfo(np.float16).max, depth, np.inf)
+            self.depth.append(depth.astype(np.float16))
+
+    def close(self):
+        data = {
+            'instances': np.array(self.instances, dtype='U'),
+            'shape': np.array(self.shape or (0, 0), dtype=np.int32),
+        }
+        if len(self.index_indptr) > 1:
+            data['index_values'] = np.concatenate(self.index_values)
+            data['index_lengths'] = np.concatenate(self.index_lengths)
+            data['index_indptr'] = np.array(self.index_indptr, dtype=np.int64)
+        if self.depth:
+            data['depth'] = np.stack(self.depth)
+        tmp_fpath = '{}.{}.tmp.npz'.format(self.fpath, os.getpid())
+        np.savez_compressed(tmp_fpath, **data)
+        os.rename(tmp_fpath, self.fpath)
+
+
+class Passes:
+    """ Reads the passes written by PassWriter. """
+    def __init__(self, fpath):
+        self._data = np.load(fpath)
+        self.instances = [str(el) for el in self._data['instances']]
+        self.shape = tuple(self._data['shape'])
+        self._index = None
+        self._depth = None
+        if 'index_indptr' in self._data.files:
+            self._index = (self._data['index_values'],
+                           self._data['index_lengths'],
+                           self._data['index_indptr'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._data.close()
+
+    def __len__(self):
+        if self._index is not None:
+            return len(self._index[2]) - 1
+        return len(self.get_depth())
+
+    def get_index(self, frame):
+        """ (height, width) uint8 pass index of each pixel of a frame. """
+        if self._index is None:
+            raise KeyError('No index pass stored')
+        values, lengths, indptr = self._index
+        start, end = indptr[frame], indptr[frame + 1]
+        return rle_decode(values[start:end], lengths[start:end], self.shape)
+
+    def get_mask(self, frame, instance):
+        """ (height, width) bool mask of an object, by instance name. """
+        return self.get_index(frame) == self.instances.index(instance) + 1
+
+    def get_depth(self, frame=None):
+        """ (height, width) float16 depth of a frame, or of all frames. """
+        if self._depth is None:
+            self._depth = self._data['depth']
+        return self._depth if frame is None else self._depth[frame]
@@ -8,6 +8,7 @@
 from __future__ import print_function
 import math
 import sys
+import time
 sys.path.append('/home/ramtin/code/uni-thesis/CATER/generate/')
 import random
 import argparse
@@ -16,7 +17,20 @@ import os
 from datetime import datetime as dt
 import numpy as np
 import errno
+import shutil
+import tempfile
 from movement_record import MovementRecord
+import scene_metrics
+import planner_trace
+import heartbeat
+import trajectory
+import scene_log
+import shards
+import avi_index
+import projection
+import visibility
+import relationships
+import render_passes
 import logging
 import itertools
 
@@ -34,9 +48,13 @@ blender --background --python render_images.py -- [arguments to this script]
 """
 
 INSIDE_BLENDER = True
+# Times to plan a scene again when objects are not visible enough
+MAX_VISIBILITY_TRIALS = 10
+# Name of the compositor node writing the render passes
+PASS_NODE = 'render_passes'
 try:
     import bpy
-    from mathutils import Vector
+    from mathutils import Matrix, Vector
 except ImportError as e:
     INSIDE_BLENDER = False
 if INSIDE_BLENDER:
@@ -99,9 +117,10 @@ parser.add_argument(
          "spatial relationships slightly less ambiguous.")
 parser.add_argument(
     '--min_pixels_per_object', default=200, type=int,
-    help="All objects will have at least this many visible pixels in the " +
-         "final rendered images; this ensures that no objects are fully " +
-         "occluded by other objects.")
+    help="Plan the scene again while an object has less than this many " +
+         "estimated visible pixels (see visibility.py), and render the " +
+         "last plan after " + str(MAX_VISIBILITY_TRIALS) + " plans; 0 to " +
+         "not check.")
 parser.add_argument(
     '--max_retries', default=50, type=int,
     help="The number of times to try placing an object before giving up and " +
@@ -143,8 +162,19 @@ parser.add_argument(
 #     help="The directory where output JSON scene structures will be stored. " +
 #          "It will be created if it does not exist.")
 parser.add_argument(
-    '--output_scene_file', default='../output/CLEVR_scenes.json',
-    help="Path to write a single JSON file containing all scene information")
+    '--output_scene_file', default=None,
+    help="Path to write a single JSON file containing all scene information " +
+         "of this worker at the end. With several workers, merge their " +
+         "--scene_log files with scene_log.py instead.")
+parser.add_argument(
+    '--scene_log', default=None,
+    help="JSON lines file where each finished scene is appended. Defaults " +
+         "to a new file per worker and run in scene_logs/ in --output_dir.")
+parser.add_argument(
+    '--metrics_file', default=None,
+    help="Path to a JSON lines file where per-scene stage timings and " +
+         "counters are appended. Defaults to metrics.jsonl in --output_dir. " +
+         "Use metrics_report.py to summarize it.")
 # parser.add_argument(
 #     '--output_blend_dir', default='output/blendfiles',
 #     help="The directory where blender scene files will be stored, if the " +
@@ -168,6 +198,33 @@ parser.add_argument(
     '--date', default=dt.today().strftime("%m/%d/%Y"),
     help="String to store in the \"date\" field of the generated JSON file; " +
          "defaults to today's date")
+parser.add_argument(
+    '--shard_dir', default=None,
+    help="Also pack every finished video and scene into shard files in " +
+         "this directory (see shards.py), one series of shards per worker.")
+parser.add_argument(
+    '--max_shard_bytes', default=shards.MAX_SHARD_BYTES, type=int,
+    help="Start a new shard once one reaches this size.")
+parser.add_argument(
+    '--compact_trajectories', action='store_true',
+    help="Store the object locations as keyframes in a .npz file next to " +
+         "each scene JSON (see trajectory.py), instead of the location at " +
+         "every frame in the JSON.")
+parser.add_argument(
+    '--planner_trace', action='store_true',
+    help="Record how many candidates the object placement and movement " +
+         "planner drew per segment, why they were rejected and which " +
+         "fallbacks fired. Written to traces/ in --output_dir, with the " +
+         "same name as the scene JSON.")
+parser.add_argument(
+    '--heartbeat_file', default=None,
+    help="Keep a small JSON status file at this path up to date with the " +
+         "scene, stage and frame this worker is on. Used by launch.py to " +
+         "monitor all workers.")
+parser.add_argument(
+    '--worker_slot', default=None, type=int,
+    help="Id of this worker among all launched workers, stored in the " +
+         "heartbeat file.")
 
 # Rendering options
 parser.add_argument(
@@ -176,6 +233,10 @@ parser.add_argument(
          "You must have an NVIDIA GPU with the CUDA toolkit installed for " +
          "GPU rendering to work. For specifying a GPU, use "
          "CUDA_VISIBLE_DEVICES before running singularity.")
+parser.add_argument(
+    '--threads', default=0, type=int,
+    help="Number of threads Cycles uses for rendering. 0 lets Blender " +
+         "pick one thread per available core.")
 parser.add_argument(
     '--width', default=320, type=int,
     help="The width (in pixels) for the rendered images")
@@ -221,12 +282,35 @@ parser.add_argument(
 parser.add_argument(
     '--fps', default=24, type=int,
     help="Video FPS.")
+parser.add_argument(
+    '--frame_step', default=1, type=int,
+    help="Only render every n-th frame. Useful for benchmarks; the " +
+         "rendered video will be shorter than the planned scene.")
+parser.add_argument(
+    '--output_format', default='AVI_JPEG', choices=['AVI_JPEG', 'PNG'],
+    help="Render to a MJPEG video, or to one PNG image per frame (named " +
+         "like the video, with the frame number appended).")
+parser.add_argument(
+    '--render_passes', nargs='*', default=[], choices=render_passes.PASSES,
+    help="Also store these passes of the Cycles render (object index, " +
+         "depth) of every frame next to each video (see render_passes.py).")
 parser.add_argument(
     '--render', default=True, type=bool,
     help="Render the video. Otherwise will only store the blend file.")
 parser.add_argument(
     "--random_camera", help="Render the video with random camera motion",
     action="store_true")
+parser.add_argument(
+    '--num_views', default=1, type=int,
+    help="Render this many camera views of each planned scene, in the " +
+         "same Blender session. The first view is the usual video, view " +
+         "k > 0 is rendered to <video>_view<k>.avi and described in the " +
+         "'views' of the scene JSON.")
+parser.add_argument(
+    '--view_rig', default='jitter', choices=['jitter', 'orbit'],
+    help="Place the other views by jittering the camera of the first view " +
+         "by --camera_jitter (which must then be > 0), or evenly around " +
+         "the scene.")
 parser.add_argument(
     "--max_motions",
     help="Number of max objects to move in the single object case. "
@@ -291,27 +375,62 @@ def main(args):
     args.output_image_dir = os.path.join(args.output_dir, 'images')
     args.output_scene_dir = os.path.join(args.output_dir, 'scenes')
     args.output_blend_dir = os.path.join(args.output_dir, 'blend')
+    args.output_trace_dir = os.path.join(args.output_dir, 'traces')
+    # The base scene with its materials, saved by the first plan_scene
+    args.base_scene_copy = os.path.join(
+        tempfile.gettempdir(), 'render_videos_base_{}.blend'.format(
+            os.getpid()))
     img_template = os.path.join(args.output_image_dir, img_template)
     scene_template = os.path.join(args.output_scene_dir, scene_template)
     blend_template = os.path.join(args.output_blend_dir, blend_template)
 
+    if args.metrics_file is None:
+        args.metrics_file = os.path.join(args.output_dir, 'metrics.jsonl')
+    if args.scene_log is None:
+        mkdir_p(os.path.join(args.output_dir, 'scene_logs'))
+        args.scene_log = scene_log.default_log_path(
+            os.path.join(args.output_dir, 'scene_logs'))
+    log = scene_log.SceneLog(args.scene_log, info={
+        'date': args.date,
+        'version': args.version,
+        'split': args.split,
+        'license': args.license,
+    })
+
     mkdir_p(args.output_image_dir)
     mkdir_p(args.output_scene_dir)
     if args.save_blendfiles == 1 and not os.path.isdir(args.output_blend_dir):
         mkdir_p(args.output_blend_dir)
+    if args.planner_trace:
+        mkdir_p(args.output_trace_dir)
+    shard_writer = None
+    if args.shard_dir is not None:
+        mkdir_p(args.shard_dir)
+        shard_writer = shards.ShardedWriter(
+            args.shard_dir, max_shard_bytes=args.max_shard_bytes)
+    if args.heartbeat_file is not None:
+        heartbeat.start(args.heartbeat_file, slot=args.worker_slot,
+                        device='cpu' if args.cpu else None)
 
-    all_scene_paths = []
     for i in range(args.num_images):
         img_path = img_template % (i + args.start_idx)
         if not lock(img_path):
             continue
         logging.info('Working on {}'.format(img_path))
         scene_path = scene_template % (i + args.start_idx)
-        all_scene_paths.append(scene_path)
         blend_path = None
         if args.save_blendfiles == 1:
             blend_path = blend_template % (i + args.start_idx)
         num_objects = random.randint(args.min_objects, args.max_objects)
+        scene_metrics.start_scene(i + args.start_idx, img_path)
+        scene_metrics.set_info('num_objects', num_objects)
+        scene_metrics.set_info('num_frames', args.num_frames)
+        heartbeat.start_scene(i + args.start_idx, args.num_frames)
+        trace_path = None
+        if args.planner_trace:
+            planner_trace.start_scene(i + args.start_idx)
+            trace_path = os.path.join(
+                args.output_trace_dir, os.path.basename(scene_path))
         try:
             render_scene(
                 args,
@@ -323,37 +442,81 @@ def main(args):
                 output_blendfile=blend_path,
             )
         except Exception as e:
+            scene_metrics.finish_scene(
+                args.metrics_file, status='failed', error=e)
+            heartbeat.finish_scene(failed=True)
             if args.debug:
                 unlock(img_path)
                 raise e
             logging.warning('Didnt work for {} due to {}. Ignoring for now..'
                             .format(img_path, e))
+        else:
+            # render_scene does not raise when all render trials fail
+            broken = is_video_broken(args, img_path)
+            if (shard_writer is not None and not broken and
+                    os.path.exists(scene_path) and os.path.exists(img_path)):
+                with scene_metrics.stage('write_shard'):
+                    _, members = shards.scene_members(scene_path, img_path)
+                    shard_writer.add(i + args.start_idx,
+                                     os.path.basename(img_path), members)
+            if broken:
+                logging.warning('Broken video {}'.format(img_path))
+                scene_metrics.finish_scene(
+                    args.metrics_file, status='failed',
+                    error='broken video')
+            else:
+                scene_metrics.finish_scene(args.metrics_file)
+            heartbeat.finish_scene(failed=broken)
+            if os.path.exists(scene_path):
+                log.append_file(scene_path)
+        planner_trace.finish_scene(trace_path)
         unlock(img_path)
         logging.info('Done for {}'.format(img_path))
-
-    # After rendering all images, combine the JSON files for each scene into a
-    # single JSON file.
-    all_scenes = []
-    for scene_path in all_scene_paths:
-        with open(scene_path, 'r') as f:
-            all_scenes.append(json.load(f))
-    output = {
-        'info': {
-            'date': args.date,
-            'version': args.version,
-            'split': args.split,
-            'license': args.license,
-        },
-        'scenes': all_scenes
-    }
-    with open(args.output_scene_file, 'w') as f:
-        json.dump(output, f)
+    heartbeat.stop()
+    if shard_writer is not None:
+        shard_writer.close()
+    if os.path.exists(args.base_scene_copy):
+        os.remove(args.base_scene_copy)
+
+    if args.output_scene_file is not None:
+        # Combine the scenes of this worker into a single JSON file
+        scene_log.merge([args.scene_log], args.output_scene_file)
+
+
+def is_video_broken(args, output_image):
+    """ Whether the video of a scene is missing or incomplete (see
+    avi_index.is_broken). It is still locked, so check_avi_broken would
+    always report it broken. """
+    if not args.render or args.output_format != 'AVI_JPEG':
+        return False
+    # With --frame_step, the video has fewer frames than planned
+    num_frames = args.num_frames if args.frame_step == 1 else None
+    return avi_index.is_broken(avi_index.read_avi(output_image), num_frames)
 
 
 def rand(L):
     return 2.0 * L * (random.random() - 0.5)
 
 
+def get_directions(camera, plane_normal):
+    """ The six axis-aligned directions of the camera, along the ground plane.
+    """
+    cam_behind = camera.matrix_world.to_quaternion() * Vector((0, 0, -1))
+    cam_left = camera.matrix_world.to_quaternion() * Vector((-1, 0, 0))
+    cam_up = camera.matrix_world.to_quaternion() * Vector((0, 1, 0))
+    plane_behind = (cam_behind - cam_behind.project(plane_normal)).normalized()
+    plane_left = (cam_left - cam_left.project(plane_normal)).normalized()
+    plane_up = cam_up.project(plane_normal).normalized()
+    return {
+        'behind': tuple(plane_behind),
+        'front': tuple(-plane_behind),
+        'left': tuple(plane_left),
+        'right': tuple(-plane_left),
+        'above': tuple(plane_up),
+        'below': tuple(-plane_up),
+    }
+
+
 def setup_scene(
     args,
     num_objects=5,
@@ -368,8 +531,8 @@ def setup_scene(
         'split': output_split,
         'image_index': output_index,
         'image_filename': os.path.basename(output_image),
+        'num_frames': args.num_frames,
         'objects': [],
-        'directions': {},
     }
 
     # Put a plane on the ground so we can compute cardinal directions
@@ -383,22 +546,8 @@ def setup_scene(
     # Figure out the left, up, and behind directions along the plane and record
     # them in the scene structure
     camera = bpy.data.objects['Camera']
-
-    plane_normal = plane.data.vertices[0].normal
-    cam_behind = camera.matrix_world.to_quaternion() * Vector((0, 0, -1))
-    cam_left = camera.matrix_world.to_quaternion() * Vector((-1, 0, 0))
-    cam_up = camera.matrix_world.to_quaternion() * Vector((0, 1, 0))
-    plane_behind = (cam_behind - cam_behind.project(plane_normal)).normalized()
-    plane_left = (cam_left - cam_left.project(plane_normal)).normalized()
-    plane_up = cam_up.project(plane_normal).normalized()
-
-    # Save all six axis-aligned directions in the scene struct
-    scene_struct['directions']['behind'] = tuple(plane_behind)
-    scene_struct['directions']['front'] = tuple(-plane_behind)
-    scene_struct['directions']['left'] = tuple(plane_left)
-    scene_struct['directions']['right'] = tuple(-plane_left)
-    scene_struct['directions']['above'] = tuple(plane_up)
-    scene_struct['directions']['below'] = tuple(-plane_up)
+    scene_struct['directions'] = get_directions(
+        camera, plane.data.vertices[0].normal)
 
     # Delete the plane; we only used it for normals anyway. The base scene file
     # contains the actual ground plane.
@@ -419,19 +568,134 @@ def setup_scene(
                 args.fill_light_jitter)
 
     # objects = cup_game(scene_struct, num_objects, args, camera)
-    objects, blender_objects = add_random_objects(
-        scene_struct, num_objects, args, camera)
+    planner_trace.start_segment('add_random_objects')
+    with scene_metrics.stage('add_random_objects'):
+        objects, blender_objects = add_random_objects(
+            scene_struct, num_objects, args, camera)
+    planner_trace.end_segment()
     record = MovementRecord(blender_objects, args.num_frames)
-    actions.random_objects_movements(
-        objects, blender_objects, args, args.num_frames, args.min_dist,
-        record, max_motions=args.max_motions)
+    with scene_metrics.stage('random_objects_movements'):
+        actions.random_objects_movements(
+            objects, blender_objects, args, args.num_frames, args.min_dist,
+            record, max_motions=args.max_motions)
 
     # Render the scene and dump the scene data structure
     scene_struct['objects'] = objects
-    scene_struct['relationships'] = compute_all_relationships(scene_struct)
+    positions = [[obj['locations'][frame]
+                  for frame in range(len(obj['locations']))]
+                 for obj in objects]
+    with scene_metrics.stage('compute_all_relationships'):
+        # Only the first frame is stored, see relationships.py for all
+        scene_struct['relationships'] = relationships.to_lists(
+            relationships.relation_tensor(
+                positions, scene_struct['directions']))
     scene_struct['movements'] = record.get_dict()
-    with open(output_scene, 'w') as f:
-        json.dump(scene_struct, f, indent=2)
+    if args.compact_trajectories:
+        with scene_metrics.stage('write_trajectories'):
+            trajectory_path = trajectory.get_fpath(output_scene)
+            trajectory.write(
+                trajectory_path, [obj['instance'] for obj in objects],
+                positions)
+            for obj in objects:
+                del obj['locations']
+            scene_struct['trajectory_file'] = os.path.basename(
+                trajectory_path)
+    return scene_struct
+
+
+def write_scene_json(output_scene, scene_struct):
+    with scene_metrics.stage('dump_scene_json'):
+        with open(output_scene, 'w') as f:
+            json.dump(scene_struct, f, indent=2)
+
+
+def get_visibility_struct(scene_struct, visible):
+    """ The visible pixels of each object at each frame, by instance. """
+    return {obj['instance']: visible[i].tolist()
+            for i, obj in enumerate(scene_struct['objects'])}
+
+
+def get_scene_positions(scene_struct, output_scene):
+    """ The trajectories of a scene struct, which may be stored next to its
+    JSON (--compact_trajectories). """
+    return projection.get_positions(
+        dict(scene_struct, scene_file=output_scene))
+
+
+def add_camera_and_visibility(args, scene_struct, output_scene):
+    """ Add the camera of the scene, and the estimated visible pixels of
+    each object at each frame (see visibility.py), to the scene struct.
+    Returns the visibility problems of the scene. """
+    scene_struct['camera'] = get_camera_struct(
+        args.num_frames, per_frame=args.random_camera)
+    visible = visibility.visible_pixels(
+        projection.annotate(
+            scene_struct, get_scene_positions(scene_struct, output_scene)),
+        scene_struct['camera']['width'], scene_struct['camera']['height'])
+    scene_struct['visibility'] = get_visibility_struct(scene_struct, visible)
+    return visibility.check(scene_struct, visible, args.min_pixels_per_object)
+
+
+def plan_scene(
+        args,
+        num_objects=5,
+        output_index=0,
+        output_split='none',
+        output_image='render.png',
+        output_scene='render_json',
+        output_blendfile=None):
+    """ Set up the scene to render, or load it from its BLEND file. Returns
+    the scene struct (None if loaded without its JSON), and the visibility
+    problems of a newly set up scene. Only the first call of a worker loads
+    the materials, later ones (every plan again included) open a copy of
+    the base scene with them. """
+    if os.path.exists(args.base_scene_copy):
+        with scene_metrics.stage('open_mainfile'):
+            bpy.ops.wm.open_mainfile(filepath=args.base_scene_copy)
+    else:
+        # Load the main blendfile
+        with scene_metrics.stage('open_mainfile'):
+            bpy.ops.wm.open_mainfile(filepath=args.base_scene_blendfile)
+
+        # Load materials
+        with scene_metrics.stage('load_materials'):
+            utils.load_materials(args.material_dir)
+            bpy.ops.wm.save_as_mainfile(
+                filepath=args.base_scene_copy, copy=True)
+
+    set_render_settings(args, output_image)
+
+    loaded = output_blendfile is not None and os.path.exists(output_blendfile)
+    if loaded:
+        logging.info('Loading pre-defined BLEND file from {}'.format(
+            output_blendfile))
+        with scene_metrics.stage('open_blendfile'):
+            bpy.ops.wm.open_mainfile(filepath=output_blendfile)
+        # The render settings are stored with the BLEND file, so set them
+        # again to the ones asked for now
+        set_render_settings(args, output_image)
+        scene_struct = None
+        if os.path.exists(output_scene):
+            with open(output_scene, 'r') as f:
+                scene_struct = json.load(f)
+    else:
+        heartbeat.update(stage='setup_scene')
+        with scene_metrics.stage('setup_scene'):
+            scene_struct = setup_scene(
+                args, num_objects, output_index, output_split,
+                output_image, output_scene)
+    print_camera_matrix()
+    if args.random_camera:
+        add_random_camera_motion(args.num_frames)
+    problems = []
+    if scene_struct is not None:
+        # Store the camera, to project the objects to the frames later (see
+        # projection.py), and how visible the objects are
+        with scene_metrics.stage('visibility'):
+            problems = add_camera_and_visibility(
+                args, scene_struct, output_scene)
+        write_scene_json(output_scene, scene_struct)
+    return scene_struct, [] if loaded else problems
 
 
 def render_scene(
@@ -442,28 +706,268 @@ def render_scene(
         output_image='render.png',
         output_scene='render_json',
         output_blendfile=None):
-    # Load the main blendfile
-    bpy.ops.wm.open_mainfile(filepath=args.base_scene_blendfile)
+    # Plan the scene again while objects are hidden, before rendering it
+    for trial in range(1, MAX_VISIBILITY_TRIALS + 1):
+        scene_struct, problems = plan_scene(
+            args, num_objects, output_index, output_split, output_image,
+            output_scene, output_blendfile)
+        if not problems:
+            break
+        scene_metrics.count('visibility_rejections')
+        planner_trace.fallback('not_visible')
+        if trial < MAX_VISIBILITY_TRIALS:
+            logging.info('Planning again, objects not visible: {}'.format(
+                ', '.join(problems)))
+        else:
+            # Better a scene with a hidden object than no scene
+            scene_metrics.count('visibility_fallbacks')
+            logging.warning(
+                'Objects not visible after {} trials, rendering the last '
+                'plan: {}'.format(MAX_VISIBILITY_TRIALS, ', '.join(problems)))
+    if output_blendfile is not None and not os.path.exists(output_blendfile):
+        with scene_metrics.stage('save_blendfile'):
+            bpy.ops.wm.save_as_mainfile(filepath=output_blendfile)
+    if args.render:
+        add_render_timing_handlers()
+        render_video(args, scene_struct, output_image)
+    if args.num_views > 1:
+        if scene_struct is None:
+            # The views are stored in the scene JSON
+            logging.warning('No scene JSON, not rendering the other views '
+                            'of {}'.format(output_image))
+        else:
+            render_views(args, scene_struct, output_scene, output_image)
+
 
-    # Load materials
-    utils.load_materials(args.material_dir)
+def get_view_fpath(output_image, view_id):
+    base, ext = os.path.splitext(output_image)
+    return '{}_view{}{}'.format(base, view_id, ext)
 
+
+def set_view_camera(args, base_matrix, view_id):
+    """ Move the camera from the pose of the first view to the pose of
+    view_id: around the scene for the orbit rig, or jittered otherwise. """
+    camera = bpy.data.objects['Camera']
+    # Drop the camera motion of the previous view
+    camera.animation_data_clear()
+    if args.view_rig == 'orbit':
+        camera.matrix_world = Matrix.Rotation(
+            2 * math.pi * view_id / args.num_views, 4, 'Z') * base_matrix
+    else:
+        camera.matrix_world = base_matrix
+        for i in range(3):
+            camera.location[i] += rand(args.camera_jitter)
+    bpy.context.scene.update()
+    if args.random_camera:
+        add_random_camera_motion(args.num_frames)
+
+
+def get_view_struct(args, scene_struct, positions, view_id, view_image):
+    """ The metadata of a view: its video, camera, the directions and
+    relationships seen from it, and the visibility of the objects. Returns it
+    with the visibility problems of the view. """
+    camera = get_camera_struct(args.num_frames, per_frame=args.random_camera)
+    directions = get_directions(
+        bpy.data.objects['Camera'], Vector((0, 0, 1)))
+    visible = visibility.visible_pixels(
+        projection.annotate(dict(scene_struct, camera=camera), positions),
+        camera['width'], camera['height'])
+    view = {
+        'view': view_id,
+        'image_filename': os.path.basename(view_image),
+        'camera': camera,
+        'directions': directions,
+        'relationships': relationships.to_lists(
+            relationships.relation_tensor(positions, directions)),
+        'visibility': get_visibility_struct(scene_struct, visible),
+    }
+    return view, visibility.check(
+        scene_struct, visible, args.min_pixels_per_object)
+
+
+def render_views(args, scene_struct, output_scene, output_image):
+    """ Render the other --num_views views of the planned scene in the same
+    session, each to its own video, and store them in the 'views' of the
+    scene JSON. As for the first view, a view where objects are hidden is
+    moved again, unless its pose is fixed. """
+    positions = get_scene_positions(scene_struct, output_scene)
+    bpy.context.scene.frame_set(0)
+    base_matrix = bpy.data.objects['Camera'].matrix_world.copy()
+    fixed_pose = not args.random_camera and args.view_rig == 'orbit'
+    views = []
+    for view_id in range(1, args.num_views):
+        view_image = get_view_fpath(output_image, view_id)
+        with scene_metrics.stage('setup_view'):
+            for trial in range(1, MAX_VISIBILITY_TRIALS + 1):
+                set_view_camera(args, base_matrix, view_id)
+                view, problems = get_view_struct(
+                    args, scene_struct, positions, view_id, view_image)
+                if not problems:
+                    break
+                scene_metrics.count('view_visibility_rejections')
+                if fixed_pose or trial == MAX_VISIBILITY_TRIALS:
+                    scene_metrics.count('visibility_fallbacks')
+                    logging.warning(
+                        'Objects not visible from view {}, rendering it '
+                        'anyway: {}'.format(view_id, ', '.join(problems)))
+                    break
+                logging.info('Moving view {} again, objects not visible: '
+                             '{}'.format(view_id, ', '.join(problems)))
+            views.append(view)
+            set_render_settings(args, view_image)
+        if args.render:
+            render_video(args, scene_struct, view_image, view_id)
+    scene_struct['views'] = views
+    write_scene_json(output_scene, scene_struct)
+
+
+def render_video(args, scene_struct, output_image, view_id=0):
+    """ Render the animation of the current camera to output_image. """
+    max_num_render_trials = 10
+    # The pass indices follow the objects of the scene JSON
+    with_passes = bool(args.render_passes) and scene_struct is not None
+    if args.render_passes and not with_passes:
+        logging.warning('No scene JSON, rendering {} without passes'.format(
+            output_image))
+    if with_passes:
+        instances = setup_render_passes(args, scene_struct, output_image)
+    heartbeat.start_render(view_id)
+    while max_num_render_trials > 0:
+        scene_metrics.count('render_trials')
+        try:
+            if args.suppress_blender_logs:
+                # redirect output to log file
+                logfile = '/dev/null'
+                open(logfile, 'a').close()
+                old = os.dup(1)
+                sys.stdout.flush()
+                os.close(1)
+                os.open(logfile, os.O_WRONLY)
+            with scene_metrics.stage('render'):
+                bpy.ops.render.render(animation=True)
+            if args.suppress_blender_logs:
+                # disable output redirection
+                os.close(1)
+                os.dup(old)
+                os.close(old)
+            break
+        except Exception as e:
+            max_num_render_trials -= 1
+            print(e)
+    if with_passes:
+        with scene_metrics.stage('write_render_passes'):
+            write_render_passes(args, instances, output_image)
+
+
+def get_pass_dir(output_image):
+    """ Where the render passes of each frame are written during the render.
+    """
+    return os.path.splitext(output_image)[0] + '_passes'
+
+
+def setup_render_passes(args, scene_struct, output_image):
+    """
+    Write the --render_passes of every frame to EXR files, with a File Output
+    node in the compositor. The objects get the pass index of their position
+    in the scene JSON, plus one. Returns the instance names of the objects.
+    """
+    instances = [obj['instance'] for obj in scene_struct['objects']]
+    for pass_index, instance in enumerate(instances):
+        bpy.data.objects[instance].pass_index = pass_index + 1
+    scene = bpy.context.scene
+    layer = scene.render.layers[0]
+    layer.use_pass_object_index = 'index' in args.render_passes
+    layer.use_pass_z = 'depth' in args.render_passes
+    scene.use_nodes = True
+    tree = scene.node_tree
+    render_layers = next(
+        (node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+    if render_layers is None:
+        render_layers = tree.nodes.new('CompositorNodeRLayers')
+        composite = tree.nodes.new('CompositorNodeComposite')
+        tree.links.new(render_layers.outputs['Image'],
+                       composite.inputs['Image'])
+    output = tree.nodes.get(PASS_NODE)
+    if output is not None:
+        # Set up for an earlier view of the scene
+        output.base_path = get_pass_dir(output_image)
+        return instances
+    # The depth output was renamed from Z in later Blender versions
+    sockets = {
+        'index': 'IndexOB',
+        'depth': 'Depth' if 'Depth' in render_layers.outputs else 'Z',
+    }
+    output = tree.nodes.new('CompositorNodeOutputFile')
+    output.name = PASS_NODE
+    output.base_path = get_pass_dir(output_image)
+    output.format.file_format = 'OPEN_EXR'
+    output.format.color_depth = '32'
+    for slot_id, name in enumerate(args.render_passes):
+        if slot_id > 0:
+            output.file_slots.new(name)
+        output.file_slots[slot_id].path = name + '_'
+        tree.links.new(render_layers.outputs[sockets[name]],
+                       output.inputs[slot_id])
+    return instances
+
+
+def read_exr(fpath):
+    """ (height, width) first channel of an EXR image, top row first. """
+    image = bpy.data.images.load(fpath)
+    width, height = image.size
+    pixels = np.array(image.pixels[:], dtype=np.float32).reshape(
+        (height, width, image.channels))
+    bpy.data.images.remove(image)
+    # Blender stores the bottom row first
+    return pixels[::-1, :, 0]
+
+
+def write_render_passes(args, instances, output_image):
+    """ Store the passes written during the render in the compact per-video
+    format of render_passes.py, and remove the EXR files. """
+    pass_dir = get_pass_dir(output_image)
+    writer = render_passes.PassWriter(
+        render_passes.get_fpath(output_image), instances)
+    scene = bpy.context.scene
+    for frame in range(scene.frame_start, scene.frame_end + 1,
+                       scene.frame_step):
+        passes = {
+            name: read_exr(os.path.join(
+                pass_dir, '{}_{:04d}.exr'.format(name, frame)))
+            for name in args.render_passes}
+        index = passes.get('index')
+        writer.add(
+            index=None if index is None else np.rint(index).astype(np.uint8),
+            depth=passes.get('depth'))
+    writer.close()
+    shutil.rmtree(pass_dir)
+
+
+def set_render_settings(args, output_image):
     # Set render arguments so we can get pixel coordinates later.
     # We use functionality specific to the CYCLES renderer so BLENDER_RENDER
     # cannot be used.
     bpy.ops.screen.frame_jump(end=False)
     render_args = bpy.context.scene.render
     render_args.engine = "CYCLES"
-    render_args.filepath = output_image
+    if args.output_format == 'PNG':
+        # One image per frame, Blender appends the frame number
+        render_args.filepath = os.path.splitext(output_image)[0] + '_'
+    else:
+        render_args.filepath = output_image
     render_args.resolution_x = args.width
     render_args.resolution_y = args.height
     render_args.resolution_percentage = 100
     render_args.tile_x = args.render_tile_size
     render_args.tile_y = args.render_tile_size
-    render_args.image_settings.file_format = 'AVI_JPEG'
+    if args.threads > 0:
+        render_args.threads_mode = 'FIXED'
+        render_args.threads = args.threads
+    render_args.image_settings.file_format = args.output_format
     # Video params
     bpy.context.scene.frame_start = 0
     bpy.context.scene.frame_end = args.num_frames  # same as kinetics
+    bpy.context.scene.frame_step = args.frame_step
     render_args.fps = args.fps
 
     if args.cpu is False:
@@ -496,41 +1000,37 @@ def render_scene(
     if args.cpu is False:
         bpy.context.scene.cycles.device = 'GPU'
 
-    if output_blendfile is not None and os.path.exists(output_blendfile):
-        logging.info('Loading pre-defined BLEND file from {}'.format(
-            output_blendfile))
-        bpy.ops.wm.open_mainfile(filepath=output_blendfile)
-    else:
-        setup_scene(
-            args, num_objects, output_index, output_split,
-            output_image, output_scene)
-    print_camera_matrix()
-    if args.random_camera:
-        add_random_camera_motion(args.num_frames)
-    if output_blendfile is not None and not os.path.exists(output_blendfile):
-        bpy.ops.wm.save_as_mainfile(filepath=output_blendfile)
-    max_num_render_trials = 10
-    if args.render:
-        while max_num_render_trials > 0:
-            try:
-                if args.suppress_blender_logs:
-                    # redirect output to log file
-                    logfile = '/dev/null'
-                    open(logfile, 'a').close()
-                    old = os.dup(1)
-                    sys.stdout.flush()
-                    os.close(1)
-                    os.open(logfile, os.O_WRONLY)
-                bpy.ops.render.render(animation=True)
-                if args.suppress_blender_logs:
-                    # disable output redirection
-                    os.close(1)
-                    os.dup(old)
-                    os.close(old)
-                break
-            except Exception as e:
-                max_num_render_trials -= 1
-                print(e)
+
+def add_render_timing_handlers():
+    """
+    Split the time of the animation render into the Cycles render of each
+    frame (render_pre to render_post) and the time to encode and write it
+    into the video (render_post to render_write).
+    """
+    timestamps = {}
+
+    def render_pre(scene):
+        timestamps['pre'] = time.time()
+
+    def render_post(scene):
+        timestamps['post'] = time.time()
+        metrics = scene_metrics.active()
+        if metrics is not None and 'pre' in timestamps:
+            metrics.add_time('cycles_render', timestamps['post'] -
+                             timestamps['pre'])
+            metrics.count('frames_rendered')
+
+    def render_write(scene):
+        metrics = scene_metrics.active()
+        if metrics is not None and 'post' in timestamps:
+            metrics.add_time('avi_write', time.time() - timestamps['post'])
+        heartbeat.frame_done()
+
+    # Handlers are not persistent, so loading the next base scene file will
+    # remove these again.
+    bpy.app.handlers.render_pre.append(render_pre)
+    bpy.app.handlers.render_post.append(render_post)
+    bpy.app.handlers.render_write.append(render_write)
 
 
 def print_camera_matrix():
@@ -549,6 +1049,36 @@ def print_camera_matrix():
     print('Overall camera matrix:', final_mat)
 
 
+def matrix_to_list(matrix):
+    return [list(row) for row in matrix]
+
+
+def get_camera_struct(num_frames, per_frame=False):
+    """ The image size, projection matrix and world to camera matrix of the
+    camera, at every frame if per_frame (the camera moves) or else once. """
+    camera = bpy.data.objects['Camera']
+    scene = bpy.context.scene
+    render = scene.render
+    scale = render.resolution_percentage / 100.0
+    projection_matrix = camera.calc_matrix_camera(
+        render.resolution_x,
+        render.resolution_y,
+        render.pixel_aspect_x,
+        render.pixel_aspect_y,
+    )
+    modelview = []
+    for frame in (range(num_frames + 1) if per_frame else [0]):
+        scene.frame_set(frame)
+        modelview.append(matrix_to_list(camera.matrix_world.inverted()))
+    scene.frame_set(0)
+    return {
+        'width': int(scale * render.resolution_x),
+        'height': int(scale * render.resolution_y),
+        'projection': matrix_to_list(projection_matrix),
+        'modelview': modelview,
+    }
+
+
 def get_new_camera_location():
     # Don't move in X and Y at the same time, as it crosses the 0,0,z point
     # which is a singularity
@@ -657,13 +1187,17 @@ def add_random_objects(scene_struct, num_objects, args, camera):
             # If we try and fail to place an object too many times, then
             # delete all the objects in the scene and start over.
             num_tries += 1
+            scene_metrics.count('placement_tries')
             if num_tries > args.max_retries:
+                scene_metrics.count('placement_restarts')
+                planner_trace.fallback('restart_placement')
                 for obj in blender_objects:
                     utils.delete_object(obj)
                 return add_random_objects(scene_struct, num_objects, args,
                                           camera)
             x = random.uniform(-3, 3)
             y = random.uniform(-3, 3)
+            planner_trace.candidate()
             # Check to make sure the new object is further than min_dist from
             # all other objects, and further than margin along the four
             # cardinal directions
@@ -674,6 +1208,7 @@ def add_random_objects(scene_struct, num_objects, args, camera):
                 dist = math.sqrt(dx * dx + dy * dy)
                 if dist - r - rr < args.min_dist:
                     dists_good = False
+                    planner_trace.reject('distance')
                     break
                 for direction_name in ['left', 'right', 'front', 'behind']:
                     direction_vec = scene_struct['directions'][direction_name]
@@ -684,6 +1219,7 @@ def add_random_objects(scene_struct, num_objects, args, camera):
                             margin, args.margin, direction_name))
                         logging.debug('BROKEN MARGIN!')
                         margins_good = False
+                        planner_trace.reject('margin')
                         break
                 if not margins_good:
                     break
@@ -846,40 +1382,16 @@ def add_flips(blender_objects, num_flips=10, total_frames=300):
     bpy.ops.screen.frame_jump(end=False)
 
 
-def compute_all_relationships(scene_struct, eps=0.2):
-    """
-    Computes relationships between all pairs of objects in the scene.
-
-    Returns a dictionary mapping string relationship names to lists of lists of
-    integers, where output[rel][i] gives a list of object indices that have the
-    relationship rel with object i. For example if j is in output['left'][i]
-    then object j is left of object i.
-    """
-    all_relationships = {}
-    for name, direction_vec in scene_struct['directions'].items():
-        if name == 'above' or name == 'below':
-            continue
-        all_relationships[name] = []
-        for i, obj1 in enumerate(scene_struct['objects']):
-            coords1 = obj1['3d_coords']
-            related = set()
-            for j, obj2 in enumerate(scene_struct['objects']):
-                if obj1 == obj2:
-                    continue
-                coords2 = obj2['3d_coords']
-                diff = [coords2[k] - coords1[k] for k in [0, 1, 2]]
-                dot = sum(diff[k] * direction_vec[k] for k in [0, 1, 2])
-                if dot > eps:
-                    related.add(j)
-                all_relationships[name].append(sorted(list(related)))
-    return all_relationships
-
-
 if __name__ == '__main__':
     if INSIDE_BLENDER:
         # Run normally
         argv = utils.extract_args()
         args = parser.parse_args(argv)
+        if (args.num_views > 1 and args.view_rig == 'jitter' and
+                args.camera_jitter <= 0):
+            # Every view would be a copy of the first one
+            parser.error('--view_rig jitter needs --camera_jitter > 0 to '
+                         'render several views')
         if args.verbose:
             logging.basicConfig(level=logging.DEBUG)
         else:
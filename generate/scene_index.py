@@ -0,0 +1,169 @@
+import json
+import logging
+import os.path as osp
+from collections import namedtuple
+
+import trajectory
+
+
+"""
+Compact, parsed view of the scene JSON files written by render_videos.py.
+Every scene file is parsed once into a SceneRecord holding only what the
+label tools need (video file name, objects and movements); the large
+per-frame locations are dropped right away. iter_scenes streams the scene
+metadata projected to a few fields in the same way, and the locations are
+read again from the scene file only by the tools that need them.
+"""
+
+# Top level fields of the scene JSON kept by project_scene by default
+DEFAULT_FIELDS = ('image_filename', 'objects', 'movements', 'num_frames',
+                  'trajectory_file')
+
+# objects: dict from instance name to (color, material, shape)
+# moves: list of [instance, action, other instance, start frame, end frame]
+#   without the _no_op's, sorted by start frame
+# num_frames: the --num_frames the scene was planned with, the video has one
+#   frame more
+SceneRecord = namedtuple('SceneRecord', [
+    'name', 'video', 'objects', 'moves', 'num_frames'])
+
+
+def get_num_frames(metadata):
+    """ Scenes rendered before num_frames was stored have it implicitly. """
+    if 'num_frames' in metadata:
+        return metadata['num_frames']
+    locations = metadata['objects'][0].get('locations')
+    if locations:
+        return len(locations) - 1
+    return None
+
+
+def parse_scene(name, metadata):
+    """ Build the SceneRecord for the metadata of a scene JSON file. """
+    objects = {}
+    for obj in metadata['objects']:
+        objects[obj['instance']] = (
+            obj['color'], obj['material'], obj['shape'])
+    moves = []
+    for object_name, motions in metadata['movements'].items():
+        for motion in motions:
+            if motion[0] == '_no_op':
+                continue
+            moves.append([object_name] + list(motion))
+    # Sort by start frame (3rd element of tuple)
+    moves.sort(key=lambda x: x[3])
+    return SceneRecord(
+        name=name,
+        video=metadata['image_filename'],
+        objects=objects,
+        moves=moves,
+        num_frames=get_num_frames(metadata))
+
+
+def project_scene(metadata, fields=DEFAULT_FIELDS, with_locations=False,
+                  scene_file=None):
+    """
+    Copy of the metadata with only the given top level fields. The objects
+    lose their per-frame locations unless with_locations is set; scene_file
+    is kept in the copy so read_locations can load them later.
+    """
+    scene = {key: metadata[key] for key in fields if key in metadata}
+    if 'num_frames' in fields:
+        scene['num_frames'] = get_num_frames(metadata)
+    if 'objects' in scene and not with_locations:
+        scene['objects'] = [
+            {key: value for key, value in obj.items() if key != 'locations'}
+            for obj in scene['objects']]
+    if scene_file is not None:
+        scene['scene_file'] = scene_file
+    return scene
+
+
+def read_projected(fpath, fields=DEFAULT_FIELDS, with_locations=False,
+                   on_read=None):
+    """ The projected metadata of a scene file. on_read(metadata, scene) is
+    called with the full metadata and its projection, to keep more of it
+    without reading the file again. """
+    with open(fpath, 'r') as fin:
+        metadata = json.load(fin)
+    scene = project_scene(metadata, fields, with_locations, fpath)
+    if on_read is not None:
+        on_read(metadata, scene)
+    return scene
+
+
+def iter_scenes(fpaths, fields=DEFAULT_FIELDS, with_locations=False,
+                on_read=None):
+    """ Yields (fpath, projected metadata) for each scene file, holding only
+    one full scene in memory at a time (see read_projected for on_read).
+    Scenes that can not be read are logged and skipped. """
+    for fpath in fpaths:
+        try:
+            metadata = read_projected(
+                fpath, fields, with_locations, on_read)
+        except Exception as e:
+            logging.error('Unable to read {} due to {}'.format(fpath, e))
+            continue
+        yield fpath, metadata
+
+
+def read_locations(scene, shape=None):
+    """
+    Per-frame locations of the objects of a scene, as a dict from instance
+    name to the locations dict (frame number as string to [x, y, z]). scene
+    is the metadata, from which the locations are taken if it still has
+    them, or otherwise read from its scene file, or from its trajectory file
+    for scenes rendered with --compact_trajectories. If shape is given, only
+    the objects of that shape are returned.
+    """
+    objects = [obj for obj in scene['objects']
+               if shape is None or obj['shape'] == shape]
+    if 'trajectory_file' in scene:
+        trajectories = read_trajectories(scene)
+        return {obj['instance']: trajectories.get_locations(obj['instance'])
+                for obj in objects}
+    if objects and 'locations' not in objects[0]:
+        with open(scene['scene_file'], 'r') as fin:
+            objects = [obj for obj in json.load(fin)['objects']
+                       if shape is None or obj['shape'] == shape]
+    return {obj['instance']: obj['locations'] for obj in objects}
+
+
+def read_trajectories(scene):
+    """ The Trajectories of a scene rendered with --compact_trajectories. """
+    return trajectory.Trajectories(osp.join(
+        osp.dirname(scene['scene_file']), scene['trajectory_file']))
+
+
+def get_views(scene):
+    """ All camera views of a scene rendered with --num_views, starting with
+    the first view (the scene's own video and camera). """
+    first = {'view': 0}
+    for key in ('image_filename', 'camera', 'directions', 'relationships',
+                'visibility'):
+        if key in scene:
+            first[key] = scene[key]
+    return [first] + scene.get('views', [])
+
+
+def read_scene(fpath):
+    with open(fpath, 'r') as fin:
+        metadata = json.load(fin)
+    return parse_scene(osp.basename(fpath), metadata)
+
+
+class SceneIndex:
+    """ Parses each scene of a folder on first use and keeps the record. """
+    def __init__(self, scenes_folder):
+        self.scenes_folder = scenes_folder
+        self.records = {}
+
+    def get(self, scene):
+        record = self.records.get(scene)
+        if record is None:
+            record = read_scene(osp.join(self.scenes_folder, scene))
+            self.records[scene] = record
+        return record
+
+    def evict(self, scene):
+        self.records.pop(scene, None)
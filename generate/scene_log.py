@@ -0,0 +1,169 @@
+from __future__ import print_function
+
+import argparse
+import glob
+import heapq
+import json
+import logging
+import os
+import os.path as osp
+import socket
+import time
+
+
+"""
+Per-worker logs of the rendered scenes, merged into one catalog. Each
+render_videos.py worker appends every scene it finished to its own JSON lines
+file (one per worker process and run, so workers never write to the same
+file), and syncs it to disk after each scene. A line is only complete once
+it ends with a newline, so a worker killed while writing leaves at most one
+torn last line, which is skipped when reading. Since a worker renders its
+scenes in index order, each log is sorted, and `merge` builds the index
+sorted, deduplicated catalog with a streaming merge of all logs, holding one
+scene per log in memory.
+
+python scene_log.py Out/scene_logs/*.jsonl --output Out/scene.json
+"""
+
+
+def default_log_path(log_dir):
+    """ A new log per worker and run: pids are reused by later runs, so the
+    start time is part of the name. """
+    return osp.join(log_dir, '{}_{}_{}.jsonl'.format(
+        socket.gethostname(), os.getpid(),
+        time.strftime('%Y%m%d-%H%M%S')))
+
+
+class SceneLog:
+    def __init__(self, fpath, info=None):
+        self.fpath = fpath
+        self.last_index = None
+        if info is not None:
+            self._append({'info': info})
+
+    def _append(self, entry):
+        line = json.dumps(entry) + '\n'
+        with open(self.fpath, 'a') as fout:
+            fout.write(line)
+            fout.flush()
+            os.fsync(fout.fileno())
+
+    def append(self, scene):
+        index = scene['image_index']
+        assert self.last_index is None or index > self.last_index, \
+            'Scenes must be logged in index order'
+        self.last_index = index
+        self._append({'index': index, 'time': time.time(), 'scene': scene})
+
+    def append_file(self, scene_fpath):
+        with open(scene_fpath, 'r') as fin:
+            self.append(json.load(fin))
+
+
+def read_log(fpath):
+    """ Yields the entries of a log, skipping torn or corrupt lines. """
+    with open(fpath, 'r') as fin:
+        for line_no, line in enumerate(fin):
+            if not line.endswith('\n'):
+                logging.warning('Skipping torn last line of {}'.format(fpath))
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning('Skipping corrupt line {} of {}'.format(
+                    line_no + 1, fpath))
+
+
+def read_info(fpath):
+    for entry in read_log(fpath):
+        if 'info' in entry:
+            return entry['info']
+    return None
+
+
+def _read_scenes(fpath):
+    for entry in read_log(fpath):
+        if 'info' not in entry:
+            yield entry['index'], entry['time'], entry['scene']
+
+
+def _is_sorted(fpath):
+    last_index = None
+    for index, _, _ in _read_scenes(fpath):
+        if last_index is not None and index < last_index:
+            return False
+        last_index = index
+    return True
+
+
+def read_scenes(fpath):
+    """ Yields the (index, time, scene) of a log in index order. A worker
+    logs its scenes in index order, a log that is not sorted anyway (eg,
+    appended to by more than one run) is sorted in memory. """
+    if _is_sorted(fpath):
+        for el in _read_scenes(fpath):
+            yield el
+        return
+    logging.warning('{} is not sorted by index, sorting it'.format(fpath))
+    for el in sorted(_read_scenes(fpath), key=lambda el: el[0]):
+        yield el
+
+
+def merge_scenes(fpaths):
+    """ Yields the scenes of all logs sorted by index. When a scene was logged
+    more than once (rendered again in a later run), the latest is kept. """
+    last = None
+    for index, log_time, scene in heapq.merge(
+            *[read_scenes(fpath) for fpath in fpaths],
+            key=lambda el: el[0]):
+        if last is not None and last[0] != index:
+            yield last[2]
+            last = None
+        if last is None or log_time >= last[1]:
+            last = (index, log_time, scene)
+    if last is not None:
+        yield last[2]
+
+
+def merge(fpaths, output_fpath, info=None):
+    """ Write the catalog ({'info': ..., 'scenes': [...]}) of all logs to
+    output_fpath, one scene at a time. Returns the number of scenes. """
+    if info is None:
+        info = next(
+            (el for el in (read_info(fpath) for fpath in fpaths) if el), {})
+    num_scenes = 0
+    tmp_fpath = '{}.{}.tmp'.format(output_fpath, os.getpid())
+    with open(tmp_fpath, 'w') as fout:
+        fout.write('{"info": ' + json.dumps(info) + ', "scenes": [')
+        for scene in merge_scenes(fpaths):
+            if num_scenes > 0:
+                fout.write(', ')
+            fout.write(json.dumps(scene))
+            num_scenes += 1
+        fout.write(']}')
+    os.rename(tmp_fpath, output_fpath)
+    return num_scenes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Merge the per-worker scene logs into one catalog')
+    parser.add_argument(
+        'logs', nargs='+',
+        help='Scene logs, or directories with scene logs')
+    parser.add_argument(
+        '--output', required=True, help='Where to write the catalog')
+    args = parser.parse_args()
+    fpaths = []
+    for el in args.logs:
+        if osp.isdir(el):
+            fpaths += sorted(glob.glob(osp.join(el, '*.jsonl')))
+        else:
+            fpaths.append(el)
+    num_scenes = merge(fpaths, args.output)
+    print('Wrote {} scenes from {} logs to {}'.format(
+        num_scenes, len(fpaths), args.output))
+
+
+if __name__ == '__main__':
+    main()
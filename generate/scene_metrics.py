@@ -0,0 +1,106 @@
+from __future__ import print_function
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+"""
+Per-scene stage timers and counters. render_videos.py starts a SceneMetrics
+for every scene it works on, wraps each stage of the scene in `stage(name)`
+and finally appends the result as one JSON line to the metrics file. Code
+deeper down (eg, actions.py) does not need a handle to the metrics object, it
+can call the module level `stage` and `count`, which are no-ops when no scene
+is active. Use metrics_report.py to aggregate the log over a run.
+"""
+
+_ACTIVE = None
+
+
+class SceneMetrics:
+    def __init__(self, index, output_image):
+        self.index = index
+        self.output_image = output_image
+        self.start_time = time.time()
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.info = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """ Time the enclosed block. Repeated stages are accumulated. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def get_dict(self, status='ok', error=None):
+        res = OrderedDict([
+            ('index', self.index),
+            ('image', self.output_image),
+            ('status', status),
+            ('start_time', self.start_time),
+            ('total', time.time() - self.start_time),
+            ('stages', self.stages),
+            ('counters', self.counters),
+        ])
+        if self.info:
+            res['info'] = self.info
+        if error is not None:
+            res['error'] = str(error)
+        return res
+
+
+def start_scene(index, output_image):
+    """ Start collecting metrics for a new scene and make it the active one. """
+    global _ACTIVE
+    _ACTIVE = SceneMetrics(index, output_image)
+    return _ACTIVE
+
+
+def active():
+    return _ACTIVE
+
+
+def finish_scene(metrics_file, status='ok', error=None):
+    """
+    Append the active scene's metrics as a single JSON line to metrics_file
+    and deactivate it. The line is written with a single write call so that
+    multiple workers can share the same file.
+    """
+    global _ACTIVE
+    if _ACTIVE is None:
+        return None
+    res = _ACTIVE.get_dict(status=status, error=error)
+    _ACTIVE = None
+    if metrics_file is not None:
+        with open(metrics_file, 'a') as fout:
+            fout.write(json.dumps(res) + '\n')
+    return res
+
+
+@contextmanager
+def stage(name):
+    if _ACTIVE is None:
+        yield
+    else:
+        with _ACTIVE.stage(name):
+            yield
+
+
+def count(name, n=1):
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, n)
+
+
+def set_info(name, value):
+    if _ACTIVE is not None:
+        _ACTIVE.info[name] = value
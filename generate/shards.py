@@ -0,0 +1,311 @@
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import os.path as osp
+import socket
+import struct
+
+from avi_index import check_avi_broken
+from gen_utils import mkdir_p
+import render_passes
+from scene_index import get_num_frames, get_views
+
+
+"""
+Sharded, packed dataset. Instead of thousands of small video and scene files,
+the finished scenes are packed into shard files of about --max_shard_bytes
+each. A shard is a sequence of records, one per scene, followed by an index:
+
+  b'CATERSHD' (file magic)
+  per scene: b'REC0', header size (uint32), JSON header with the scene index,
+    name and the size of each member, then the members (video, scene JSON,
+    trajectories, render passes, labels, ...) one after the other
+  b'IDX0', the JSON index with the offset and size of each member
+  footer: offset of the index (uint64), b'CATERIDX'
+
+Shards can be read sequentially record by record (iter_shard), or randomly
+through the index (ShardReader, or ShardedDataset for all shards of a
+folder). Pack the rendered output with
+
+python shards.py Out --shard_dir Out/shards
+
+or write the shards while rendering with render_videos.py --shard_dir.
+"""
+
+MAGIC = b'CATERSHD'
+RECORD_MAGIC = b'REC0'
+INDEX_MAGIC = b'IDX0'
+FOOTER_MAGIC = b'CATERIDX'
+_UINT32 = struct.Struct('<I')
+_FOOTER = struct.Struct('<Q8s')
+SHARD_SUFFIX = '.shard'
+MAX_SHARD_BYTES = 1 << 30
+
+
+class ShardWriter:
+    """ Writes one shard. The shard is written to a temporary file, and only
+    appears under its name, complete with its index, once closed. """
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.tmp_fpath = '{}.{}.tmp'.format(fpath, os.getpid())
+        self._fout = open(self.tmp_fpath, 'wb')
+        self._fout.write(MAGIC)
+        self.entries = []
+
+    @property
+    def size(self):
+        return self._fout.tell()
+
+    def add(self, index, name, members):
+        """ members: OrderedDict, or list of pairs, of member name to bytes.
+        """
+        members = list(members.items()) if hasattr(members, 'items') \
+            else list(members)
+        header = json.dumps({
+            'index': index,
+            'name': name,
+            'members': [[key, len(value)] for key, value in members],
+        }).encode('utf-8')
+        self._fout.write(RECORD_MAGIC + _UINT32.pack(len(header)) + header)
+        offsets = {}
+        for key, value in members:
+            offsets[key] = [self._fout.tell(), len(value)]
+            self._fout.write(value)
+        self.entries.append({'index': index, 'name': name, 'members': offsets})
+
+    def close(self):
+        index = json.dumps(self.entries).encode('utf-8')
+        index_offset = self._fout.tell()
+        self._fout.write(INDEX_MAGIC + _UINT32.pack(len(index)) + index)
+        self._fout.write(_FOOTER.pack(index_offset, FOOTER_MAGIC))
+        self._fout.flush()
+        os.fsync(self._fout.fileno())
+        self._fout.close()
+        os.rename(self.tmp_fpath, self.fpath)
+
+
+class ShardedWriter:
+    """ Writes shards of about max_shard_bytes each, named
+    {prefix}-{number}.shard. """
+    def __init__(self, shard_dir, prefix=None,
+                 max_shard_bytes=MAX_SHARD_BYTES):
+        if prefix is None:
+            # Unique per worker, so workers can write to the same folder
+            prefix = '{}_{}'.format(socket.gethostname(), os.getpid())
+        self.shard_dir = shard_dir
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.num_shards = 0
+        self._writer = None
+
+    def add(self, index, name, members):
+        if self._writer is None:
+            self._writer = ShardWriter(osp.join(
+                self.shard_dir, '{}-{:05d}{}'.format(
+                    self.prefix, self.num_shards, SHARD_SUFFIX)))
+            self.num_shards += 1
+        self._writer.add(index, name, members)
+        if self._writer.size >= self.max_shard_bytes:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _read_exact(fin, size):
+    data = fin.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated shard {}'.format(fin.name))
+    return data
+
+
+def iter_shard(fpath):
+    """ Yields (index, name, members dict) for each scene of a shard, reading
+    it sequentially. """
+    with open(fpath, 'rb') as fin:
+        if fin.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a shard: {}'.format(fpath))
+        while True:
+            magic = _read_exact(fin, 4)
+            if magic == INDEX_MAGIC:
+                return
+            if magic != RECORD_MAGIC:
+                raise ValueError('Corrupt shard {}'.format(fpath))
+            header_size, = _UINT32.unpack(_read_exact(fin, _UINT32.size))
+            header = json.loads(_read_exact(fin, header_size).decode('utf-8'))
+            members = {}
+            for key, size in header['members']:
+                members[key] = _read_exact(fin, size)
+            yield header['index'], header['name'], members
+
+
+class ShardReader:
+    """ Random access to the scenes of a shard, through its index. """
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self._fin = open(fpath, 'rb')
+        self._fin.seek(-_FOOTER.size, os.SEEK_END)
+        index_offset, magic = _FOOTER.unpack(self._fin.read(_FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError('Shard without index: {}'.format(fpath))
+        self._fin.seek(index_offset)
+        if self._fin.read(4) != INDEX_MAGIC:
+            raise ValueError('Corrupt shard {}'.format(fpath))
+        index_size, = _UINT32.unpack(self._fin.read(_UINT32.size))
+        self.entries = json.loads(self._fin.read(index_size).decode('utf-8'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._fin.close()
+
+    def read(self, entry, member):
+        offset, size = entry['members'][member]
+        self._fin.seek(offset)
+        return self._fin.read(size)
+
+
+class ShardedDataset:
+    """ Random lookup of the scenes of all shards in a folder, by scene index
+    or name. Only the shard indexes are read up front. """
+    def __init__(self, shard_dir):
+        self.readers = [
+            ShardReader(fpath) for fpath in
+            sorted(glob.glob(osp.join(shard_dir, '*' + SHARD_SUFFIX)))]
+        self.by_index = {}
+        self.by_name = {}
+        for reader in self.readers:
+            for entry in reader.entries:
+                self.by_index[entry['index']] = (reader, entry)
+                self.by_name[entry['name']] = (reader, entry)
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+    def members(self, index=None, name=None):
+        """ Names of the members stored for a scene. """
+        _, entry = self.by_index[index] if name is None else self.by_name[name]
+        return list(entry['members'].keys())
+
+    def read(self, member, index=None, name=None):
+        """ A member (e.g. 'video', 'scene') of the scene with the given
+        index or name, as bytes. """
+        reader, entry = self.by_index[index] if name is None \
+            else self.by_name[name]
+        return reader.read(entry, member)
+
+    def read_scene(self, index=None, name=None):
+        return json.loads(self.read('scene', index, name).decode('utf-8'))
+
+
+def scene_members(scene_fpath, video_fpath, labels=None):
+    """ The members to pack for a scene: video, scene JSON, the trajectory
+    file, the videos of the other views ('video/view<k>') and the render
+    passes if any, and one 'label/<name>' per label set. """
+    members = []
+    with open(video_fpath, 'rb') as fin:
+        members.append(('video', fin.read()))
+    with open(scene_fpath, 'rb') as fin:
+        scene_json = fin.read()
+    members.append(('scene', scene_json))
+    scene = json.loads(scene_json.decode('utf-8'))
+    if 'trajectory_file' in scene:
+        with open(osp.join(osp.dirname(scene_fpath),
+                           scene['trajectory_file']), 'rb') as fin:
+            members.append(('trajectory', fin.read()))
+    for view in get_views(scene)[1:]:
+        view_fpath = osp.join(osp.dirname(video_fpath), view['image_filename'])
+        if osp.exists(view_fpath):
+            with open(view_fpath, 'rb') as fin:
+                members.append(('video/view{}'.format(view['view']),
+                                fin.read()))
+    passes_fpath = render_passes.get_fpath(video_fpath)
+    if osp.exists(passes_fpath):
+        with open(passes_fpath, 'rb') as fin:
+            members.append(('passes', fin.read()))
+    for label_name, video_labels in (labels or {}).items():
+        label = video_labels.get(osp.basename(video_fpath))
+        if label is not None:
+            members.append(('label/' + label_name, label.encode('utf-8')))
+    return scene, members
+
+
+def read_label_file(fpath):
+    """ Labels of a label list, as written by generate_labels.py
+    ('video:label') or gen_train_test.py ('video label'). """
+    labels = {}
+    with open(fpath, 'r') as fin:
+        for line in fin:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            sep = ':' if ':' in line else ' '
+            video, label = line.split(sep, 1)
+            labels[osp.basename(video)] = label
+    return labels
+
+
+def pack(output_dir, shard_dir, labels=None, max_shard_bytes=MAX_SHARD_BYTES,
+         prefix='pack'):
+    """ Pack all scenes of a render output folder with a good video. labels
+    is a dict from label set name to label list file. Returns the number of
+    scenes packed. """
+    labels = {name: read_label_file(fpath)
+              for name, fpath in (labels or {}).items()}
+    mkdir_p(shard_dir)
+    # Drop the shards of an earlier pack
+    for fpath in glob.glob(osp.join(shard_dir, prefix + '-*' + SHARD_SUFFIX)):
+        os.remove(fpath)
+    writer = ShardedWriter(shard_dir, prefix, max_shard_bytes)
+    num_packed = 0
+    for scene_fpath in sorted(glob.glob(
+            osp.join(output_dir, 'scenes', '*.json'))):
+        video_fpath = osp.join(output_dir, 'images', osp.splitext(
+            osp.basename(scene_fpath))[0] + '.avi')
+        with open(scene_fpath, 'r') as fin:
+            num_frames = get_num_frames(json.load(fin))
+        if check_avi_broken(video_fpath, num_frames):
+            continue
+        scene, members = scene_members(scene_fpath, video_fpath, labels)
+        writer.add(scene['image_index'], osp.basename(video_fpath), members)
+        num_packed += 1
+    writer.close()
+    return num_packed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pack the rendered videos and scenes into shards')
+    parser.add_argument(
+        'output_dir', help='--output_dir of render_videos.py')
+    parser.add_argument(
+        '--shard_dir', required=True, help='Where to write the shards')
+    parser.add_argument(
+        '--labels', nargs='*', default=[],
+        help='Label lists to pack with the scenes, as name=path')
+    parser.add_argument(
+        '--max_shard_bytes', default=MAX_SHARD_BYTES, type=int,
+        help='Start a new shard once one reaches this size')
+    args = parser.parse_args()
+    labels = dict(el.split('=', 1) for el in args.labels)
+    num_packed = pack(args.output_dir, args.shard_dir, labels,
+                      args.max_shard_bytes)
+    print('Packed {} scenes into {}'.format(num_packed, args.shard_dir))
+
+
+if __name__ == '__main__':
+    main()
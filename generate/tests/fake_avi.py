@@ -0,0 +1,58 @@
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+
+"""
+Small MJPEG AVI files with the layout Blender writes (AVI_JPEG), for the
+tests of the video readers. Frame i is filled with the gray level
+FRAME_STEP * i, modulo 256.
+"""
+
+FRAME_STEP = 10
+
+
+def _chunk(fourcc, data):
+    pad = b'\0' if len(data) % 2 else b''
+    return fourcc + struct.pack('<I', len(data)) + data + pad
+
+
+def _list(list_type, data):
+    return b'LIST' + struct.pack('<I', len(data) + 4) + list_type + data
+
+
+def write_avi(fpath, num_frames, width=32, height=24, fps=10, index=True,
+              truncate=None):
+    """ Write a video of num_frames frames, without the idx1 index (as an
+    unfinished render) unless index is set, and cut after truncate bytes if
+    given. Returns the JPEG of each frame. """
+    jpegs = []
+    for i in range(num_frames):
+        buf = io.BytesIO()
+        Image.fromarray(np.full((height, width, 3), FRAME_STEP * i % 256,
+                                dtype=np.uint8)).save(buf, 'JPEG')
+        jpegs.append(buf.getvalue())
+    avih = struct.pack('<10I', 100000, 0, 0, 0x10, num_frames, 0, 1, 0,
+                       width, height) + b'\0' * 16
+    strh = struct.pack('<4s4sIHHIIII', b'vids', b'MJPG', 0, 0, 0, 0, 1, fps,
+                       0) + struct.pack('<IIII', num_frames, 0, 0xffffffff,
+                                        0) + b'\0' * 8
+    hdrl = _list(b'hdrl', _chunk(b'avih', avih) + _list(
+        b'strl', _chunk(b'strh', strh) + _chunk(b'strf', b'\0' * 40)))
+    movi, idx1 = b'', b''
+    for jpeg in jpegs:
+        # Offsets relative to the 'movi' fourcc
+        idx1 += struct.pack('<4sIII', b'00dc', 0x10, 4 + len(movi),
+                            len(jpeg))
+        movi += _chunk(b'00dc', jpeg)
+    body = b'AVI ' + hdrl + _list(b'movi', movi)
+    if index:
+        body += _chunk(b'idx1', idx1)
+    data = b'RIFF' + struct.pack('<I', len(body)) + body
+    if truncate is not None:
+        data = data[:truncate]
+    with open(fpath, 'wb') as fout:
+        fout.write(data)
+    return jpegs
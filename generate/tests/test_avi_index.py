@@ -0,0 +1,60 @@
+import avi_index
+from fake_avi import write_avi
+
+
+def test_read_avi(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    jpegs = write_avi(fpath, 5, width=32, height=24, fps=10)
+    info, frames = avi_index.read_avi(fpath, with_frames=True)
+    assert info.error is None
+    assert info.has_index and not info.truncated
+    assert info.header_frames == 5 and info.index_frames == 5
+    assert (info.width, info.height, info.fps) == (32, 24, 10.0)
+    assert frames.sizes == [len(el) for el in jpegs]
+    with open(fpath, 'rb') as fin:
+        data = fin.read()
+    for offset, jpeg in zip(frames.offsets, jpegs):
+        assert data[offset:offset + len(jpeg)] == jpeg
+
+
+def test_is_broken(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    write_avi(fpath, 5)
+    info = avi_index.read_avi(fpath)
+    assert not avi_index.is_broken(info)
+    # The video has num_frames + 1 frames
+    assert not avi_index.is_broken(info, 4)
+    assert avi_index.is_broken(info, 5)
+
+
+def test_unfinished_videos_are_broken(tmp_path):
+    no_index = str(tmp_path / 'no_index.avi')
+    write_avi(no_index, 5, index=False)
+    assert not avi_index.read_avi(no_index).has_index
+    truncated = str(tmp_path / 'truncated.avi')
+    write_avi(truncated, 5, truncate=2000)
+    assert avi_index.read_avi(truncated).truncated
+    not_avi = str(tmp_path / 'not_avi.avi')
+    with open(not_avi, 'wb') as fout:
+        fout.write(b'RIFF\0\0\0\0WAVE')
+    assert avi_index.read_avi(not_avi).error is not None
+    missing = str(tmp_path / 'missing.avi')
+    assert avi_index.check_avis_broken(
+        [no_index, truncated, not_avi, missing]) == [True] * 4
+
+
+def test_locked_video_is_broken(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    write_avi(fpath, 5)
+    assert not avi_index.check_avi_broken(fpath, 4)
+    open(fpath + '.lock', 'w').close()
+    assert avi_index.check_avi_broken(fpath, 4)
+
+
+def test_check_avis_broken_num_frames(tmp_path):
+    fpaths = [str(tmp_path / '{}.avi'.format(i)) for i in range(3)]
+    for fpath in fpaths:
+        write_avi(fpath, 5)
+    assert avi_index.check_avis_broken(fpaths, 4) == [False] * 3
+    assert avi_index.check_avis_broken(fpaths, [4, 5, None]) == \
+        [False, True, False]
@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+
+import clip_index
+from generate_labels import DICTIONARY_INDEX, find_missing_window
+from fake_avi import write_avi
+from scene_index import SceneRecord
+
+
+def make_record(moves, num_frames=90):
+    return SceneRecord(
+        name='CATER_new_000000.json', video='CATER_new_000000.avi',
+        objects={'Spl_0': ('gold', 'metal', 'spl'),
+                 'Cone_1': ('red', 'rubber', 'cone')},
+        moves=moves, num_frames=num_frames)
+
+
+def test_windows_share_their_boundary():
+    moves = [
+        ['Spl_0', '_slide', None, 2, 30],
+        ['Cone_1', '_rotate', None, 25, 35],
+        ['Cone_1', '_pick_place', None, 33, 58],
+        ['Spl_0', '_slide', None, 61, 89],
+    ]
+    windows = clip_index.get_windows(make_record(moves))
+    assert [start for start, _ in windows] == [0, 30, 60]
+    assert [[move[3] for move in window] for _, window in windows] == \
+        [[2], [33], [61]]
+    # Same convention as the labels: every window has a move
+    assert find_missing_window(moves) is None
+    assert find_missing_window(moves[1:]) == (0, 30)
+
+
+def test_build(tmp_path):
+    output_dir = str(tmp_path)
+    os.makedirs(os.path.join(output_dir, 'images'))
+    os.makedirs(os.path.join(output_dir, 'scenes'))
+    for index, rendered in [(0, True), (1, False)]:
+        name = 'CATER_new_{:06d}'.format(index)
+        if rendered:
+            write_avi(os.path.join(output_dir, 'images', name + '.avi'), 61)
+        scene = {
+            'image_filename': name + '.avi',
+            'num_frames': 60,
+            'objects': [{'instance': 'Spl_0', 'color': 'gold',
+                         'material': 'metal', 'shape': 'spl'}],
+            'movements': {'Spl_0': [['_slide', None, 3, 20],
+                                    ['_no_op', None, 31, 40]]},
+        }
+        with open(os.path.join(output_dir, 'scenes', name + '.json'),
+                  'w') as fout:
+            json.dump(scene, fout)
+    fpath = str(tmp_path / 'clips.npz')
+    np.savez(fpath, **clip_index.build(output_dir))
+    index = clip_index.ClipIndex(fpath)
+    assert len(index) == 2
+    clip = index.get(0)
+    assert clip['video'] == 'CATER_new_000000.avi'
+    assert clip['start'] == 0
+    np.testing.assert_array_equal(clip['frames'], [[3, 20]])
+    np.testing.assert_array_equal(clip['tokens'], [[
+        DICTIONARY_INDEX[el] for el in ('_slide', 'gold', 'metal', 'spl')]])
+    assert len(index.get(1)['tokens']) == 0
+    assert index.get(1)['offset'] > clip['offset']
+    np.testing.assert_array_equal(index.sample(5), [0] * 5)
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+import frame_reader
+from fake_avi import FRAME_STEP, write_avi
+
+
+def test_get_frames(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    jpegs = write_avi(fpath, 6, width=32, height=24)
+    with frame_reader.FrameReader(fpath, num_frames=5) as reader:
+        assert len(reader) == 6
+        assert reader.get_jpeg(2) == jpegs[2]
+        frame = reader.get_frame(3)
+        assert frame.shape == (24, 32, 3) and frame.dtype == np.uint8
+        clip = reader.get_clip(1, 3, step=2)
+        assert clip.shape == (3, 24, 32, 3)
+        # JPEG is lossy, the gray levels are close
+        np.testing.assert_allclose(
+            clip.mean(axis=(1, 2, 3)),
+            [FRAME_STEP * el for el in (1, 3, 5)], atol=2)
+    assert os.path.exists(frame_reader.index_path(fpath))
+
+
+def test_index_rebuilt_when_video_changes(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    write_avi(fpath, 4)
+    assert len(frame_reader.load_index(fpath)['offsets']) == 4
+    write_avi(fpath, 6)
+    st = os.stat(fpath)
+    os.utime(fpath, (st.st_atime, st.st_mtime + 10))
+    assert len(frame_reader.load_index(fpath)['offsets']) == 6
+
+
+def test_broken_video(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    write_avi(fpath, 4, index=False)
+    with pytest.raises(ValueError):
+        frame_reader.build_index(fpath)
+    write_avi(fpath, 4)
+    with pytest.raises(ValueError):
+        frame_reader.build_index(fpath, num_frames=10)
+
+
+def test_add_huffman_tables(tmp_path):
+    fpath = str(tmp_path / 'video.avi')
+    jpeg = write_avi(fpath, 1)[0]
+    # Drop the DHT segments, as MJPEG writers may
+    start = jpeg.find(frame_reader._DHT_MARKER)
+    sos = jpeg.find(frame_reader._SOS_MARKER)
+    stripped = jpeg[:start] + jpeg[sos:]
+    assert frame_reader.add_huffman_tables(jpeg) == jpeg
+    np.testing.assert_array_equal(frame_reader.decode_jpeg(stripped),
+                                  frame_reader.decode_jpeg(jpeg))
@@ -0,0 +1,73 @@
+import os
+
+from label_cache import LabelCache
+
+
+def write(fpath, content):
+    with open(fpath, 'w') as fout:
+        fout.write(content)
+
+
+def touch(fpath, seconds=10):
+    st = os.stat(fpath)
+    os.utime(fpath, (st.st_atime, st.st_mtime + seconds))
+
+
+def test_get_put_save(tmp_path):
+    scene = str(tmp_path / 'scene.json')
+    write(scene, '{}')
+    cache_fpath = str(tmp_path / 'cache.pkl')
+    cache = LabelCache(cache_fpath)
+    assert cache.get(scene) is None
+    cache.put(scene, 'label')
+    assert cache.get(scene) == 'label'
+    cache.save()
+    cache = LabelCache(cache_fpath)
+    assert cache.get(scene) == 'label'
+    assert (cache.num_hits, cache.num_misses) == (1, 0)
+    # Other versions are dropped
+    assert LabelCache(cache_fpath, version=2).get(scene) is None
+
+
+def test_scene_changes(tmp_path):
+    scene = str(tmp_path / 'scene.json')
+    write(scene, '{"a": 1}')
+    cache = LabelCache(str(tmp_path / 'cache.pkl'))
+    cache.put(scene, 'label')
+    # Touched only: same content
+    touch(scene)
+    assert cache.get(scene) == 'label'
+    # Same size, other content
+    write(scene, '{"a": 2}')
+    touch(scene, 20)
+    assert cache.get(scene) is None
+    cache.put(scene, 'label')
+    write(scene, '{"a": 10}')
+    assert cache.get(scene) is None
+
+
+def test_video_changes(tmp_path):
+    scene = str(tmp_path / 'scene.json')
+    video = str(tmp_path / 'video.avi')
+    write(scene, '{}')
+    write(video, 'frames')
+    open(video + '.lock', 'w').close()
+    cache = LabelCache(str(tmp_path / 'cache.pkl'))
+    cache.put(scene, 'broken', video_path=video)
+    assert cache.get(scene) == 'broken'
+    # Unlocked once rendered
+    os.remove(video + '.lock')
+    assert cache.get(scene) is None
+    cache.put(scene, 'good', video_path=video)
+    write(video, 'more frames')
+    assert cache.get(scene) is None
+
+
+def test_prune(tmp_path):
+    scenes = [str(tmp_path / '{}.json'.format(i)) for i in range(3)]
+    cache = LabelCache(str(tmp_path / 'cache.pkl'))
+    for scene in scenes:
+        write(scene, '{}')
+        cache.put(scene, scene)
+    cache.prune(scenes[1:])
+    assert sorted(cache.entries) == scenes[1:]
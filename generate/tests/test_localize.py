@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+
+import localize
+from scene_index import iter_scenes
+
+
+def write_scene(fpath, num_frames=5):
+    metadata = {
+        'image_filename': 'CATER_new_000000.avi',
+        'num_frames': num_frames - 1,
+        'movements': {},
+        'objects': [
+            {'instance': instance, 'shape': shape, 'color': 'gold',
+             'material': 'metal',
+             'locations': {str(frame): [offset + frame, -frame, 0.0]
+                           for frame in range(num_frames)}}
+            for instance, shape, offset in [('Spl_0', 'spl', 0.5),
+                                            ('Cone_1', 'cone', 2.0)]],
+    }
+    with open(fpath, 'w') as fout:
+        json.dump(metadata, fout)
+
+
+def read_with_trajectory(fpath):
+    return list(iter_scenes(
+        [fpath], on_read=lambda full, scene: localize.with_trajectory(
+            scene, full_metadata=full)))
+
+
+def test_with_trajectory_on_read(tmp_path):
+    fpath = str(tmp_path / 'scene.json')
+    write_scene(fpath)
+    [(_, metadata)] = read_with_trajectory(fpath)
+    assert 'locations' not in metadata['objects'][0]
+    expected = [[0.5 + frame, -frame] for frame in range(5)]
+    np.testing.assert_array_equal(metadata['spl_trajectory'], expected)
+    # Same as reading the locations back from the scene file
+    del metadata['spl_trajectory']
+    np.testing.assert_array_equal(localize.get_trajectory(metadata),
+                                  expected)
+
+
+def test_unreadable_scene_skipped(tmp_path):
+    fpath = str(tmp_path / 'scene.json')
+    with open(fpath, 'w') as fout:
+        fout.write('{')
+    assert read_with_trajectory(fpath) == []
+
+
+def test_localize_pads_short_videos():
+    metadatas = [
+        {'spl_trajectory': np.zeros((10, 2))},
+        {'spl_trajectory': np.zeros((4, 2))},
+    ]
+    positions, num_frames = localize.get_trajectories(metadatas)
+    assert positions.shape == (2, 10, 2)
+    np.testing.assert_array_equal(num_frames, [10, 4])
+    frame_ids, lengths = localize.get_frame_ids(num_frames, 'all')
+    np.testing.assert_array_equal(lengths, [10, 4])
+    assert frame_ids.shape == (2, 10)
+    class_ids = localize.localize(positions, num_frames, [(3, 3)], 'all')
+    assert np.all(class_ids[0, 1, 4:] == localize.PAD)
+    assert np.all(class_ids[0, :, :4] != localize.PAD)
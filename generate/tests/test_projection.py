@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+
+import projection
+
+
+def make_scene(num_frames=4):
+    """ A scene struct as planned by render_videos.py, before it is written:
+    the locations are keyed by the frame number as an int. """
+    objects = []
+    for i, instance in enumerate(['Cone_0', 'Sphere_1']):
+        objects.append({
+            'instance': instance,
+            'sized': 0.5,
+            'locations': {frame: [float(i), float(frame), 0.0]
+                          for frame in range(num_frames)},
+        })
+    camera = {
+        'width': 320,
+        'height': 240,
+        'projection': np.eye(4).tolist(),
+        'modelview': [np.eye(4).tolist()],
+    }
+    return {'objects': objects, 'num_frames': num_frames - 1,
+            'camera': camera}
+
+
+def test_get_positions_unserialized(tmp_path):
+    scene = make_scene()
+    # As render_videos.get_scene_positions calls it
+    positions = projection.get_positions(
+        dict(scene, scene_file=str(tmp_path / 'scene.json')))
+    assert positions.shape == (2, 4, 3)
+    np.testing.assert_array_equal(positions[1, :, 1], [0, 1, 2, 3])
+    np.testing.assert_array_equal(positions[:, 0, 0], [0, 1])
+
+
+def test_get_positions_from_json():
+    scene = make_scene()
+    serialized = json.loads(json.dumps(scene))
+    np.testing.assert_array_equal(projection.get_positions(serialized),
+                                  projection.get_positions(scene))
+
+
+def test_project_center():
+    pixels, depth = projection.project(
+        [[0.0, 0.0, -2.0], [1.0, 1.0, -2.0]], np.eye(4), np.eye(4)[None],
+        320, 240)
+    np.testing.assert_allclose(pixels, [[160, 120], [320, 0]])
+    np.testing.assert_allclose(depth, [2, 2])
+
+
+def test_annotate_shapes():
+    annotations = projection.annotate(make_scene())
+    assert annotations['centers'].shape == (2, 4, 2)
+    assert annotations['boxes'].shape == (2, 4, 4)
+    assert annotations['depth'].shape == (2, 4)
+    boxes = annotations['boxes']
+    assert np.all(boxes[..., :2] <= boxes[..., 2:])
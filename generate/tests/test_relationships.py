@@ -0,0 +1,40 @@
+import numpy as np
+
+import relationships
+
+# Directions on the ground plane, as in scene_struct['directions']
+DIRECTIONS = {
+    'left': (-1.0, 0.0, 0.0),
+    'right': (1.0, 0.0, 0.0),
+    'front': (0.0, -1.0, 0.0),
+    'behind': (0.0, 1.0, 0.0),
+}
+
+
+def test_relation_tensor():
+    # Object 1 moves from the right of object 0 to its left
+    positions = [
+        [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]],
+        [[1.0, 0.1, 0.0], [-1.0, 1.0, 0.0]],
+    ]
+    tensor = relationships.relation_tensor(positions, DIRECTIONS)
+    assert tensor.shape == (4, 2, 2, 2)
+    assert relationships.to_lists(tensor) == {
+        'left': [[], [0]], 'right': [[1], []], 'front': [[], []],
+        'behind': [[], []]}
+    assert relationships.to_lists(tensor, frame=1) == {
+        'left': [[1], []], 'right': [[], [0]], 'front': [[], [0]],
+        'behind': [[1], []]}
+
+
+def test_eps_and_diagonal():
+    positions = np.zeros((3, 1, 3))
+    positions[1, 0, 0] = 0.1
+    positions[2, 0, 0] = 0.5
+    tensor = relationships.relation_tensor(positions, DIRECTIONS)
+    right = relationships.RELATIONS.index('right')
+    # Closer than EPS: not related
+    assert not tensor[right, 0, 0, 1]
+    assert tensor[right, 0, 0, 2] and tensor[right, 0, 1, 2]
+    tensor = relationships.relation_tensor(positions, DIRECTIONS, eps=-1)
+    assert not tensor[:, :, [0, 1, 2], [0, 1, 2]].any()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import render_passes
+
+
+def test_rle_round_trip():
+    labels = np.array([[0, 0, 1], [1, 1, 2]], dtype=np.uint8)
+    values, lengths = render_passes.rle_encode(labels)
+    np.testing.assert_array_equal(values, [0, 1, 2])
+    np.testing.assert_array_equal(lengths, [2, 3, 1])
+    np.testing.assert_array_equal(
+        render_passes.rle_decode(values, lengths, labels.shape), labels)
+
+
+def test_write_and_read(tmp_path):
+    fpath = render_passes.get_fpath(str(tmp_path / 'video.avi'))
+    assert fpath.endswith(render_passes.SUFFIX)
+    writer = render_passes.PassWriter(fpath, ['Cone_0', 'Spl_1'])
+    index = np.zeros((4, 6), dtype=np.uint8)
+    index[1:3, 1:3] = 1
+    index[2:, 4:] = 2
+    depth = np.full((4, 6), 1e10, dtype=np.float32)
+    depth[index > 0] = 3.5
+    for frame in range(3):
+        writer.add(index=np.roll(index, frame, axis=1), depth=depth)
+    writer.close()
+    with render_passes.Passes(fpath) as passes:
+        assert len(passes) == 3
+        assert passes.instances == ['Cone_0', 'Spl_1']
+        np.testing.assert_array_equal(passes.get_index(2),
+                                      np.roll(index, 2, axis=1))
+        np.testing.assert_array_equal(passes.get_mask(0, 'Spl_1'),
+                                      index == 2)
+        frame_depth = passes.get_depth(1)
+        assert np.all(np.isinf(frame_depth[index == 0]))
+        np.testing.assert_allclose(frame_depth[index > 0], 3.5)
+        assert passes.get_depth().shape == (3, 4, 6)
+
+
+def test_depth_only(tmp_path):
+    fpath = str(tmp_path / 'video.passes.npz')
+    writer = render_passes.PassWriter(fpath, ['Cone_0'])
+    writer.add(depth=np.ones((2, 2)))
+    writer.close()
+    with render_passes.Passes(fpath) as passes:
+        assert len(passes) == 1
+        with pytest.raises(KeyError):
+            passes.get_index(0)
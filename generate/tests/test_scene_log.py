@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import scene_log
+
+
+def scene(index, **fields):
+    return dict(fields, image_index=index)
+
+
+def write_entries(fpath, entries):
+    with open(fpath, 'w') as fout:
+        for entry in entries:
+            fout.write(json.dumps(entry) + '\n')
+
+
+def test_merge(tmp_path):
+    fpaths = [str(tmp_path / 'a.jsonl'), str(tmp_path / 'b.jsonl')]
+    log_a = scene_log.SceneLog(fpaths[0], info={'split': 'train'})
+    log_b = scene_log.SceneLog(fpaths[1], info={'split': 'train'})
+    for index in [0, 2, 5]:
+        log_a.append(scene(index))
+    for index in [1, 3]:
+        log_b.append(scene(index))
+    output = str(tmp_path / 'scenes.json')
+    assert scene_log.merge(fpaths, output) == 5
+    with open(output) as fin:
+        catalog = json.load(fin)
+    assert catalog['info'] == {'split': 'train'}
+    assert [el['image_index'] for el in catalog['scenes']] == [0, 1, 2, 3, 5]
+
+
+def test_append_in_index_order(tmp_path):
+    log = scene_log.SceneLog(str(tmp_path / 'a.jsonl'))
+    log.append(scene(3))
+    with pytest.raises(AssertionError):
+        log.append(scene(2))
+
+
+def test_append_file(tmp_path):
+    scene_fpath = str(tmp_path / 'scene.json')
+    with open(scene_fpath, 'w') as fout:
+        json.dump(scene(7, image_filename='v.avi'), fout)
+    fpath = str(tmp_path / 'a.jsonl')
+    scene_log.SceneLog(fpath).append_file(scene_fpath)
+    [(index, _, logged)] = list(scene_log.read_scenes(fpath))
+    assert index == 7 and logged['image_filename'] == 'v.avi'
+
+
+def test_torn_and_corrupt_lines(tmp_path):
+    fpath = str(tmp_path / 'a.jsonl')
+    with open(fpath, 'w') as fout:
+        fout.write(json.dumps({'index': 0, 'time': 0, 'scene': scene(0)}))
+        fout.write('\n{"index": 1, "ti\n')
+        fout.write(json.dumps({'index': 2, 'time': 0, 'scene': scene(2)}))
+        fout.write('\n{"index": 3, "time"')
+    assert [el[0] for el in scene_log.read_scenes(fpath)] == [0, 2]
+
+
+def test_duplicates_keep_latest(tmp_path):
+    fpaths = [str(tmp_path / 'a.jsonl'), str(tmp_path / 'b.jsonl')]
+    write_entries(fpaths[0], [
+        {'index': 0, 'time': 1, 'scene': scene(0, run='first')},
+        {'index': 1, 'time': 5, 'scene': scene(1, run='second')}])
+    write_entries(fpaths[1], [
+        {'index': 0, 'time': 2, 'scene': scene(0, run='second')},
+        {'index': 1, 'time': 3, 'scene': scene(1, run='first')}])
+    assert [el['run'] for el in scene_log.merge_scenes(fpaths)] == \
+        ['second', 'second']
+
+
+def test_unsorted_log(tmp_path):
+    fpath = str(tmp_path / 'a.jsonl')
+    # Two runs appended to the same log
+    write_entries(fpath, [
+        {'index': index, 'time': 0, 'scene': scene(index)}
+        for index in [2, 4, 1, 3]])
+    assert [el['image_index'] for el in scene_log.merge_scenes([fpath])] == \
+        [1, 2, 3, 4]
+
+
+def test_default_log_path(tmp_path):
+    fpath = scene_log.default_log_path(str(tmp_path))
+    assert fpath.startswith(str(tmp_path)) and fpath.endswith('.jsonl')
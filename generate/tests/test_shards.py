@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+import shards
+from fake_avi import write_avi
+
+
+def test_write_and_read(tmp_path):
+    fpath = str(tmp_path / 'a.shard')
+    writer = shards.ShardWriter(fpath)
+    writer.add(0, 'v0.avi', [('video', b'abc'), ('scene', b'{}')])
+    writer.add(1, 'v1.avi', [('video', b''), ('scene', b'{"a": 1}')])
+    # Only complete shards appear under their name
+    assert not os.path.exists(fpath)
+    writer.close()
+    records = list(shards.iter_shard(fpath))
+    assert [(index, name) for index, name, _ in records] == \
+        [(0, 'v0.avi'), (1, 'v1.avi')]
+    assert records[1][2] == {'video': b'', 'scene': b'{"a": 1}'}
+    with shards.ShardReader(fpath) as reader:
+        assert reader.read(reader.entries[0], 'video') == b'abc'
+        assert reader.read(reader.entries[1], 'scene') == b'{"a": 1}'
+
+
+def test_truncated_shard(tmp_path):
+    fpath = str(tmp_path / 'a.shard')
+    writer = shards.ShardWriter(fpath)
+    writer.add(0, 'v0.avi', [('video', b'abcdef')])
+    writer.close()
+    with open(fpath, 'rb') as fin:
+        data = fin.read()
+    with open(fpath, 'wb') as fout:
+        fout.write(data[:len(shards.MAGIC) + 20])
+    with pytest.raises(ValueError):
+        list(shards.iter_shard(fpath))
+    with pytest.raises(ValueError):
+        shards.ShardReader(fpath)
+
+
+def test_sharded_dataset(tmp_path):
+    writer = shards.ShardedWriter(str(tmp_path), prefix='test',
+                                  max_shard_bytes=100)
+    for index in range(5):
+        writer.add(index, 'v{}.avi'.format(index), [
+            ('video', b'x' * 60),
+            ('scene', json.dumps({'image_index': index}).encode('utf-8'))])
+    writer.close()
+    assert writer.num_shards > 1
+    dataset = shards.ShardedDataset(str(tmp_path))
+    assert len(dataset) == 5
+    assert dataset.read_scene(3) == {'image_index': 3}
+    assert dataset.read('video', name='v4.avi') == b'x' * 60
+    assert dataset.members(0) == ['video', 'scene']
+    dataset.close()
+
+
+def write_scene(output_dir, index, num_frames=4, index_video=True,
+                views=()):
+    name = 'CATER_new_{:06d}'.format(index)
+    video = os.path.join(output_dir, 'images', name + '.avi')
+    write_avi(video, num_frames + 1, index=index_video)
+    scene = {'image_index': index, 'image_filename': name + '.avi',
+             'num_frames': num_frames, 'objects': [], 'views': []}
+    for view_id in views:
+        view_name = '{}_view{}.avi'.format(name, view_id)
+        write_avi(os.path.join(output_dir, 'images', view_name),
+                  num_frames + 1)
+        scene['views'].append({'view': view_id,
+                               'image_filename': view_name})
+    with open(os.path.join(output_dir, 'scenes', name + '.json'), 'w') as f:
+        json.dump(scene, f)
+    return name + '.avi'
+
+
+def test_pack(tmp_path):
+    output_dir = str(tmp_path / 'Out')
+    os.makedirs(os.path.join(output_dir, 'images'))
+    os.makedirs(os.path.join(output_dir, 'scenes'))
+    good = write_scene(output_dir, 0, views=[1])
+    write_scene(output_dir, 1, index_video=False)
+    labels = str(tmp_path / 'labels.txt')
+    with open(labels, 'w') as fout:
+        fout.write('{} 3,5\n'.format(good))
+    shard_dir = str(tmp_path / 'shards')
+    assert shards.pack(output_dir, shard_dir, {'actions': labels}) == 1
+    dataset = shards.ShardedDataset(shard_dir)
+    assert sorted(dataset.members(0)) == \
+        ['label/actions', 'scene', 'video', 'video/view1']
+    assert dataset.read('label/actions', 0) == b'3,5'
+    with open(os.path.join(output_dir, 'images', good), 'rb') as fin:
+        assert dataset.read('video', name=good) == fin.read()
+    dataset.close()
+
+
+def test_read_label_file(tmp_path):
+    fpath = str(tmp_path / 'labels.txt')
+    with open(fpath, 'w') as fout:
+        fout.write('images/a.avi:1,2\nb.avi 3\n\n')
+    assert shards.read_label_file(fpath) == {'a.avi': '1,2', 'b.avi': '3'}
@@ -0,0 +1,52 @@
+import numpy as np
+
+import trajectory
+
+
+def piecewise_linear(num_frames=30):
+    """ Static, then a slide from frame 10 to 20, then static. """
+    locations = np.zeros((num_frames, 3))
+    locations[:, 2] = 0.35
+    locations[10:20, 0] = np.linspace(0, 1, 11)[:10]
+    locations[20:, 0] = 1
+    locations[10:20, 1] = np.linspace(0, -2, 11)[:10]
+    locations[20:, 1] = -2
+    return locations
+
+
+def test_keyframes():
+    keyframes = trajectory.get_keyframes(piecewise_linear())
+    np.testing.assert_array_equal(keyframes, [0, 10, 20, 29])
+    np.testing.assert_array_equal(
+        trajectory.get_keyframes(np.zeros((2, 3))), [0, 1])
+
+
+def test_round_trip(tmp_path):
+    fpath = str(tmp_path / 'scene.npz')
+    moving = piecewise_linear()
+    static = np.tile([[2.0, 3.0, 0.35]], (30, 1))
+    trajectory.write(fpath, ['Spl_0', 'Cube_1'], [moving, static])
+    trajectories = trajectory.Trajectories(fpath)
+    assert trajectories.num_frames == 30
+    np.testing.assert_allclose(trajectories.get('Spl_0'), moving)
+    np.testing.assert_allclose(trajectories.get('Cube_1'), static)
+    np.testing.assert_allclose(trajectories.at('Spl_0', 15), moving[15])
+    np.testing.assert_allclose(
+        trajectories.get('Spl_0', [0, 12, 25]), moving[[0, 12, 25]])
+    assert trajectories.get_segments('Spl_0') == [
+        (0, 10, 'static'), (10, 20, 'linear'), (20, 29, 'static')]
+    assert trajectories.get_segments('Cube_1') == [(0, 29, 'static')]
+
+
+def test_get_locations(tmp_path):
+    fpath = str(tmp_path / 'scene.npz')
+    moving = piecewise_linear()
+    trajectory.write(fpath, ['Spl_0'], [moving])
+    locations = trajectory.Trajectories(fpath).get_locations('Spl_0')
+    assert sorted(locations, key=int) == [str(el) for el in range(30)]
+    np.testing.assert_allclose(locations['15'], moving[15])
+
+
+def test_get_fpath():
+    assert trajectory.get_fpath('Out/scenes/CATER_new_000001.json') == \
+        'Out/scenes/CATER_new_000001.npz'
@@ -0,0 +1,67 @@
+import numpy as np
+
+import visibility
+
+
+def boxes_and_depth(boxes, depth, num_frames=3):
+    """ Annotations of static objects, as from projection.annotate. """
+    boxes = np.array(boxes, dtype=np.float64)[:, np.newaxis]
+    depth = np.array(depth, dtype=np.float64)[:, np.newaxis]
+    return {'boxes': np.repeat(boxes, num_frames, axis=1),
+            'depth': np.repeat(depth, num_frames, axis=1)}
+
+
+def test_footprint_area():
+    mask = visibility.footprints(
+        np.array([0.0, 0.0, 64.0, 64.0]), 64, 64, downsample=1)
+    assert abs(mask.sum() - np.pi * 32 ** 2) < 0.02 * np.pi * 32 ** 2
+
+
+def test_occlusion():
+    annotations = boxes_and_depth(
+        [[0, 0, 32, 32], [0, 0, 32, 32], [32, 0, 64, 32], [32, 0, 64, 32]],
+        [5, 2, 3, -1])
+    visible = visibility.visible_pixels(annotations, 64, 64, chunk_frames=2)
+    assert visible.shape == (4, 3)
+    # Hidden behind the second object
+    np.testing.assert_array_equal(visible[0], 0)
+    assert np.all(visible[1] > 0)
+    np.testing.assert_array_equal(visible[1], visible[2])
+    # Behind the camera
+    np.testing.assert_array_equal(visible[3], 0)
+
+
+def make_scene():
+    return {
+        'objects': [{'instance': 'Cone_0'}, {'instance': 'Spl_1'}],
+        'movements': {
+            'Cone_0': [['_contain', 'Spl_1', 10, 15],
+                       ['_pick_place', None, 16, 20]],
+            'Spl_1': [['_no_op', None, 0, 5], ['_slide', None, 12, 18]],
+        },
+    }
+
+
+def test_get_contained():
+    contained = visibility.get_contained(make_scene(), 30)
+    assert not contained[0].any()
+    np.testing.assert_array_equal(
+        np.flatnonzero(contained[1]), np.arange(10, 20))
+
+
+def test_check():
+    scene = make_scene()
+    visible = np.full((2, 30), 500)
+    assert visibility.check(scene, visible, 200) == []
+    # Hidden only while inside the cone
+    visible[1, 10:20] = 0
+    assert visibility.check(scene, visible, 200) == []
+    visible[0, 0] = 10
+    visible[0, 10:21] = 0
+    problems = visibility.check(scene, visible, 200)
+    assert problems == [
+        'Cone_0 at frame 0 (10 px)',
+        'Cone_0 during _contain at 10-15 (0 px)',
+        'Cone_0 during _pick_place at 16-20 (0 px)']
+    # 0 turns the check off
+    assert visibility.check(scene, visible, 0) == []
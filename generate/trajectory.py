@@ -0,0 +1,127 @@
+import os.path as osp
+
+import numpy as np
+
+
+"""
+Compact trajectories of the scene objects. The movements (move_to_location,
+_slide, _pick_place, _contain) are piecewise linear in the location, and the
+objects are static most of the time, so a trajectory is stored as the frames
+where it changes direction (keyframes) with the location at each, and
+linearly interpolated in between. render_videos.py --compact_trajectories
+writes the trajectories of all objects of a scene to a .npz file next to the
+scene JSON instead of the per-frame `locations`; Trajectories reads them back.
+"""
+
+# Type of the segment starting at each keyframe
+STATIC = 0
+LINEAR = 1
+SEGMENT_TYPES = ('static', 'linear')
+
+# Locations closer than this are treated as the same
+TOLERANCE = 1e-6
+
+
+def get_keyframes(locations, tol=TOLERANCE):
+    """
+    Indices of the keyframes of a (num frames, 3) array of locations: the
+    first and last frames, and every frame where the velocity changes.
+    """
+    locations = np.asarray(locations, dtype=np.float64)
+    if len(locations) <= 2:
+        return np.arange(len(locations))
+    velocity = np.diff(locations, axis=0)
+    changes = np.abs(np.diff(velocity, axis=0)).max(axis=1) > tol
+    return np.concatenate([[0], np.nonzero(changes)[0] + 1,
+                           [len(locations) - 1]])
+
+
+def encode(all_locations, tol=TOLERANCE):
+    """
+    Encode the (num frames, 3) locations of each object. Returns a dict of
+    arrays: keyframes of all objects concatenated, with offsets[i] the index
+    of the first keyframe of the i-th object.
+    """
+    offsets, frames, positions, segments = [0], [], [], []
+    num_frames = None
+    for locations in all_locations:
+        locations = np.asarray(locations, dtype=np.float64)
+        assert num_frames in (None, len(locations)), \
+            'All objects must have the same number of frames'
+        num_frames = len(locations)
+        keyframes = get_keyframes(locations, tol)
+        moving = np.abs(np.diff(locations[keyframes], axis=0)).max(axis=1) \
+            > tol if len(keyframes) > 1 else np.zeros(0, dtype=bool)
+        frames.append(keyframes)
+        positions.append(locations[keyframes])
+        # The last keyframe does not start a segment
+        segments.append(np.append(np.where(moving, LINEAR, STATIC), STATIC))
+        offsets.append(offsets[-1] + len(keyframes))
+    return {
+        'num_frames': np.int32(num_frames or 0),
+        'offsets': np.array(offsets, dtype=np.int32),
+        'frames': np.concatenate(frames or [[]]).astype(np.int32),
+        'positions': np.concatenate(
+            positions or [np.zeros((0, 3))]).astype(np.float64),
+        'segments': np.concatenate(segments or [[]]).astype(np.int8),
+    }
+
+
+def write(fpath, instances, all_locations, tol=TOLERANCE):
+    """ Write the trajectories of the objects (in the order of instances) to
+    an .npz file. """
+    arrays = encode(all_locations, tol)
+    arrays['instances'] = np.array(list(instances), dtype='U')
+    np.savez_compressed(fpath, **arrays)
+
+
+def get_fpath(scene_fpath):
+    """ Path of the trajectory file written for a scene JSON. """
+    return osp.splitext(scene_fpath)[0] + '.npz'
+
+
+class Trajectories(object):
+    """ Reader for the trajectories written by `write`. """
+    def __init__(self, fpath):
+        with np.load(fpath) as data:
+            self.num_frames = int(data['num_frames'])
+            self.offsets = data['offsets']
+            self.frames = data['frames']
+            self.positions = data['positions']
+            self.segments = data['segments']
+            self.instances = [str(el) for el in data['instances']]
+        self._instance_ids = {
+            instance: i for i, instance in enumerate(self.instances)}
+
+    def _keyframes(self, instance):
+        i = self._instance_ids[instance]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.frames[start:end], self.positions[start:end]
+
+    def get(self, instance, frames=None):
+        """ (len(frames), 3) array with the locations of the object at the
+        given frames, by default all of them. """
+        if frames is None:
+            frames = np.arange(self.num_frames)
+        keyframes, positions = self._keyframes(instance)
+        frames = np.asarray(frames)
+        return np.stack([np.interp(frames, keyframes, positions[:, axis])
+                         for axis in range(3)], axis=-1)
+
+    def at(self, instance, frame):
+        """ Location of the object at one frame. """
+        return self.get(instance, [frame])[0]
+
+    def get_segments(self, instance):
+        """ List of (start frame, end frame, segment type) of the object. """
+        i = self._instance_ids[instance]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [(int(self.frames[j]), int(self.frames[j + 1]),
+                 SEGMENT_TYPES[self.segments[j]])
+                for j in range(start, end - 1)]
+
+    def get_locations(self, instance):
+        """ The locations in the format of the scene JSON (frame number as
+        string to [x, y, z]). """
+        return {str(frame): location.tolist()
+                for frame, location in enumerate(self.get(instance))}
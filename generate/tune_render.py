@@ -0,0 +1,192 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import os.path as osp
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import metrics_report
+from gen_utils import mkdir_p
+
+"""
+Benchmark the render settings (samples, bounces, tile size) against quality.
+A fixed set of reference scenes is planned once and rendered with high
+quality settings. The same scenes (loaded from their BLEND files) are then
+rendered with every setting of the grid, and each setting is scored by its
+seconds per frame and its PSNR to the reference images. The cheapest setting
+above --min_psnr is recommended.
+
+python tune_render.py --output_dir Out/tune
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Find the cheapest render settings for a given quality')
+    parser.add_argument(
+        '--output_dir', default='Out/tune',
+        help='Where the reference and benchmark renders are stored')
+    parser.add_argument(
+        '--blender', default='/opt/blender-2.79/blender',
+        help='Path to the blender binary')
+    parser.add_argument(
+        '--num_scenes', default=3, type=int,
+        help='Number of reference scenes')
+    parser.add_argument(
+        '--num_frames', default=90, type=int,
+        help='Number of frames of the planned scenes')
+    parser.add_argument(
+        '--frame_step', default=15, type=int,
+        help='Render only every n-th frame of each scene')
+    parser.add_argument(
+        '--samples', default='16,32,64,128',
+        help='Comma separated --render_num_samples values to try')
+    parser.add_argument(
+        '--bounces', default='1,2,4',
+        help='Comma separated bounce values to try (used for both '
+             '--render_min_bounces and --render_max_bounces)')
+    parser.add_argument(
+        '--tile_sizes', default='64,256',
+        help='Comma separated --render_tile_size values to try')
+    parser.add_argument(
+        '--reference_samples', default=1024, type=int,
+        help='Samples for the reference renders')
+    parser.add_argument(
+        '--reference_bounces', default=8, type=int,
+        help='Bounces for the reference renders')
+    parser.add_argument(
+        '--min_psnr', default=35.0, type=float,
+        help='Minimum PSNR (in dB) to the reference for a setting to be '
+             'acceptable')
+    parser.add_argument(
+        '--cpu', action='store_true',
+        help='Benchmark CPU rendering instead of the GPU')
+    return parser.parse_args()
+
+
+def parse_int_list(value):
+    return [int(el) for el in value.split(',') if el]
+
+
+def render(args, output_dir, samples, bounces, tile_size):
+    """ Render the reference scenes into output_dir, return secs/frame. """
+    metrics_fpath = osp.join(output_dir, 'metrics.jsonl')
+    if not osp.exists(metrics_fpath):
+        cmd = (
+            f'{args.blender} data/base_scene.blend '
+            f'--background --python render_videos.py -- '
+            f'--num_images {args.num_scenes} '
+            f'--num_frames {args.num_frames} '
+            f'--frame_step {args.frame_step} '
+            f'--output_format PNG '
+            f'--save_blendfiles 1 '
+            f'--suppress_blender_logs '
+            f'--filename_prefix TUNE '
+            f'--output_dir {output_dir} '
+            f'--output_scene_file {output_dir}/scene.json '
+            f'--render_num_samples {samples} '
+            f'--render_min_bounces {bounces} '
+            f'--render_max_bounces {bounces} '
+            f'--render_tile_size {tile_size} '
+            f'{"--cpu" if args.cpu else ""}')
+        print(f'Running {cmd}')
+        subprocess.check_call(cmd, shell=True)
+    render_seconds, frames = 0.0, 0
+    for metrics in metrics_report.read_metrics([metrics_fpath]):
+        if metrics['status'] != 'ok':
+            continue
+        render_seconds += metrics['stages'].get('render', 0.0)
+        frames += metrics['counters'].get('frames_rendered', 0)
+    assert frames > 0, f'Nothing was rendered in {output_dir}'
+    return render_seconds / frames
+
+
+def read_frames(image_dir):
+    return OrderedDict(
+        (osp.basename(fpath), fpath)
+        for fpath in sorted(glob.glob(osp.join(image_dir, '*.png'))))
+
+
+def psnr(ref_frames, frames):
+    """ PSNR over all frames, in dB. """
+    squared_error, num_values = 0.0, 0
+    for fname, ref_fpath in ref_frames.items():
+        ref = np.asarray(Image.open(ref_fpath).convert('RGB'), np.float64)
+        img = np.asarray(Image.open(frames[fname]).convert('RGB'), np.float64)
+        squared_error += ((ref - img) ** 2).sum()
+        num_values += ref.size
+    mse = squared_error / num_values
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    args = parse_args()
+    mkdir_p(args.output_dir)
+    ref_dir = osp.join(args.output_dir, 'reference')
+    mkdir_p(ref_dir)
+    # Plans the scenes, and stores their BLEND files for the other renders
+    ref_sec_per_frame = render(
+        args, ref_dir, args.reference_samples, args.reference_bounces,
+        parse_int_list(args.tile_sizes)[-1])
+    ref_frames = read_frames(osp.join(ref_dir, 'images'))
+    print(f'Reference: {ref_sec_per_frame:.3f} s/frame, '
+          f'{len(ref_frames)} frames')
+
+    results = []
+    for samples, bounces, tile_size in itertools.product(
+            parse_int_list(args.samples), parse_int_list(args.bounces),
+            parse_int_list(args.tile_sizes)):
+        output_dir = osp.join(
+            args.output_dir, f's{samples}_b{bounces}_t{tile_size}')
+        mkdir_p(output_dir)
+        blend_dir = osp.join(output_dir, 'blend')
+        if not osp.exists(blend_dir):
+            # Render the same scenes as the reference
+            os.symlink(osp.abspath(osp.join(ref_dir, 'blend')), blend_dir)
+        sec_per_frame = render(args, output_dir, samples, bounces, tile_size)
+        quality = psnr(ref_frames, read_frames(osp.join(output_dir, 'images')))
+        results.append(OrderedDict([
+            ('samples', samples),
+            ('bounces', bounces),
+            ('tile_size', tile_size),
+            ('sec_per_frame', sec_per_frame),
+            ('psnr', quality),
+        ]))
+        print('samples {samples:5d} bounces {bounces:2d} tile {tile_size:4d}: '
+              '{sec_per_frame:.3f} s/frame, PSNR {psnr:.2f} dB'.format(
+                  **results[-1]))
+
+    good = [el for el in results if el['psnr'] >= args.min_psnr]
+    recommended = min(good, key=lambda el: el['sec_per_frame']) \
+        if good else None
+    with open(osp.join(args.output_dir, 'results.json'), 'w') as fout:
+        json.dump({
+            'reference': {
+                'samples': args.reference_samples,
+                'bounces': args.reference_bounces,
+                'sec_per_frame': ref_sec_per_frame,
+            },
+            'min_psnr': args.min_psnr,
+            'results': results,
+            'recommended': recommended,
+        }, fout, indent=2)
+    if recommended is None:
+        print(f'No setting reaches {args.min_psnr} dB PSNR')
+    else:
+        print(f'Recommended: --render_num_samples {recommended["samples"]} '
+              f'--render_min_bounces {recommended["bounces"]} '
+              f'--render_max_bounces {recommended["bounces"]} '
+              f'--render_tile_size {recommended["tile_size"]} '
+              f'({recommended["sec_per_frame"]:.3f} s/frame, '
+              f'{recommended["psnr"]:.2f} dB)')
+
+
+if __name__ == '__main__':
+    main()
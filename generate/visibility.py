@@ -0,0 +1,105 @@
+import numpy as np
+
+
+"""
+Geometric estimate of how visible each object is at each frame, without
+rendering. The footprint of an object is the ellipse inscribed in its
+projected bounding box (see projection.annotate), rasterized on a grid
+DOWNSAMPLE times coarser than the frames. At every frame the footprints are
+sorted by depth, and the visible pixels of an object are the pixels of its
+footprint not covered by a nearer one. render_videos.py uses it to plan a
+scene again when an object is hidden (--min_pixels_per_object) before
+rendering it, and stores the estimate in the scene JSON ('visibility').
+"""
+
+DOWNSAMPLE = 4
+# Frames rasterized at once, to bound the memory of the footprints
+CHUNK_FRAMES = 32
+NO_OP = '_no_op'
+
+
+def footprints(boxes, width, height, downsample=DOWNSAMPLE):
+    """ (..., grid height, grid width) masks of the ellipses inscribed in the
+    (..., 4) boxes. """
+    xs = (np.arange(width // downsample) + 0.5) * downsample
+    ys = (np.arange(height // downsample) + 0.5) * downsample
+    center = (boxes[..., :2] + boxes[..., 2:]) / 2
+    radius = np.maximum((boxes[..., 2:] - boxes[..., :2]) / 2, 1e-6)
+    dx = (xs - center[..., 0:1]) / radius[..., 0:1]
+    dy = (ys - center[..., 1:2]) / radius[..., 1:2]
+    return (dy[..., :, np.newaxis] ** 2 + dx[..., np.newaxis, :] ** 2) <= 1
+
+
+def visible_pixels(annotations, width, height, downsample=DOWNSAMPLE,
+                   chunk_frames=CHUNK_FRAMES):
+    """ (num objects, num frames) estimated visible pixels of each object,
+    from the output of projection.annotate. """
+    boxes, depth = annotations['boxes'], annotations['depth']
+    num_objects, num_frames = depth.shape
+    visible = np.zeros((num_objects, num_frames), dtype=np.int64)
+    for start in range(0, num_frames, chunk_frames):
+        end = min(start + chunk_frames, num_frames)
+        masks = footprints(boxes[:, start:end], width, height, downsample)
+        # Objects behind the camera are not seen
+        masks &= (depth[:, start:end] > 0)[..., np.newaxis, np.newaxis]
+        # Nearest object first, at each frame
+        order = np.argsort(depth[:, start:end], axis=0)
+        frames = np.arange(end - start)[np.newaxis]
+        masks = masks[order, frames]
+        covered = np.logical_or.accumulate(masks, axis=0)
+        masks[1:] &= ~covered[:-1]
+        visible[order, frames + start] = masks.sum(axis=(2, 3))
+    return visible * downsample ** 2
+
+
+def get_contained(scene, num_frames):
+    """ (num objects, num frames) True where an object is inside a cone, and
+    so hidden on purpose. Follows MovementRecord: a cone holds what it
+    contained from the start of the _contain until the end of its next
+    _pick_place. """
+    names = [obj['instance'] for obj in scene['objects']]
+    contains = {name: [None] * num_frames for name in names}
+    for name, moves in scene['movements'].items():
+        for action, other, start, end in sorted(
+                moves, key=lambda el: el[2]):
+            if action == '_contain':
+                contains[name][start:] = [other] * (num_frames - start)
+            elif action == '_pick_place':
+                contains[name][end:] = [None] * max(num_frames - end, 0)
+    contained = np.zeros((len(names), num_frames), dtype=bool)
+    for i, name in enumerate(names):
+        for frame in range(num_frames):
+            # Whatever is held by a held object is hidden as well
+            inner = contains[name][frame]
+            while inner is not None and inner in contains:
+                contained[names.index(inner), frame] = True
+                inner = contains[inner][frame]
+    return contained
+
+
+def check(scene, visible, min_pixels):
+    """
+    Problems with the visibility of a planned scene, as a list of strings
+    (empty if none): an object with less than min_pixels visible pixels in
+    the first frame, or in the median frame of one of its actions (except
+    while it is inside a cone).
+    """
+    problems = []
+    contained = get_contained(scene, visible.shape[1])
+    for i, obj in enumerate(scene['objects']):
+        name = obj['instance']
+        if visible[i, 0] < min_pixels:
+            problems.append('{} at frame 0 ({} px)'.format(
+                name, visible[i, 0]))
+        for action, _, start, end in scene['movements'].get(name, []):
+            if action == NO_OP:
+                continue
+            frames = np.arange(start, min(end, visible.shape[1] - 1) + 1)
+            frames = frames[~contained[i, frames]]
+            if len(frames) == 0:
+                continue
+            pixels = np.median(visible[i, frames])
+            if pixels < min_pixels:
+                problems.append('{} during {} at {}-{} ({} px)'.format(
+                    name, action, start, end, int(pixels)))
+    return problems